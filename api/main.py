@@ -1,34 +1,170 @@
 """Moonhub API
 Start the proxy server using uvicorn to run FastAPI
+The server processes (one or more workers) share one listening socket and are
+kept alive by a small supervisor, which replaces the workers that exit. Workers
+are spawned (not forked) and import the app themselves, so their database /
+redis connections are opened by the app's lifespans, inside each worker.
 """
+import asyncio
 import os
-from time import sleep
+import random
+import signal
+import threading
+import time
+from functools import partial
+from multiprocessing.context import SpawnProcess
+from socket import socket
+from types import FrameType
+
 from loguru import logger
-from uvicorn import Server, Config
-from src.common.logging import init_logging, sink_serializer
+from uvicorn import Config, Server
+from uvicorn._subprocess import get_subprocess
 
 # load our config
 # from src.common.config import Settings # pylint: disable=C0413,E0401
 from src.common.config import settings
+from src.common.lifespans import in_flight
+from src.common.logging import init_logging, log_sink
 
 # remove default logging and setup our custom sink serializer
+# (runs again in every worker, they import this module when spawned)
 logger.remove()
-logger.add(sink_serializer, level=settings.log_level)
+logger.add(log_sink, level=settings.log_level)
 
-# kick off the server
-if __name__ == "__main__":
-    server = Server(
-        Config(
-            "src.entry:app",
-            host=settings.listen_address,
-            port=settings.port,
-            reload=settings.reload,
-        )
+# a worker exiting with an error sooner than this is not restarted
+MIN_WORKER_UPTIME = 5.0
+
+
+def server_config(workers: int) -> Config:
+    # with reload the server runs in this process, nothing would replace it
+    # once it stops after limit_max_requests
+    limit_max_requests = None if settings.reload else settings.limit_max_requests
+    return Config(
+        "src.entry:app",
+        host=settings.listen_address,
+        port=settings.port,
+        reload=settings.reload,
+        workers=workers,
+        loop=settings.loop,
+        http=settings.http,
+        backlog=settings.backlog,
+        timeout_keep_alive=settings.timeout_keep_alive,
+        limit_concurrency=settings.limit_concurrency,
+        limit_max_requests=limit_max_requests,
+        timeout_graceful_shutdown=settings.timeout_graceful_shutdown,
     )
 
+
+class DrainingServer(Server):
+    """Drains before uvicorn stops listening: on the first signal readiness
+    turns 503 and the broker stops consuming, the server keeps serving for
+    shutdown_drain_delay and until the work in flight is done, then shuts
+    down as usual. Another signal skips the rest of the drain."""
+
+    draining: asyncio.Task[None] | None = None
+
+    def handle_exit(self, sig: int, frame: FrameType | None) -> None:
+        if self.draining is not None or self.should_exit:
+            super().handle_exit(sig, frame)
+            return
+
+        self.draining = asyncio.ensure_future(self.drain(sig, frame))
+
+    async def drain(self, sig: int, frame: FrameType | None) -> None:
+        in_flight.start_draining()
+        try:
+            await asyncio.sleep(settings.shutdown_drain_delay)
+            await in_flight.wait_idle(settings.shutdown_drain_timeout)
+        finally:
+            super().handle_exit(sig, frame)
+
+
+def serve(config: Config, sockets: list[socket] | None = None) -> None:
+    """Runs a server, in this process or in a worker"""
+    if config.limit_max_requests and settings.limit_max_requests_jitter:
+        config.limit_max_requests += random.randint(
+            0, settings.limit_max_requests_jitter
+        )
+
     # setup logging last, to make sure no library overwrites it
     # (they shouldn't, but it happens)
     init_logging()
 
     # run the server
-    server.run()
+    DrainingServer(config).run(sockets=sockets)
+
+
+class Supervisor:
+    """Keeps `workers` server processes running on one shared socket, workers
+    that exit (e.g. after limit_max_requests) are replaced until shutdown"""
+
+    def __init__(self, config: Config, workers: int) -> None:
+        self.config = config
+        self.workers = workers
+        self.processes: list[tuple[SpawnProcess, float]] = []
+        self.should_exit = threading.Event()
+        self.failed = False
+
+    def start_worker(self, sock: socket) -> tuple[SpawnProcess, float]:
+        process = get_subprocess(
+            self.config, target=partial(serve, self.config), sockets=[sock]
+        )
+        process.start()
+        return process, time.monotonic()
+
+    def shutdown(self, sig: int, frame: FrameType | None) -> None:
+        self.should_exit.set()
+
+    def run(self) -> None:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.shutdown)
+
+        sock = self.config.bind_socket()
+        self.processes = [self.start_worker(sock) for _ in range(self.workers)]
+        logger.info(f"Started {self.workers} workers on port {self.config.port}")
+
+        while not self.should_exit.wait(0.5):
+            for index, (process, started) in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+
+                uptime = time.monotonic() - started
+                if process.exitcode and uptime < MIN_WORKER_UPTIME:
+                    # most likely failing on startup, restarting won't help
+                    logger.error(
+                        f"Worker {process.pid} failed after {uptime:.1f}s "
+                        f"(exit code {process.exitcode}), stopping"
+                    )
+                    self.failed = True
+                    self.should_exit.set()
+                    break
+
+                logger.info(
+                    f"Worker {process.pid} exited (exit code {process.exitcode}), "
+                    "starting a new one"
+                )
+                self.processes[index] = self.start_worker(sock)
+
+        # workers shut down gracefully on SIGTERM
+        for process, _ in self.processes:
+            process.terminate()
+        for process, _ in self.processes:
+            process.join()
+        sock.close()
+
+
+# kick off the server
+if __name__ == "__main__":
+    if settings.reload:
+        serve(server_config(1))
+    else:
+        # also for a single worker, it is replaced after limit_max_requests
+        workers = settings.workers or os.cpu_count() or 1
+        supervisor = Supervisor(server_config(workers), workers)
+        try:
+            supervisor.run()
+        finally:
+            # the supervisor's own records, the workers drain theirs
+            log_sink.close()
+        if supervisor.failed:
+            raise SystemExit(1)
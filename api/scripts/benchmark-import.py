@@ -0,0 +1,252 @@
+"""
+Ingestion benchmark: the person importer against in-memory sinks.
+
+    python benchmark-import.py [source.jsonl] [--count 5000] [--batch-size 500]
+
+Without a source, synthetic profiles from profiles.py are generated first. The
+graph driver only records the statements it is given, embeddings come from
+FakeEmbedder and end up in a NullSink, so the numbers are the importer's own
+cost (parsing, transforming, building statements and nodes) and don't depend
+on memgraph, qdrant or TEI being around.
+"""
+import argparse
+import dataclasses
+import importlib.util
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+from types import ModuleType
+
+from profiles import write_profiles
+from tqdm import tqdm
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_importer() -> ModuleType:
+    """import-us-persons.py isn't importable by name, load it from its path"""
+    if "import_us_persons" in sys.modules:
+        return sys.modules["import_us_persons"]
+
+    if SCRIPTS not in sys.path:
+        sys.path.insert(0, SCRIPTS)
+
+    spec = importlib.util.spec_from_file_location(
+        "import_us_persons", os.path.join(SCRIPTS, "import-us-persons.py")
+    )
+    assert spec and spec.loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class _Result:
+    def consume(self) -> None:
+        pass
+
+    def data(self) -> list[dict]:
+        return []
+
+
+class RecordingDriver:
+    """Stands in for the neo4j driver, counts statements instead of running them"""
+
+    def __init__(self) -> None:
+        self.queries: Counter[str] = Counter()
+        self.rows = 0
+        self.transactions = 0
+
+    def __enter__(self) -> "RecordingDriver":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def session(self, **kwargs) -> "RecordingDriver":
+        return self
+
+    def run(self, query: str, rows: list[dict] | None = None, **params) -> _Result:
+        self.queries[query] += 1
+        self.rows += len(rows or [])
+        return _Result()
+
+    def execute_write(self, work, *args, **kwargs):
+        self.transactions += 1
+        return work(self, *args, **kwargs)
+
+    @property
+    def statements(self) -> int:
+        return sum(self.queries.values())
+
+
+class TimedStage:
+    """Adds the CPU time spent in an embedding stage to cpu["embed"]"""
+
+    def __init__(self, stage, cpu: dict[str, float]) -> None:
+        self.stage = stage
+        self.cpu = cpu
+
+    def add(self, documents) -> None:
+        started = time.process_time()
+        self.stage.add(documents)
+        self.cpu["embed"] += time.process_time() - started
+
+    def drain(self) -> None:
+        started = time.process_time()
+        self.stage.drain()
+        self.cpu["embed"] += time.process_time() - started
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    profiles: int
+    failed: int
+    elapsed: float
+    statements: int
+    transactions: int
+    rows: int
+    nodes: int
+    # CPU seconds per stage, embed includes the embedding threads
+    cpu: dict[str, float]
+    peak_rss: int
+
+    @property
+    def profiles_per_second(self) -> float:
+        return self.profiles / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def queries_per_profile(self) -> float:
+        return self.statements / self.profiles if self.profiles else 0.0
+
+    def report(self) -> str:
+        return "\n".join(
+            [
+                f"{self.profiles:,} profiles in {self.elapsed:.2f}s "
+                f"({self.profiles_per_second:,.0f} profiles/s), {self.failed} failed",
+                f"  {self.statements:,} statements in {self.transactions:,} "
+                f"transactions ({self.queries_per_profile:.3f} per profile), "
+                f"{self.rows:,} rows",
+                f"  {self.nodes:,} vector nodes",
+                "  cpu "
+                + " ".join(
+                    f"{stage}={seconds:.2f}s" for stage, seconds in self.cpu.items()
+                ),
+                f"  peak rss {self.peak_rss / 2**20:,.0f}MB",
+            ]
+        )
+
+
+def run_benchmark(
+    source: str,
+    batch_size: int = 500,
+    embed: bool = True,
+    entity_cache_size: int = 500_000,
+) -> BenchmarkResult:
+    """Imports source the way run_sequential does, timing each stage"""
+    importer = load_importer()
+
+    driver = RecordingDriver()
+    cpu = dict.fromkeys(("read", "transform", "write", "embed"), 0.0)
+    sink = importer.NullSink()
+    embeddings = (
+        TimedStage(importer.EmbeddingStage(importer.FakeEmbedder(), sink), cpu)
+        if embed
+        else None
+    )
+    batch = importer.GraphBatch(
+        batch_size=batch_size,
+        entities=importer.EntityCache(entity_cache_size)
+        if entity_cache_size > 0
+        else None,
+    )
+    commits = importer.PendingCommits(None, embeddings)
+    profiles = failed = 0
+
+    def flush():
+        nonlocal profiles, failed
+        started, embedded = time.process_time(), cpu["embed"]
+        failures, _, written = importer.write_changes(driver, batch, None, embeddings)
+        commits.add(written, lambda: None)
+        profiles -= len(failures)
+        failed += len(failures)
+        cpu["write"] += time.process_time() - started - (cpu["embed"] - embedded)
+
+    started = time.perf_counter()
+    lines = importer.read_sources(
+        [source], importer.Checkpoint(source=source), False, tqdm(disable=True)
+    )
+    while True:
+        mark = time.process_time()
+        line = next(lines, None)
+        cpu["read"] += time.process_time() - mark
+        if line is None:
+            break
+
+        mark = time.process_time()
+        try:
+            rows = importer.parse_person(line[2])
+        except Exception:
+            rows = None
+            failed += 1
+        cpu["transform"] += time.process_time() - mark
+
+        if rows is None:
+            continue
+
+        profiles += 1
+        batch.add(rows)
+        if batch.is_full():
+            flush()
+
+    if len(batch) > 0:
+        flush()
+    commits.flush()
+
+    return BenchmarkResult(
+        profiles=profiles,
+        failed=failed,
+        elapsed=time.perf_counter() - started,
+        statements=driver.statements,
+        transactions=driver.transactions,
+        rows=driver.rows,
+        nodes=sink.count,
+        cpu=cpu,
+        # kilobytes on linux
+        peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    )
+
+
+def app():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", nargs="?", help="LinkDB jsonl file")
+    parser.add_argument(
+        "--count", type=int, default=5000, help="synthetic profiles without a source"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--entity-cache-size", type=int, default=500_000)
+    parser.add_argument("--no-embed", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = args.source
+        if not source:
+            source = os.path.join(directory, "profiles.jsonl")
+            write_profiles(source, args.count, args.seed)
+
+        result = run_benchmark(
+            source,
+            batch_size=args.batch_size,
+            embed=not args.no_embed,
+            entity_cache_size=args.entity_cache_size,
+        )
+
+    print(result.report())
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,107 @@
+"""
+Micro-benchmark: compiled SkillMatcher vs. the original per-call list scan.
+
+    python benchmark-skills.py [source.jsonl] [--limit 2000] [--repeat 5]
+
+Descriptions are taken from the experiences / projects of a LinkDB dump when
+one is given, otherwise a small built-in sample is used.
+"""
+import argparse
+import itertools
+import json
+import timeit
+
+from nltk.tokenize import word_tokenize
+from skills import ALLOWED_SKILLS, SKILL_ALIASES, skill_matcher
+
+SAMPLE_DESCRIPTIONS = [
+    "Built and maintained React Native and React applications backed by a "
+    "Node.js / Express.js API, deployed to AWS with Docker and Kubernetes.",
+    "Machine Learning engineer working with Python, Pandas, NumPy, "
+    "Scikit-learn and TensorFlow on Google Cloud.",
+    "Led a team of Java developers building Spring Boot microservices on "
+    "PostgreSQL and Redis, following Agile Methodologies and Scrum.",
+    "Responsible for the day to day operations of the store, managing staff "
+    "schedules, inventory and customer relations.",
+    "Developed embedded firmware in C and C++ for Arduino based sensors, "
+    "scripting builds with Bash and Makefile.",
+]
+
+
+def extract_skills_scan(text: str) -> set[str]:
+    """The original extract_skills: tokenize, then scan the token list per skill"""
+    allowed_skills = list(ALLOWED_SKILLS) + list(SKILL_ALIASES)
+
+    # word tokenize the source
+    tokens = word_tokenize(text.lower())
+
+    # find all the skills
+    skills = set()
+    for skill in allowed_skills:
+        if skill.lower() in tokens:
+            skills.add(skill)
+
+    return skills
+
+
+def load_descriptions(source_file: str, limit: int) -> list[str]:
+    descriptions: list[str] = []
+    with open(source_file) as f_in:
+        for line in f_in:
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            for entry in (data.get("experiences") or []) + (
+                data.get("accomplishment_projects") or []
+            ):
+                if entry.get("description"):
+                    descriptions.append(entry["description"])
+
+            if len(descriptions) >= limit:
+                break
+
+    return descriptions[:limit]
+
+
+def app():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", nargs="?", help="LinkDB jsonl file")
+    parser.add_argument("--limit", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.source:
+        descriptions = load_descriptions(args.source, args.limit)
+    else:
+        descriptions = list(
+            itertools.islice(itertools.cycle(SAMPLE_DESCRIPTIONS), args.limit)
+        )
+
+    characters = sum(len(description) for description in descriptions)
+    print(f"{len(descriptions)} descriptions, {characters:,} characters")
+
+    results = {}
+    for name, extract in (
+        ("list scan", extract_skills_scan),
+        ("compiled", skill_matcher.match),
+    ):
+        best = min(
+            timeit.repeat(
+                lambda extract=extract: [extract(d) for d in descriptions],
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        results[name] = best
+        print(
+            f"  {name:<10} {best * 1000:9.1f}ms "
+            f"{len(descriptions) / best:12,.0f} descriptions/s"
+        )
+
+    print(f"  speedup    {results['list scan'] / results['compiled']:9.1f}x")
+
+
+if __name__ == "__main__":
+    app()
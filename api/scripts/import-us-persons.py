@@ -1,39 +1,65 @@
+import argparse
+import bz2
+import dataclasses
+import functools
+import glob
+import gzip
 import hashlib
+import io
 import json
+import multiprocessing
+import os
+import sqlite3
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from enum import Enum
-from typing import Sequence, Set
+from queue import Empty, Full
+from typing import BinaryIO, Protocol, Set
 
+import httpx
 import qdrant_client
 from llama_index.core import (
     Document,
     Settings,
-    StorageContext,
 )
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode, MetadataMode
 from llama_index.embeddings.text_embeddings_inference import TextEmbeddingsInference
 from llama_index.vector_stores.qdrant import QdrantVectorStore
-from neo4j import Driver, GraphDatabase
-from nltk.tokenize import word_tokenize
+from neo4j import Driver, GraphDatabase, ManagedTransaction
+from neo4j.exceptions import Neo4jError, ServiceUnavailable
 from pydantic import BaseModel, Field
+from skills import skill_matcher
 from slugify import slugify
 from tqdm import tqdm
 
 # the source data is from
 # https://nubela.co/blog/sample-data-for-linkdb/
 
-client = qdrant_client.QdrantClient("http://qdrant:6333")
+QDRANT_URL = "http://qdrant:6333"
+EMBED_MODEL = "BAAI/bge-large-en-v1.5"
+EMBED_URL = "http://192.168.6.2"
 
 Settings.embed_model = TextEmbeddingsInference(
-    model_name="BAAI/bge-large-en-v1.5",  # required for formatting inference text,
+    model_name=EMBED_MODEL,  # required for formatting inference text,
     timeout=60,  # timeout in seconds
     embed_batch_size=10,  # batch size for embedding
-    base_url="http://192.168.6.2",
+    base_url=EMBED_URL,
     query_instruction="为这个句子生成表示以用于检索相关文章：",
 )
 Settings.chunk_size = 500
 Settings.chunk_overlap = 16
 
-vector_store = QdrantVectorStore(client=client, collection_name="people")
-storage_context = StorageContext.from_defaults(vector_store=vector_store)
+
+def qdrant_vector_store() -> QdrantVectorStore:
+    # created on demand (once per process), the constructor already talks to qdrant
+    return QdrantVectorStore(
+        client=qdrant_client.QdrantClient(QDRANT_URL), collection_name="people"
+    )
 
 
 class SkillSourceEnum(str, Enum):
@@ -94,363 +120,227 @@ def hash_string(input_str) -> str:
 
 
 def extract_skills(text: str) -> Set[str]:
-    allowed_skills = [
-        "3D Modeling",
-        "API",
-        "ASP.NET",
-        "AWS",
-        "Active Record",
-        "AdonisJS",
-        "Agile Methodologies",
-        "Ajax",
-        "POLARDDB",
-        "DocumentDB",
-        "DynamoDB",
-        "RDS",
-        "Android",
-        "Angular",
-        "Ant Design",
-        "Cassandra",
-        "Spark",
-        "AppleScript",
-        "Arduino",
-        "Artificial Intelligence",
-        "Assembly",
-        "Azure",
-        "Azure Cosmos DB (API for MongoDB)",
-        "Azure Cosmos DB (Core SQL API)",
-        "Bash",
-        "Beego",
-        "Blazor",
-        "Blockchain Technology",
-        "Bootstrap",
-        "Bulma",
-        "C",
-        "C#",
-        "C++",
-        "CPP",
-        "CSS",
-        "CakePHP",
-        "Cassandra",
-        "Chakra UI",
-        "ClickHouse",
-        "Cloudera Impala",
-        "CodeIgniter",
-        "Couchbase Server",
-        "Crystal",
-        "Cybersecurity",
-        "Dart",
-        "Data Analysis",
-        "DataStax Astra DB",
-        "Deno",
-        "DevOps",
-        "Django",
-        "Docker",
-        "Dockerfile",
-        "Druid",
-        "Echo",
-        "Elasticsearch",
-        "Element Plus",
-        "Elm",
-        "Emacs Lisp",
-        "Erlang",
-        "Express.js",
-        "F#",
-        "Facebook Presto",
-        "FastAPI",
-        "FeathersJS",
-        "Firebase",
-        "Firebird",
-        "Flask",
-        "Flutter",
-        "Fortran",
-        "Foundation",
-        "Frameworx",
-        "Game Development",
-        "GameMaker Language",
-        "Gin",
-        "Git",
-        "GitHub",
-        "Glsl",
-        "Go",
-        "Golang",
-        "Firestore",
-        "Google Cloud",
-        "GraphQL",
-        "Graphic Design",
-        "Greenplum",
-        "H2 Database",
-        "HBase",
-        "HDFS",
-        "HTML",
-        "Hadoop",
-        "Haml",
-        "Handlebars.js",
-        "Harbor",
-        "Haskell",
-        "Hazelcast",
-        "HeadlessUI",
-        "Hyperledger",
-        "Db2",
-        "InfluxDB",
-        "Inform7",
-        "Information Security",
-        "Ionic Framework",
-        "Java",
-        "JavaScript",
-        "JeffersonDB",
-        "Julia",
-        "Kafka",
-        "KairosDB",
-        "Kendo UI",
-        "Keycloak",
-        "Knox",
-        "Kohana",
-        "Kotlin",
-        "Kubernetes",
-        "LaTeX",
-        "Laravel",
-        "Less",
-        "LevelDB",
-        "LiteSpeed",
-        "Lua",
-        "LuaJIT",
-        "Lumen",
-        "MATLAB",
-        "Machine Learning",
-        "Makefile",
-        "Mapbox GL JS",
-        "MariaDB",
-        "Markdown",
-        "Material UI",
-        "Materialize CSS",
-        "Matplotlib",
-        "Memcached",
-        "Mermaid",
-        "Microsoft SQL Server",
-        "MSSQL",
-        "MongoDB",
-        "Mongoose",
-        "MySQL",
-        "NGINX",
-        "NativeScript",
-        "Neo4j",
-        "Network Security",
-        "NewSQL",
-        "Next.js",
-        "Nim",
-        "Node.js",
-        "NumPy",
-        "NuoDB",
-        "Nuxt.js",
-        "OCaml",
-        "ORM",
-        "Objective-C",
-        "OceanBase",
-        "Onsen UI",
-        "OpenCV",
-        "OpenSearch",
-        "Opentelemetry",
-        "Oracle",
-        "OracleDB",
-        "PHP",
-        "Pandas",
-        "Penetration Testing",
-        "Percona",
-        "Perl",
-        "Phabricator",
-        "PhoneGap",
-        "PlainText",
-        "PlanetScale",
-        "PostgreSQL",
-        "PowerShell",
-        "Preact",
-        "Prisma",
-        "Processing",
-        "Prometheus",
-        "Protobuf",
-        "Proxysql",
-        "Puppet",
-        "PureBasic",
-        "Python",
-        "QML",
-        "Quest",
-        "R",
-        "Racket",
-        "Radix",
-        "Rails",
-        "React",
-        "React Native",
-        "Redis",
-        "Redshift",
-        "Remix",
-        "RethinkDB",
-        "Riak",
-        "RoachDB",
-        "RobotFramework",
-        "Rpkg",
-        "Ruby",
-        "Rust",
-        "SQL",
-        "SQLite",
-        "Sanic",
-        "Sapientia",
-        "Sass",
-        "Scala",
-        "Scheme",
-        "Scikit-learn",
-        "Scrum",
-        "ScyllaDB",
-        "Selenium",
-        "Sencha Touch",
-        "Sequelize",
-        "Shaders",
-        "Shell",
-        "Sidekiq",
-        "SignalR",
-        "Snowflake",
-        "Socket.io",
-        "SocketCluster",
-        "Solidity",
-        "Spanner",
-        "Spring Boot",
-        "Supabase",
-        "Svelte",
-        "Swift",
-        "Sybase",
-        "Symfony",
-        "Tailwind",
-        "Tailwind CSS",
-        "Tcl",
-        "TensorFlow",
-        "Texinfo",
-        "Themeross",
-        "Thrift",
-        "TiDB",
-        "TimescaleDB",
-        "TinyDB",
-        "TokuMX",
-        "Traefik",
-        "TrueNAS",
-        "Twig",
-        "TypeDocs",
-        "TypeORM",
-        "TypeScript",
-        "Unity",
-        "Unreal Engine",
-        "UnrealScript",
-        "Upside",
-        "VBScript",
-        "VHDL",
-        "Vala",
-        "Vant",
-        "Verilog",
-        "Vite",
-        "Visual Basic .NET",
-        "VoltDB",
-        "Vue",
-        "Vue.js",
-        "Vuetify",
-        "VMware",
-        "WebAssembly",
-        "Websockets",
-        "Wren",
-        "Xamarin",
-        "YAML",
-        "Yii Framework",
-        "ZooKeeper",
-        "jQuery",
-    ]
-
-    # word tokenize the source
-    tokens = word_tokenize(text.lower())
+    """Returns the ids of the skills mentioned in text, see skills.SkillMatcher"""
+    return skill_matcher.match(text)
+
+
+def _date_parts(value) -> dict | None:
+    """Returns a {year, month, day} map when all three parts are present"""
+    if value and "year" in value and "month" in value and "day" in value:
+        return {"year": value["year"], "month": value["month"], "day": value["day"]}
+
+    return None
+
+
+def _optional(data: dict, key: str):
+    """Returns the value for key when it is present and truthy, otherwise None"""
+    return data[key] if key in data and data[key] else None
+
+
+# the parts of a profile that are hashed (and rewritten) independently
+SECTIONS = ("person", "experiences", "languages", "education", "skills")
+
+
+@dataclasses.dataclass
+class PersonRows:
+    """Graph rows (and documents) extracted from a single profile"""
+
+    person: dict
+    experiences: list[dict] = dataclasses.field(default_factory=list)
+    languages: list[dict] = dataclasses.field(default_factory=list)
+    education: list[dict] = dataclasses.field(default_factory=list)
+    skills: list[dict] = dataclasses.field(default_factory=list)
+    documents: list[Document] = dataclasses.field(default_factory=list)
+
+    # change detection, see hash_sections / keep_changed
+    content_hash: str = ""
+    hashes: dict[str, str] = dataclasses.field(default_factory=dict)
+    prune: set[str] = dataclasses.field(default_factory=set)
+
+    # where the profile came from, used for dead letters
+    line: bytes = b""
+    source: str = ""
+    offset: int = 0
+
+    def hash_sections(self) -> None:
+        """Stable hash per section (and of the whole profile) over the rows that
+        end up in the graph, so a transform change also counts as a change
+        """
+        self.hashes = {
+            name: hash_string(json.dumps(getattr(self, name), sort_keys=True))
+            for name in SECTIONS
+        }
+        self.content_hash = hash_string(
+            ":".join(self.hashes[name] for name in SECTIONS)
+        )
+
+    def keep_changed(self, previous: dict[str, str]) -> None:
+        """Drops the rows of sections that match the previous import, changed
+        sections are pruned of relationships that are no longer in the profile
+        """
+        for name in SECTIONS[1:]:
+            if previous.get(name) == self.hashes[name]:
+                setattr(self, name, [])
+            else:
+                self.prune.add(name)
+
+
+def transform_person(data: dict) -> PersonRows:
+    """Maps a LinkDB profile into the rows written by GraphBatch.flush"""
+    # start our document
+    p_id = data["public_identifier"]
+    if p_id.lower().strip() == "none":
+        p_id = data["profile_pic_url"]
+    else:
+        p_id = f"https://www.linkedin.com/in/{p_id}"
+
+    # hash the id
+    id = hash_string(p_id)
+
+    # person
+    rows = PersonRows(
+        person={
+            "id": id,
+            "first_name": data["first_name"],
+            "last_name": data["last_name"],
+            "full_name": data["full_name"],
+            "profile_pic_url": data["profile_pic_url"],
+            "occupation": data["occupation"],
+            "headline": data["headline"],
+            "url": p_id,
+            "connections": data["connections"]
+            if "connections" in data and isinstance(data["connections"], int)
+            else None,
+        }
+    )
 
-    # find all the skills
-    skills = set()
-    for skill in allowed_skills:
-        if skill.lower() in tokens:
-            skills.add(skill)
+    # a person has a set of skills
+    skills = set[str]()
+
+    # add our person to the index
+    rows.documents.append(
+        Document(
+            doc_id=id,
+            text=f"""
+        Name:
+        {data['full_name']}
+
+        Occupation:
+        {data['occupation']}
+
+        Headline:
+        {data['headline']}
+
+        Location:
+        {data['city']}, {data['state']}, {data['country']}
+        """,
+            metadata={
+                "person_id": id,
+                "kind": "experience",
+            },
+            excluded_embed_metadata_keys=["kind", "person_id"],
+            excluded_llm_metadata_keys=["kind", "person_id"],
+        )
+    )
 
-    return skills
+    # experience(s)
+    if "experiences" in data and data["experiences"] and len(data["experiences"]) > 0:
+        for experience in data["experiences"]:
+            c_id = experience["company_linkedin_profile_url"]
+            if not c_id or c_id.lower().strip() == "none":
+                c_id = experience["company"]
+
+            # location is used in multiple places
+            location = (
+                experience["location"]
+                if "location" in experience and experience["location"]
+                else "UNKNOWN"
+            )
 
+            starts_at = (
+                experience["starts_at"]
+                if "starts_at" in experience and experience["starts_at"]
+                else None
+            )
+            e_id = ":".join(
+                [
+                    str(starts_at["year"]) if starts_at else "",
+                    str(starts_at["month"]) if starts_at else "",
+                    str(starts_at["day"]) if starts_at else "",
+                    experience["company"],
+                    experience["title"]
+                    if "title" in experience and experience["title"]
+                    else "",
+                ]
+            )
 
-def process_person(client: Driver, line: str):
-    documents: Sequence[Document] = []
+            l_id = slugify(location)
+            lp_id = ":".join(
+                [
+                    location,
+                    experience["company"],
+                    p_id,
+                ]
+            )
 
-    try:
-        # read the json object
-        data = json.loads(line)
-        if not data:
-            return
-
-        # create a session
-        # with client.session(database="memgraph") as session:
-        #     tx = session.begin_transaction()
-
-        #     try:
-        #         if not is_enough_token(tx, sender_id, num_of_tokens):
-        #             print("Not enough tokens in the account balance.")
-        #             return
-        #         try:
-        #             decrease_sender_balance(tx, sender_id, num_of_tokens)
-        #             increase_receiver_balance(tx, receiver_id, num_of_tokens)
-        #             tx.commit()  # both should be committed or none
-        #         except Exception as e:
-        #             raise e  # if exception happened roll back both
-        #     finally:
-        #         tx.close()  # rolls back if not yet committed
-        try:
-            # start our document
-            p_id = data["public_identifier"]
-            if p_id.lower().strip() == "none":
-                p_id = data["profile_pic_url"]
+            # hash the ids
+            c_id = hash_string(c_id)
+            e_id = hash_string(e_id)
+            l_id = hash_string(l_id)
+            lp_id = hash_string(lp_id)
+
+            # do we have a start / end date?
+            starts = _date_parts(experience.get("starts_at"))
+            ends = _date_parts(experience.get("ends_at"))
+
+            document: list[str] = []
+            document.append(f"\t* Company: {experience['company']}")
+            document.append(f"\t\t* Title: {experience['title']}")
+            if starts:
+                document.append(
+                    f"\t\t* Started: {starts['year']}-{starts['month']}-{starts['day']}"
+                )
+            if ends:
+                document.append(
+                    f"\t\t* Ended: {ends['year']}-{ends['month']}-{ends['day']}"
+                )
             else:
-                p_id = f"https://www.linkedin.com/in/{p_id}"
-
-            # hash the id
-            id = hash_string(p_id)
-
-            # person
-            client.execute_query(
-                """
-                MERGE (p:Person {id: $id})
-                    ON CREATE SET p.first_name = $first_name, p.last_name = $last_name,
-                        p.full_name = $full_name, p.profile_pic_url = $profile_pic_url,
-                        p.occupation = $occupation, p.headline = $headline, p.connections = $connections, p.url = $url
-                """,
-                id=id,
-                first_name=data["first_name"],
-                last_name=data["last_name"],
-                full_name=data["full_name"],
-                profile_pic_url=data["profile_pic_url"],
-                occupation=data["occupation"],
-                headline=data["headline"],
-                url=p_id,
-                connections=data["connections"]
-                if "connections" in data and isinstance(data["connections"], int)
-                else None,
+                document.append("\t\t* Current / Present Job")
+
+            if "description" in experience and experience["description"]:
+                document.append(f"\t\t* Description: {experience['description']}")
+
+            rows.experiences.append(
+                {
+                    # person
+                    "p_id": id,
+                    # company
+                    "c_id": c_id,
+                    "company": experience["company"].strip(),
+                    "e_id": e_id,
+                    # location
+                    "l_id": l_id,
+                    "location": location,
+                    "lp_id": lp_id,
+                    # optionals
+                    "url": experience["company_linkedin_profile_url"]
+                    if "company_linkedin_profile_url" in experience
+                    else None,
+                    "logo": experience["logo_url"]
+                    if "logo_url" in experience
+                    else None,
+                    "title": _optional(experience, "title"),
+                    "description": _optional(experience, "description"),
+                    "starts": starts,
+                    "ends": ends,
+                }
             )
 
-            # a person has a set of skills
-            skills = set[str]()
-
             # add our person to the index
-            documents.append(
+            rows.documents.append(
                 Document(
-                    doc_id=id,
-                    text=f"""
-                Name:
-                {data['full_name']}
-
-                Occupation:
-                {data['occupation']}
-
-                Headline:
-                {data['headline']}
-
-                Location:
-                {data['city']}, {data['state']}, {data['country']}
-                """,
+                    doc_id=e_id,
+                    text="\n".join(document),
                     metadata={
                         "person_id": id,
                         "kind": "experience",
@@ -460,386 +350,1669 @@ def process_person(client: Driver, line: str):
                 )
             )
 
-            # experience(s)
-            if (
-                "experiences" in data
-                and data["experiences"]
-                and len(data["experiences"]) > 0
-            ):
-                for experience in data["experiences"]:
-                    c_id = experience["company_linkedin_profile_url"]
-                    if not c_id or c_id.lower().strip() == "none":
-                        c_id = experience["company"]
-
-                    # location is used in multiple places
-                    location = (
-                        experience["location"]
-                        if "location" in experience and experience["location"]
-                        else "UNKNOWN"
-                    )
+            # extract skills from the description
+            if "description" in experience and experience["description"]:
+                skills.update(extract_skills(experience["description"]))
+
+    if "languages" in data and data["languages"] and len(data["languages"]) > 0:
+        for language in data["languages"]:
+            if not isinstance(language, str):
+                continue
+
+            rows.languages.append(
+                {
+                    "p_id": id,
+                    "l_id": hash_string(language.strip().lower()),
+                    "name": language,
+                }
+            )
 
-                    e_id = ":".join(
-                        [
-                            str(experience["starts_at"]["year"])
-                            if "starts_at" in experience and experience["starts_at"]
-                            else "",
-                            str(experience["starts_at"]["month"])
-                            if "starts_at" in experience and experience["starts_at"]
-                            else "",
-                            str(experience["starts_at"]["day"])
-                            if "starts_at" in experience and experience["starts_at"]
-                            else "",
-                            experience["company"],
-                            experience["title"]
-                            if "title" in experience and experience["title"]
-                            else "",
-                        ]
-                    )
+    # do we care about education?
+    # it doesn't really help with searching for candidates (other than degree...)
+    if "education" in data and data["education"] and len(data["education"]) > 0:
+        for education in data["education"]:
+            s_id = education["school_linkedin_profile_url"]
+            if not s_id or s_id.lower().strip() == "none":
+                s_id = education["school"]
+
+            starts_at = (
+                education["starts_at"]
+                if "starts_at" in education and education["starts_at"]
+                else None
+            )
+            se_id = ":".join(
+                [
+                    str(starts_at["year"]) if starts_at else "",
+                    str(starts_at["month"]) if starts_at else "",
+                    str(starts_at["day"]) if starts_at else "",
+                    education["school"],
+                    education["degree_name"]
+                    if "degree_name" in education and education["degree_name"]
+                    else "",
+                ]
+            )
 
-                    l_id = slugify(location)
-                    lp_id = ":".join(
+            rows.education.append(
+                {
+                    # person
+                    "p_id": id,
+                    # school
+                    "s_id": hash_string(s_id),
+                    "school": education["school"].strip(),
+                    # relationship
+                    "se_id": hash_string(se_id),
+                    # optionals
+                    "url": education["school_linkedin_profile_url"]
+                    if "school_linkedin_profile_url" in education
+                    else None,
+                    "logo": education["logo_url"] if "logo_url" in education else None,
+                    "degree_name": _optional(education, "degree_name"),
+                    "field_of_study": _optional(education, "field_of_study"),
+                    "description": _optional(education, "description"),
+                    "starts": _date_parts(education.get("starts_at")),
+                    "ends": _date_parts(education.get("ends_at")),
+                }
+            )
+
+    if (
+        "accomplishment_projects" in data
+        and data["accomplishment_projects"]
+        and len(data["accomplishment_projects"]) > 0
+    ):
+        for project in data["accomplishment_projects"]:
+            if "description" in project and project["description"]:
+                skills.update(extract_skills(project["description"]))
+
+    # if we have skills, add them to the graph
+    for s_id in sorted(skills):
+        rows.skills.append(
+            {"p_id": id, "s_id": s_id, "name": skill_matcher.names[s_id]}
+        )
+
+    rows.hash_sections()
+    return rows
+
+
+# each statement writes one entity type for every profile in the batch,
+# dates are optional so they are only set when present (FOREACH over a 0/1 list)
+# unchanged profiles never get here, so the person properties are always set
+PERSON_QUERY = """
+UNWIND $rows AS row
+MERGE (p:Person {id: row.id})
+    SET p.first_name = row.first_name, p.last_name = row.last_name,
+        p.full_name = row.full_name, p.profile_pic_url = row.profile_pic_url,
+        p.occupation = row.occupation, p.headline = row.headline,
+        p.connections = row.connections, p.url = row.url,
+        p.content_hash = row.content_hash
+"""
+
+# shared (dimension) nodes are merged by the pre-pass below, the per-person
+# statements only MATCH them
+EXPERIENCE_QUERY = """
+UNWIND $rows AS row
+MATCH (p:Person {id: row.p_id})
+MATCH (c:Company {id: row.c_id})
+MATCH (l:CompanyLocation {id: row.l_id})
+
+MERGE (p)-[r:WORKS_FOR {id: row.e_id}]->(c)
+SET r.title = row.title, r.description = row.description
+
+MERGE (p)-[a:WORKS_AT]->(l)
+SET a.id = row.lp_id
+
+FOREACH (ends IN CASE WHEN row.ends IS NULL THEN [] ELSE [row.ends] END |
+    SET r.end = date(ends), a.end = date(ends)
+)
+FOREACH (starts IN CASE WHEN row.starts IS NULL THEN [] ELSE [row.starts] END |
+    SET r.start = date(starts), a.start = date(starts)
+)
+"""
+
+LANGUAGE_QUERY = """
+UNWIND $rows AS row
+MATCH (p:Person {id: row.p_id})
+MATCH (l:Language {id: row.l_id})
+MERGE (p)-[r:SPEAKS]->(l)
+"""
+
+EDUCATION_QUERY = """
+UNWIND $rows AS row
+MATCH (p:Person {id: row.p_id})
+MATCH (s:School {id: row.s_id})
+
+MERGE (p)-[r:STUDY_AT {id: row.se_id}]->(s)
+SET r.degree = row.degree_name, r.field = row.field_of_study,
+    r.description = row.description
+
+FOREACH (ends IN CASE WHEN row.ends IS NULL THEN [] ELSE [row.ends] END |
+    SET r.end = date(ends)
+)
+FOREACH (starts IN CASE WHEN row.starts IS NULL THEN [] ELSE [row.starts] END |
+    SET r.start = date(starts)
+)
+"""
+
+SKILL_QUERY = """
+UNWIND $rows AS row
+MATCH (p:Person {id: row.p_id})
+MATCH (s:Skill {id: row.s_id})
+MERGE (p)-[r:HAS_SKILL]->(s)
+"""
+
+COMPANY_QUERY = """
+UNWIND $rows AS row
+MERGE (c:Company {id: row.c_id})
+ON CREATE SET c.name = row.company, c.url = row.url, c.logo = row.logo
+"""
+
+COMPANY_LOCATION_QUERY = """
+UNWIND $rows AS row
+MERGE (l:CompanyLocation {id: row.l_id})
+ON CREATE SET l.name = row.location
+"""
+
+BRANCH_QUERY = """
+UNWIND $rows AS row
+MATCH (c:Company {id: row.c_id})
+MATCH (l:CompanyLocation {id: row.l_id})
+MERGE (c)-[:HAS_BRANCH {id: row.l_id}]->(l)
+"""
+
+LANGUAGE_NODE_QUERY = """
+UNWIND $rows AS row
+MERGE (l:Language {id: row.l_id})
+ON CREATE SET l.name = row.name
+"""
+
+SCHOOL_QUERY = """
+UNWIND $rows AS row
+MERGE (s:School {id: row.s_id})
+ON CREATE SET s.name = row.school, s.url = row.url, s.logo = row.logo
+"""
+
+SKILL_NODE_QUERY = """
+UNWIND $rows AS row
+MERGE (s:Skill {id: row.s_id})
+ON CREATE SET s.name = row.name
+"""
+
+# entity -> (section, row key(s) identifying it, query), in write order so
+# branches find their company and location
+DIMENSIONS = {
+    "Company": ("experiences", ("c_id",), COMPANY_QUERY),
+    "CompanyLocation": ("experiences", ("l_id",), COMPANY_LOCATION_QUERY),
+    "HAS_BRANCH": ("experiences", ("c_id", "l_id"), BRANCH_QUERY),
+    "Language": ("languages", ("l_id",), LANGUAGE_NODE_QUERY),
+    "School": ("education", ("s_id",), SCHOOL_QUERY),
+    "Skill": ("skills", ("s_id",), SKILL_NODE_QUERY),
+}
+
+
+def _prune_query(pattern: str, key: str) -> str:
+    """Deletes the relationships of changed sections that are not in row.ids"""
+    return f"""
+UNWIND $rows AS row
+MATCH (p:Person {{id: row.p_id}}){pattern}
+WHERE NOT {key} IN row.ids
+DELETE r
+"""
+
+
+# section -> (query, row key holding the ids that are still current)
+PRUNE_QUERIES = {
+    "experiences": [
+        (_prune_query("-[r:WORKS_FOR]->()", "r.id"), "e_id"),
+        (_prune_query("-[r:WORKS_AT]->()", "r.id"), "lp_id"),
+    ],
+    "languages": [(_prune_query("-[r:SPEAKS]->(l:Language)", "l.id"), "l_id")],
+    "education": [(_prune_query("-[r:STUDY_AT]->()", "r.id"), "se_id")],
+    "skills": [(_prune_query("-[r:HAS_SKILL]->(s:Skill)", "s.id"), "s_id")],
+}
+
+
+class EntityCache:
+    """Bounded LRU of the dimension nodes (and branches) this process already
+    merged, their rows are left out of the pre-pass until they are evicted
+    """
+
+    def __init__(self, max_size: int = 500_000) -> None:
+        self.max_size = max_size
+        self._keys: OrderedDict[tuple, None] = OrderedDict()
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: tuple) -> bool:
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            self.hits += 1
+            return True
+
+        return False
+
+    def add(self, keys: Iterable[tuple]) -> None:
+        for key in keys:
+            self._keys[key] = None
+            self._keys.move_to_end(key)
+
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+
+class GraphBatch:
+    """Collects rows for up to batch_size profiles and writes them with one
+    UNWIND statement per entity type instead of one round trip per row.
+
+    Shared nodes (companies, skills, ...) are merged once per batch in a
+    separate, short transaction before the people are written, so parallel
+    writers don't all lock e.g. "Google" for the length of their batch.
+    """
+
+    def __init__(self, batch_size: int = 500, entities: EntityCache | None = None):
+        self.batch_size = batch_size
+        self.entities = entities
+        self.clear()
+
+    def clear(self) -> None:
+        self.rows: list[PersonRows] = []
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def is_full(self) -> bool:
+        return len(self.rows) >= self.batch_size
+
+    def add(self, rows: PersonRows) -> None:
+        self.rows.append(rows)
+
+    def _section(self, name: str) -> list[dict]:
+        return [row for rows in self.rows for row in getattr(rows, name)]
+
+    def dimensions(self) -> tuple[list[tuple[str, list[dict]]], list[tuple]]:
+        """(query, rows) pairs for the shared nodes that are not cached yet and
+        their cache keys. Rows are deduplicated and sorted by id so concurrent
+        writers lock them in the same order
+        """
+        statements, keys = [], []
+        for name, (section, columns, query) in DIMENSIONS.items():
+            unseen: dict[tuple, dict] = {}
+            for row in self._section(section):
+                key = (name, *(row[column] for column in columns))
+                if key in unseen or (
+                    self.entities is not None and key in self.entities
+                ):
+                    continue
+                unseen[key] = row
+
+            if unseen:
+                statements.append((query, [unseen[key] for key in sorted(unseen)]))
+                keys += unseen
+
+        return statements, keys
+
+    def statements(self) -> list[tuple[str, list[dict]]]:
+        """(query, rows) pairs in write order, people first so the MATCHes
+        succeed, then stale relationships of changed sections are removed
+        before the current ones are merged
+        """
+        # the hash goes on the written row only, the hashed dict stays as is
+        statements = [
+            (
+                PERSON_QUERY,
+                [
+                    {**rows.person, "content_hash": rows.content_hash}
+                    for rows in self.rows
+                ],
+            )
+        ]
+        for name, queries in PRUNE_QUERIES.items():
+            for query, key in queries:
+                statements.append(
+                    (
+                        query,
                         [
-                            location,
-                            experience["company"],
-                            p_id,
-                        ]
+                            {
+                                "p_id": rows.person["id"],
+                                "ids": [row[key] for row in getattr(rows, name)],
+                            }
+                            for rows in self.rows
+                            if name in rows.prune
+                        ],
                     )
+                )
 
-                    # hash the ids
-                    c_id = hash_string(c_id)
-                    e_id = hash_string(e_id)
-                    l_id = hash_string(l_id)
-                    lp_id = hash_string(lp_id)
-
-                    # do we have an end date?
-                    has_ends_at = (
-                        True
-                        if "ends_at" in experience
-                        and experience["ends_at"]
-                        and "year" in experience["ends_at"]
-                        and "month" in experience["ends_at"]
-                        and "day" in experience["ends_at"]
-                        else False
-                    )
-                    has_starts_at = (
-                        True
-                        if "starts_at" in experience
-                        and experience["starts_at"]
-                        and "year" in experience["starts_at"]
-                        and "month" in experience["starts_at"]
-                        and "day" in experience["starts_at"]
-                        else False
-                    )
+        statements += [
+            (EXPERIENCE_QUERY, self._section("experiences")),
+            (LANGUAGE_QUERY, self._section("languages")),
+            (EDUCATION_QUERY, self._section("education")),
+            (SKILL_QUERY, self._section("skills")),
+        ]
+        return [(query, rows) for query, rows in statements if rows]
+
+    @staticmethod
+    def _write(tx: ManagedTransaction, statements: list[tuple[str, list[dict]]]):
+        for query, rows in statements:
+            tx.run(query, rows=rows).consume()
+
+    def flush(self, client: Driver) -> None:
+        """Writes the shared nodes, then the batch in a single transaction and
+        clears it once committed, transient errors (e.g. a memgraph restart)
+        are retried by the driver
+        """
+        with client.session() as session:
+            dimensions, keys = self.dimensions()
+            if dimensions:
+                session.execute_write(self._write, dimensions)
+                # only remembered once they are committed
+                if self.entities is not None:
+                    self.entities.add(keys)
+
+            session.execute_write(self._write, self.statements())
+
+        self.clear()
+
+
+def parse_person(line: bytes) -> PersonRows | None:
+    """Parses and transforms a single source line, None for empty objects"""
+    # read the json object
+    data = json.loads(line)
+    if not data:
+        return None
+
+    return transform_person(data)
+
+
+def write_batch(client: Driver, batch: GraphBatch) -> list[tuple[PersonRows, str]]:
+    """Flushes batch, when the batch as a whole is rejected every profile is
+    written on its own to isolate the bad ones, which are returned with their
+    error. Losing the database altogether is raised so the run stops at the
+    last checkpoint.
+    """
+    try:
+        batch.flush(client)
+        return []
+    except ServiceUnavailable:
+        raise
+    except Exception as e:
+        print(f"Memgraph: {e}")
 
-                    document: list[str] = []
-                    document.append(f"\t* Company: {experience['company']}")
-                    document.append(f"\t\t* Title: {experience['title']}")
-                    if has_starts_at:
-                        document.append(
-                            f"\t\t* Started: {experience['starts_at']['year']}-{experience['starts_at']['month']}-{experience['starts_at']['day']}"
-                        )
-                    if has_ends_at:
-                        document.append(
-                            f"\t\t* Ended: {experience['ends_at']['year']}-{experience['ends_at']['month']}-{experience['ends_at']['day']}"
-                        )
-                    else:
-                        document.append("\t\t* Current / Present Job")
-
-                    if "description" in experience and experience["description"]:
-                        document.append(
-                            f"\t\t* Description: {experience['description']}"
-                        )
-
-                    client.execute_query(
-                        f"""
-                        MATCH (p:Person {"{id: $p_id}"})
-
-                        MERGE (c:Company {"{id: $c_id}"})
-                        ON CREATE SET c.name = $company, c.url = $url, c.logo = $logo
-
-                        MERGE (l:CompanyLocation {"{id: $l_id}"})
-                        ON CREATE SET l.name = $location
-
-                        MERGE (p)-[r:WORKS_FOR {"{id: $e_id}"}]->(c)
-                        SET r.title = $title, r.description = $description{" , r.end = date({year: $ends_year, month: $ends_month, day: $ends_day})" if has_ends_at else ""}{" , r.start = date({year: $starts_year, month: $starts_month, day: $starts_day})" if has_starts_at else ""}
-
-                        MERGE (p)-[a:WORKS_AT]->(l)
-                        SET a.id = $lp_id{", a.end = date({year: $ends_year, month: $ends_month, day: $ends_day})" if has_ends_at else ""}{", a.start = date({year: $starts_year, month: $starts_month, day: $starts_day})" if has_starts_at else ""}
-
-                        MERGE (c)-[:HAS_BRANCH {"{id: $l_id}"}]->(l)
-                        """,
-                        # person
-                        p_id=id,
-                        # company
-                        c_id=c_id,
-                        company=experience["company"].strip(),
-                        e_id=e_id,
-                        # location
-                        l_id=l_id,
-                        location=location,
-                        lp_id=lp_id,
-                        # optionals
-                        url=experience["company_linkedin_profile_url"]
-                        if "company_linkedin_profile_url" in experience
-                        else None,
-                        logo=experience["logo_url"]
-                        if "logo_url" in experience
-                        else None,
-                        title=experience["title"]
-                        if "title" in experience and experience["title"]
-                        else None,
-                        description=experience["description"]
-                        if "description" in experience and experience["description"]
-                        else None,
-                        ends_year=experience["ends_at"]["year"]
-                        if "ends_at" in experience
-                        and experience["ends_at"]
-                        and "year" in experience["ends_at"]
-                        else None,
-                        ends_month=experience["ends_at"]["month"]
-                        if "ends_at" in experience
-                        and experience["ends_at"]
-                        and "month" in experience["ends_at"]
-                        else None,
-                        ends_day=experience["ends_at"]["day"]
-                        if "ends_at" in experience
-                        and experience["ends_at"]
-                        and "day" in experience["ends_at"]
-                        else None,
-                        starts_year=experience["starts_at"]["year"]
-                        if "starts_at" in experience
-                        and experience["starts_at"]
-                        and "year" in experience["starts_at"]
-                        else None,
-                        starts_month=experience["starts_at"]["month"]
-                        if "starts_at" in experience
-                        and experience["starts_at"]
-                        and "month" in experience["starts_at"]
-                        else None,
-                        starts_day=experience["starts_at"]["day"]
-                        if "starts_at" in experience
-                        and experience["starts_at"]
-                        and "day" in experience["starts_at"]
-                        else None,
-                    )
+    failed: list[tuple[PersonRows, str]] = []
+    single = GraphBatch(batch_size=1, entities=batch.entities)
+    for rows in batch.rows:
+        single.add(rows)
+        try:
+            single.flush(client)
+        except ServiceUnavailable:
+            raise
+        except Exception as e:
+            failed.append((rows, repr(e)))
+            single.clear()
+
+    batch.clear()
+    return failed
+
+
+class DeadLetters:
+    """Append-only JSONL file of source lines that could not be imported, every
+    record keeps the original line so the file can be replayed with --replay
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def add(
+        self, line: bytes, source: str, offset: int, stage: str, error: str
+    ) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+
+        record = {
+            "stage": stage,
+            "error": error,
+            "source": source,
+            "offset": offset,
+            "line": line.decode("utf-8", errors="replace").rstrip("\n"),
+        }
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Embedder(Protocol):
+    """Turns texts into vectors, model names the vector space (cache key)"""
+
+    model: str
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        ...
+
+
+class TEIEmbedder:
+    """Text Embeddings Inference over a single pooled (keep-alive) http client,
+    safe to share between the embedding threads
+    """
+
+    def __init__(
+        self, base_url: str = EMBED_URL, model: str = EMBED_MODEL, retries: int = 3
+    ) -> None:
+        self.model = model
+        self.retries = retries
+        self._client = httpx.Client(base_url=base_url, timeout=60)
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._client.post(
+                    "/embed", json={"inputs": texts, "truncate": True}
+                )
+                response.raise_for_status()
+                return response.json()
+            except httpx.HTTPError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(2**attempt)
 
-                    # add our person to the index
-                    documents.append(
-                        Document(
-                            doc_id=e_id,
-                            text="\n".join(document),
-                            metadata={
-                                "person_id": id,
-                                "kind": "experience",
-                            },
-                            excluded_embed_metadata_keys=["kind", "person_id"],
-                            excluded_llm_metadata_keys=["kind", "person_id"],
-                        )
-                    )
+        raise AssertionError("unreachable")
 
-                    # extract skills from the description
-                    if "description" in experience and experience["description"]:
-                        skills.update(extract_skills(experience["description"]))
-
-            if "languages" in data and data["languages"] and len(data["languages"]) > 0:
-                for language in data["languages"]:
-                    if not isinstance(language, str):
-                        continue
-
-                    # build our id
-                    l_id = hash_string(language.strip().lower())
-
-                    client.execute_query(
-                        f"""
-                        MATCH (p:Person {"{id: $p_id}"})
-                        MERGE (l:Language {"{id: $l_id}"})
-                        ON CREATE SET l.name = $name
-
-                        MERGE (p)-[r:SPEAKS]->(l)
-                        """,
-                        p_id=id,
-                        l_id=l_id,
-                        name=language,
-                    )
 
-            # do we care about education?
-            # it doesn't really help with searching for candidates (other than degree...)
-            if "education" in data and data["education"] and len(data["education"]) > 0:
-                for education in data["education"]:
-                    s_id = education["school_linkedin_profile_url"]
-                    if not s_id or s_id.lower().strip() == "none":
-                        s_id = education["school"]
+class FakeEmbedder:
+    """Deterministic local stand-in for tests, vectors derive from the text's sha256"""
 
-                    se_id = ":".join(
-                        [
-                            str(education["starts_at"]["year"])
-                            if "starts_at" in education and education["starts_at"]
-                            else "",
-                            str(education["starts_at"]["month"])
-                            if "starts_at" in education and education["starts_at"]
-                            else "",
-                            str(education["starts_at"]["day"])
-                            if "starts_at" in education and education["starts_at"]
-                            else "",
-                            education["school"],
-                            education["degree_name"]
-                            if "degree_name" in education and education["degree_name"]
-                            else "",
-                        ]
-                    )
+    def __init__(self, dimensions: int = 16) -> None:
+        self.model = f"fake-{dimensions}"
+        self.dimensions = dimensions
 
-                    # hash the ids
-                    s_id = hash_string(s_id)
-                    se_id = hash_string(se_id)
-
-                    # do we have an end date?
-                    has_ends_at = (
-                        True
-                        if "ends_at" in education
-                        and education["ends_at"]
-                        and "year" in education["ends_at"]
-                        and "month" in education["ends_at"]
-                        and "day" in education["ends_at"]
-                        else False
-                    )
-                    has_starts_at = (
-                        True
-                        if "starts_at" in education
-                        and education["starts_at"]
-                        and "year" in education["starts_at"]
-                        and "month" in education["starts_at"]
-                        and "day" in education["starts_at"]
-                        else False
-                    )
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        vectors = []
+        for text in texts:
+            digest = hashlib.sha256(text.encode()).digest()
+            while len(digest) < self.dimensions:
+                digest += hashlib.sha256(digest).digest()
+            vectors.append([byte / 127.5 - 1 for byte in digest[: self.dimensions]])
 
-                    client.execute_query(
-                        f"""
-                        MATCH (p:Person {"{id: $p_id}"})
-                        MERGE (s:School {"{id: $s_id}"})
-                        ON CREATE SET s.name = $school, s.url = $url, s.logo = $logo
-
-                        MERGE (p)-[r:STUDY_AT {"{id: $se_id}"}]->(s)
-                        SET r.degree = $degree_name, r.field = $field_of_study, r.description = $description{" , r.end = date({year: $ends_year, month: $ends_month, day: $ends_day})" if has_ends_at else ""}{" , r.start = date({year: $starts_year, month: $starts_month, day: $starts_day})" if has_starts_at else ""}
-                        """,
-                        # person
-                        p_id=id,
-                        # school
-                        s_id=s_id,
-                        school=education["school"].strip(),
-                        # relationship
-                        se_id=se_id,
-                        # optionals
-                        url=education["school_linkedin_profile_url"]
-                        if "school_linkedin_profile_url" in education
-                        else None,
-                        logo=education["logo_url"] if "logo_url" in education else None,
-                        degree_name=education["degree_name"]
-                        if "degree_name" in education and education["degree_name"]
-                        else None,
-                        field_of_study=education["field_of_study"]
-                        if "field_of_study" in education and education["field_of_study"]
-                        else None,
-                        description=education["description"]
-                        if "description" in education and education["description"]
-                        else None,
-                        ends_year=education["ends_at"]["year"]
-                        if "ends_at" in education
-                        and education["ends_at"]
-                        and "year" in education["ends_at"]
-                        else None,
-                        ends_month=education["ends_at"]["month"]
-                        if "ends_at" in education
-                        and education["ends_at"]
-                        and "month" in education["ends_at"]
-                        else None,
-                        ends_day=education["ends_at"]["day"]
-                        if "ends_at" in education
-                        and education["ends_at"]
-                        and "day" in education["ends_at"]
-                        else None,
-                        starts_year=education["starts_at"]["year"]
-                        if "starts_at" in education
-                        and education["starts_at"]
-                        and "year" in education["starts_at"]
-                        else None,
-                        starts_month=education["starts_at"]["month"]
-                        if "starts_at" in education
-                        and education["starts_at"]
-                        and "month" in education["starts_at"]
-                        else None,
-                        starts_day=education["starts_at"]["day"]
-                        if "starts_at" in education
-                        and education["starts_at"]
-                        and "day" in education["starts_at"]
-                        else None,
-                    )
+        return vectors
 
-            if (
-                "accomplishment_projects" in data
-                and data["accomplishment_projects"]
-                and len(data["accomplishment_projects"]) > 0
-            ):
-                for project in data["accomplishment_projects"]:
-                    if "description" in project and project["description"]:
-                        skills.update(extract_skills(project["description"]))
-
-            # if we have skills, add them to the graph
-            if len(skills) > 0:
-                for skill in skills:
-                    client.execute_query(
-                        f"""
-                        MATCH (p:Person {"{id: $p_id}"})
-                        MERGE (s:Skill {"{id: $s_id}"})
-                        ON CREATE SET s.name = $name
-
-                        MERGE (p)-[r:HAS_SKILL]->(s)
-                        """,
-                        p_id=id,
-                        s_id=slugify(skill),
-                        name=skill,
-                    )
-        except Exception as e:
-            print(f"Memgraph: {e}")
+
+class VectorSink(Protocol):
+    """Where embedded nodes end up, QdrantVectorStore in production"""
+
+    def add(self, nodes: list[BaseNode]) -> list[str]:
+        ...
+
+
+class NullSink:
+    """Drops the nodes, only counts them"""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def add(self, nodes: list[BaseNode]) -> list[str]:
+        self.count += len(nodes)
+        return [node.node_id for node in nodes]
+
+
+class EmbeddingCache:
+    """On-disk sqlite cache of vectors keyed by model and the sha256 of the text,
+    re-imports only embed texts that actually changed
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=60)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embedding ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+
+        return self._db
+
+    def get_many(self, model: str, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        for idx in range(0, len(keys), 500):
+            chunk = keys[idx : idx + 500]
+            cursor = self.db.execute(
+                "SELECT text_hash, vector FROM embedding WHERE model = ? "
+                f"AND text_hash IN ({','.join('?' * len(chunk))})",
+                [model, *chunk],
+            )
+            for key, vector in cursor:
+                found[key] = array("f", vector).tolist()
+
+        return found
+
+    def put_many(self, model: str, vectors: dict[str, list[float]]) -> None:
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO embedding VALUES (?, ?, ?)",
+                [
+                    (model, key, array("f", vector).tobytes())
+                    for key, vector in vectors.items()
+                ],
+            )
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class EmbeddingStage:
+    """Embeds person documents in large batches with several requests in flight
+    and upserts them to the vector store in bulk.
+
+    Documents are split like VectorStoreIndex.from_documents would, texts
+    with a cached vector are not sent to the embedder again and node ids are
+    derived from the document id so re-imports overwrite instead of duplicate.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        sink: VectorSink,
+        cache: EmbeddingCache | None = None,
+        batch_size: int = 32,
+        concurrency: int = 4,
+        upsert_size: int = 256,
+        splitter: SentenceSplitter | None = None,
+    ) -> None:
+        self.embedder = embedder
+        self.sink = sink
+        self.cache = cache
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.upsert_size = upsert_size
+        self.splitter = splitter or SentenceSplitter(
+            chunk_size=Settings.chunk_size, chunk_overlap=Settings.chunk_overlap
+        )
+
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._in_flight: dict[Future, list[tuple[str, BaseNode]]] = {}
+        self._pending: list[tuple[str, BaseNode]] = []
+        self._ready: list[BaseNode] = []
+
+        # totals, embedded were sent to the embedder, cached were not
+        self.embedded = 0
+        self.cached = 0
+        self.upserted = 0
+        self.busy = 0.0
+        self.waited = 0.0
+
+    def add(self, documents: list[Document]) -> None:
+        started = time.perf_counter()
+        nodes = self.splitter.get_nodes_from_documents(documents)
+
+        chunks: dict[str, int] = {}
+        keyed: list[tuple[str, BaseNode]] = []
+        for node in nodes:
+            ref = node.ref_doc_id or node.node_id
+            chunks[ref] = chunks.get(ref, -1) + 1
+            node.id_ = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{ref}:{chunks[ref]}"))
+            text = node.get_content(metadata_mode=MetadataMode.EMBED)
+            keyed.append((hash_string(text), node))
+
+        cached = (
+            self.cache.get_many(self.embedder.model, [key for key, _ in keyed])
+            if self.cache is not None
+            else {}
+        )
+        for key, node in keyed:
+            if key in cached:
+                node.embedding = cached[key]
+                self._ready.append(node)
+                self.cached += 1
+            else:
+                self._pending.append((key, node))
+
+        while len(self._pending) >= self.batch_size:
+            self._submit(self._pending[: self.batch_size])
+            self._pending = self._pending[self.batch_size :]
+
+        self._upsert(self.upsert_size)
+        self.busy += time.perf_counter() - started
+
+    def _submit(self, batch: list[tuple[str, BaseNode]]) -> None:
+        # keep at most concurrency requests in flight
+        while len(self._in_flight) >= self.concurrency:
+            started = time.perf_counter()
+            done, _ = wait(self._in_flight, return_when=FIRST_COMPLETED)
+            self.waited += time.perf_counter() - started
+            self._harvest(done)
+
+        texts = [
+            node.get_content(metadata_mode=MetadataMode.EMBED) for _, node in batch
+        ]
+        self._in_flight[self._executor.submit(self.embedder.embed, texts)] = batch
+
+    def _harvest(self, done: set[Future]) -> None:
+        vectors: dict[str, list[float]] = {}
+        for future in done:
+            batch = self._in_flight.pop(future)
+            for (key, node), vector in zip(batch, future.result(), strict=True):
+                node.embedding = vector
+                vectors[key] = vector
+                self._ready.append(node)
+            self.embedded += len(batch)
+
+        if self.cache is not None and vectors:
+            self.cache.put_many(self.embedder.model, vectors)
+
+    def _upsert(self, minimum: int) -> None:
+        if self._ready and len(self._ready) >= minimum:
+            self.sink.add(self._ready)
+            self.upserted += len(self._ready)
+            self._ready = []
+
+    def drain(self) -> None:
+        """Embeds and upserts everything added so far, raises embedding errors"""
+        started = time.perf_counter()
+        if self._pending:
+            self._submit(self._pending)
+            self._pending = []
+
+        waiting = time.perf_counter()
+        done, _ = wait(self._in_flight)
+        self.waited += time.perf_counter() - waiting
+        self._harvest(done)
+        self._upsert(1)
+        self.busy += time.perf_counter() - started
+
+    def stats(self) -> "StageStats":
+        # busy includes the time spent waiting on the embedder (blocked)
+        return StageStats(
+            "embed",
+            items=self.embedded + self.cached,
+            busy=self.busy,
+            blocked=self.waited,
+            skipped=self.cached,
+        )
+
+    def close(self) -> None:
+        self.drain()
+        self._executor.shutdown()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def tei_embedding_stage(
+    cache_path: str, batch_size: int, concurrency: int
+) -> EmbeddingStage:
+    """The production stage: TEI embeddings, upserted to qdrant's people collection"""
+    return EmbeddingStage(
+        TEIEmbedder(),
+        qdrant_vector_store(),
+        EmbeddingCache(cache_path),
+        batch_size=batch_size,
+        concurrency=concurrency,
+    )
+
+
+class HashIndex:
+    """Sidecar sqlite index of the content (and section) hashes of every
+    profile written so far, used to skip unchanged profiles on re-imports.
+    The connection is opened lazily so every process gets its own.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=60)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS profile_hash ("
+                "person_id TEXT PRIMARY KEY, content_hash TEXT NOT NULL, "
+                "sections TEXT NOT NULL)"
+            )
+
+        return self._db
+
+    def get_many(self, ids: list[str]) -> dict[str, tuple[str, dict[str, str]]]:
+        found = {}
+        for idx in range(0, len(ids), 500):
+            chunk = ids[idx : idx + 500]
+            cursor = self.db.execute(
+                "SELECT person_id, content_hash, sections FROM profile_hash "
+                f"WHERE person_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for person_id, content_hash, sections in cursor:
+                found[person_id] = (content_hash, json.loads(sections))
+
+        return found
+
+    def update(self, rows: list[PersonRows]) -> None:
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO profile_hash VALUES (?, ?, ?)",
+                [(r.person["id"], r.content_hash, json.dumps(r.hashes)) for r in rows],
+            )
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def drop_unchanged(batch: GraphBatch, index: HashIndex) -> int:
+    """Removes profiles whose content hash matches the index from batch and
+    trims changed ones down to their changed sections, returns the skip count
+    """
+    previous = index.get_many([rows.person["id"] for rows in batch.rows])
+
+    kept: list[PersonRows] = []
+    for rows in batch.rows:
+        known = previous.get(rows.person["id"])
+        if known is not None:
+            content_hash, sections = known
+            if content_hash == rows.content_hash:
+                continue
+
+            rows.keep_changed(sections)
+
+        kept.append(rows)
+
+    skipped = len(batch.rows) - len(kept)
+    batch.rows = kept
+    return skipped
+
+
+def write_changes(
+    client: Driver,
+    batch: GraphBatch,
+    index: HashIndex | None,
+    embeddings: EmbeddingStage | None = None,
+) -> tuple[list[tuple[PersonRows, str]], int, list[PersonRows]]:
+    """write_batch for the profiles that changed since they were last imported
+    (all of them without an index), then hands their documents to the
+    embedding stage. Returns the failures, the skip count and the written rows,
+    which go to PendingCommits so the index is only updated once they are
+    embedded too
+    """
+    skipped = drop_unchanged(batch, index) if index is not None else 0
+    rows = list(batch.rows)
+
+    failed = write_batch(client, batch) if len(batch) > 0 else []
+    rejected = {id(rows) for rows, _ in failed}
+    written = [r for r in rows if id(r) not in rejected]
+
+    if embeddings is not None and written:
+        embeddings.add([document for r in written for document in r.documents])
+
+    return failed, skipped, written
+
+
+class PendingCommits:
+    """Checkpoint (and hash index) updates of written batches, held back until
+    the embeddings of their rows are upserted. The embedding stage is drained
+    every `every` batches (and by flush) instead of after each one, so its
+    requests overlap with the graph writes of the batches that follow.
+    """
+
+    def __init__(
+        self,
+        index: HashIndex | None,
+        embeddings: EmbeddingStage | None,
+        every: int = 20,
+    ) -> None:
+        self.index = index
+        self.embeddings = embeddings
+        self.every = max(1, every)
+        self.pending: list[tuple[list[PersonRows], Callable[[], None]]] = []
+
+    def add(self, written: list[PersonRows], commit: Callable[[], None]) -> None:
+        self.pending.append((written, commit))
+        # without embeddings there is nothing to wait for
+        if self.embeddings is None or len(self.pending) >= self.every:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.embeddings is not None and self.pending:
+            self.embeddings.drain()
+
+        for written, commit in self.pending:
+            if self.index is not None:
+                self.index.update(written)
+            commit()
+        self.pending = []
+
+
+@dataclasses.dataclass
+class Checkpoint:
+    """Progress through the source files, every line before offset in source
+    (and all of the files before it) is committed
+    """
+
+    source: str
+    offset: int = 0
+    batches: int = 0
+    profiles: int = 0
+
+    @classmethod
+    def load(cls, path: str) -> "Checkpoint | None":
+        if not os.path.exists(path):
+            return None
+
+        with open(path, encoding="utf-8") as f_in:
+            return cls(**json.load(f_in))
+
+    def commit(self, path: str, source: str, offset: int, profiles: int) -> None:
+        """Records a committed batch, written atomically so a crash mid-write
+        can't leave a truncated checkpoint behind
+        """
+        self.source = source
+        self.offset = offset
+        self.batches += 1
+        self.profiles += profiles
+
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f_out:
+            json.dump(dataclasses.asdict(self), f_out)
+        os.replace(tmp, path)
+
+
+# compressed dumps are decompressed and split into lines through buffers this
+# large, so reading a file costs a few big reads instead of many small ones
+READ_BUFFER = 16 * 1024 * 1024
+
+# progress is updated from the on-disk position every this many lines
+PROGRESS_INTERVAL = 4096
+
+
+def resolve_sources(patterns: list[str]) -> list[str]:
+    """Expands globs (shards are read in sorted order) into absolute paths"""
+    files: list[str] = []
+    for pattern in patterns:
+        if any(char in pattern for char in "*?["):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise SystemExit(f"No files match {pattern}")
+            files.extend(matches)
+        else:
+            files.append(pattern)
+
+    return [os.path.abspath(path) for path in files]
+
+
+def open_source(raw: BinaryIO, path: str) -> BinaryIO:
+    """Wraps raw in a decompressor picked by the file extension"""
+    if path.endswith(".gz"):
+        stream = gzip.GzipFile(fileobj=raw)
+    elif path.endswith(".bz2"):
+        stream = bz2.BZ2File(raw)
+    elif path.endswith((".zst", ".zstd")):
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit(
+                f"{path} is zstd compressed, pip install zstandard to read it"
+            ) from None
+
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_size=READ_BUFFER)
+    else:
+        return raw
+
+    return io.BufferedReader(stream, buffer_size=READ_BUFFER)
+
+
+def read_sources(
+    files: list[str], checkpoint: Checkpoint, replay: bool, progress: tqdm
+) -> Iterator[tuple[str, int, bytes]]:
+    """Yields (source, start offset, line) for every line in files, in a single
+    pass, starting at the checkpoint. Offsets are positions in the decompressed
+    stream, progress is reported in bytes read from disk. For a dead letter
+    file (replay) the original line is unwrapped from each record.
+    """
+    start = files.index(checkpoint.source) if checkpoint.source in files else 0
+    for path in files[:start]:
+        progress.update(os.path.getsize(path))
+
+    for path in files[start:]:
+        offset = checkpoint.offset if path == checkpoint.source else 0
+        with open(path, "rb", buffering=READ_BUFFER) as raw:
+            stream = open_source(raw, path)
+
+            # seek straight to the checkpoint, compressed streams can only get
+            # there by decompressing everything before it
+            if stream is raw:
+                raw.seek(offset)
+            else:
+                remaining = offset
+                while remaining > 0:
+                    skipped = len(stream.read(min(remaining, READ_BUFFER)))
+                    if not skipped:
+                        break
+                    remaining -= skipped
+
+            position = raw.tell()
+            progress.update(position)
+
+            for count, line in enumerate(stream):
+                start_offset = offset
+                offset += len(line)
+                if replay:
+                    line = json.loads(line)["line"].encode("utf-8")
+
+                yield path, start_offset, line
+
+                if count % PROGRESS_INTERVAL == 0:
+                    progress.update(raw.tell() - position)
+                    position = raw.tell()
+
+            progress.update(os.path.getsize(path) - position)
+
+
+GRAPH_URI = "bolt://memgraph-platform:7687"
+GRAPH_AUTH = ("", "")
+
+# how long the driver keeps retrying a transaction on transient errors, long
+# enough to ride out a memgraph restart
+GRAPH_RETRY_TIME = 120
+
+
+def graph_driver() -> Driver:
+    return GraphDatabase.driver(
+        GRAPH_URI, auth=GRAPH_AUTH, max_transaction_retry_time=GRAPH_RETRY_TIME
+    )
+
+
+# everything the importer MERGEs or MATCHes by id, nodes get an index and a
+# uniqueness constraint (memgraph constraints don't create an index)
+SCHEMA_LABELS = ("Person", "Company", "CompanyLocation", "Language", "School", "Skill")
+SCHEMA_EDGE_TYPES = ("WORKS_FOR", "WORKS_AT", "HAS_BRANCH", "STUDY_AT")
+
+
+def _schema_property(value: str | list[str]) -> str:
+    # single property indexes / constraints may be reported as a list
+    return value[0] if isinstance(value, list) and len(value) == 1 else str(value)
+
+
+def read_schema(client: Driver) -> tuple[set[str], set[str], set[str]]:
+    """Labels indexed on id, edge types indexed on id, labels unique on id"""
+    with client.session() as session:
+        indexes = session.run("SHOW INDEX INFO").data()
+        constraints = session.run("SHOW CONSTRAINT INFO").data()
+
+    nodes, edges, unique = set(), set(), set()
+    for index in indexes:
+        if _schema_property(index["property"]) != "id":
+            continue
+        if index["index type"] == "label+property":
+            nodes.add(index["label"])
+        elif index["index type"].startswith("edge-type+property"):
+            edges.add(index["label"])
+
+    for constraint in constraints:
+        if (
+            constraint["constraint type"] == "unique"
+            and _schema_property(constraint["properties"]) == "id"
+        ):
+            unique.add(constraint["label"])
+
+    return nodes, edges, unique
+
+
+def ensure_schema(client: Driver) -> None:
+    """Creates the missing indexes and constraints and verifies them, safe to
+    run on every start. Edge indexes need memgraph 2.18+, without them the
+    relationship MERGEs still work (scanning the person's edges) so missing
+    ones are only reported
+    """
+    nodes, edges, unique = read_schema(client)
+
+    statements = [
+        f"CREATE INDEX ON :{label}(id)" for label in SCHEMA_LABELS if label not in nodes
+    ]
+    statements += [
+        f"CREATE CONSTRAINT ON (n:{label}) ASSERT n.id IS UNIQUE"
+        for label in SCHEMA_LABELS
+        if label not in unique
+    ]
+    statements += [
+        f"CREATE EDGE INDEX ON :{edge_type}(id)"
+        for edge_type in SCHEMA_EDGE_TYPES
+        if edge_type not in edges
+    ]
+
+    # schema changes can't run inside an explicit transaction
+    with client.session() as session:
+        for statement in statements:
+            try:
+                session.run(statement).consume()
+                print(f"schema: {statement}")
+            except Neo4jError as e:
+                print(f"schema: {statement} failed: {e}")
+
+    nodes, edges, unique = read_schema(client)
+    missing = [
+        f"index on :{label}(id)" for label in SCHEMA_LABELS if label not in nodes
+    ] + [
+        f"unique constraint on :{label}(id)"
+        for label in SCHEMA_LABELS
+        if label not in unique
+    ]
+    if missing:
+        raise SystemExit(f"memgraph schema is incomplete: {', '.join(missing)}")
+
+    for edge_type in SCHEMA_EDGE_TYPES:
+        if edge_type not in edges:
+            print(f"schema: no index on :{edge_type}(id), continuing without it")
+
+
+@dataclasses.dataclass
+class StageStats:
+    """Work done by one pipeline process, busy excludes time blocked on queues"""
+
+    stage: str
+    items: int = 0
+    busy: float = 0.0
+    blocked: float = 0.0
+    skipped: int = 0
+
+
+@dataclasses.dataclass
+class Chunk:
+    """A run of consecutive source lines, (source, end) is the position just past
+    the last one
+    """
+
+    seq: int
+    source: str
+    end: int
+    lines: list[tuple[str, int, bytes]] = dataclasses.field(default_factory=list)
+    rows: list[PersonRows] = dataclasses.field(default_factory=list)
+
+
+def _transform_worker(
+    chunks: multiprocessing.Queue,
+    transformed: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+):
+    """Parse / transform stage: Chunk.lines in, Chunk.rows out"""
+    stage = StageStats("transform")
+    while True:
+        started = time.perf_counter()
+        chunk = chunks.get()
+        stage.blocked += time.perf_counter() - started
+        if chunk is None:
+            break
+
+        started = time.perf_counter()
+        for source, offset, line in chunk.lines:
+            try:
+                rows = parse_person(line)
+            except Exception as e:
+                results.put(("dead", line, source, offset, "parse", repr(e)))
+                continue
+
+            if rows is not None:
+                rows.line, rows.source, rows.offset = line, source, offset
+                chunk.rows.append(rows)
+
+        stage.busy += time.perf_counter() - started
+        stage.items += len(chunk.lines)
+
+        chunk.lines = []
+        started = time.perf_counter()
+        transformed.put(chunk)
+        stage.blocked += time.perf_counter() - started
+
+    results.put(("stats", stage))
+
+
+def _writer_worker(
+    transformed: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+    index_path: str | None,
+    embedding_stage: Callable[[], EmbeddingStage] | None,
+    entity_cache_size: int,
+    checkpoint_every: int,
+):
+    """Write stage: every writer holds its own driver (and therefore sessions)
+    and entity cache, each chunk is written (and embedded) as one batch and
+    reported back once committed, embeddings included
+    """
+    stage = StageStats("write")
+    index = HashIndex(index_path) if index_path else None
+    embeddings = embedding_stage() if embedding_stage is not None else None
+    entities = EntityCache(entity_cache_size) if entity_cache_size > 0 else None
+    commits = PendingCommits(index, embeddings, checkpoint_every)
+
+    with graph_driver() as client:
+        while True:
+            started = time.perf_counter()
+            chunk = transformed.get()
+            stage.blocked += time.perf_counter() - started
+            if chunk is None:
+                break
+
+            started = time.perf_counter()
+            batch = GraphBatch(batch_size=len(chunk.rows), entities=entities)
+            for rows in chunk.rows:
+                batch.add(rows)
+
+            failed, skipped, written = write_changes(client, batch, index, embeddings)
+            for rows, error in failed:
+                results.put(
+                    ("dead", rows.line, rows.source, rows.offset, "write", error)
+                )
+
+            commits.add(
+                written,
+                functools.partial(
+                    results.put,
+                    (
+                        "done",
+                        chunk.seq,
+                        chunk.source,
+                        chunk.end,
+                        len(chunk.rows) - len(failed) - skipped,
+                    ),
+                ),
+            )
+
+            stage.busy += time.perf_counter() - started
+            stage.items += len(chunk.rows)
+            stage.skipped += skipped
+
+        commits.flush()
+
+    if index is not None:
+        index.close()
+
+    if embeddings is not None:
+        embeddings.close()
+        results.put(("stats", embeddings.stats()))
+
+    results.put(("stats", stage))
+
+
+def report_stages(stages: list[StageStats], elapsed: float):
+    """Prints per-stage throughput, the stage with the highest utilization is the
+    bottleneck (transform => CPU bound, write => graph database bound)
+    """
+    print(f"pipeline finished in {elapsed:.1f}s")
+    for name in ("read", "transform", "write", "embed"):
+        group = [stage for stage in stages if stage.stage == name]
+        if not group:
+            continue
+
+        items = sum(stage.items for stage in group)
+        busy = sum(stage.busy for stage in group)
+        blocked = sum(stage.blocked for stage in group)
+        skipped = sum(stage.skipped for stage in group)
+        utilization = busy / (elapsed * len(group)) if elapsed > 0 else 0.0
+        print(
+            f"  {name:<9} workers={len(group):<3} items={items:<9} "
+            f"rate={items / elapsed if elapsed > 0 else 0.0:,.0f}/s "
+            f"busy={busy:.1f}s blocked={blocked:.1f}s "
+            f"utilization={utilization:.0%}"
+            + (f" unchanged={skipped}" if skipped else "")
+        )
+
+
+def run_sequential(
+    lines: Iterable[tuple[str, int, bytes]],
+    batch_size: int,
+    checkpoint: Checkpoint,
+    checkpoint_path: str,
+    dead_letters: DeadLetters,
+    index: HashIndex | None,
+    embeddings: EmbeddingStage | None = None,
+    entities: EntityCache | None = None,
+    checkpoint_every: int = 20,
+):
+    unchanged = 0
+    commits = PendingCommits(index, embeddings, checkpoint_every)
+
+    def flush(end: tuple[str, int]):
+        nonlocal unchanged
+        profiles = len(batch)
+        failed, skipped, written = write_changes(client, batch, index, embeddings)
+        for rows, error in failed:
+            dead_letters.add(rows.line, rows.source, rows.offset, "write", error)
+
+        unchanged += skipped
+        commits.add(
+            written,
+            functools.partial(
+                checkpoint.commit,
+                checkpoint_path,
+                *end,
+                profiles - len(failed) - skipped,
+            ),
+        )
+
+    with graph_driver() as client:
+        batch = GraphBatch(batch_size=batch_size, entities=entities)
+        start = end = (checkpoint.source, checkpoint.offset)
+
+        # each line is a json object, a batch may span files which is fine as
+        # the earlier file is then completely committed along with it
+        for source, offset, line in lines:
+            end = (source, offset + len(line))
+            try:
+                rows = parse_person(line)
+            except Exception as e:
+                dead_letters.add(line, source, offset, "parse", repr(e))
+                continue
+
+            if rows is None:
+                continue
+
+            rows.line, rows.source, rows.offset = line, source, offset
+            batch.add(rows)
+
+            if batch.is_full():
+                flush(end)
+
+        # write whatever is left over
+        if len(batch) > 0 or end != start:
+            flush(end)
+        commits.flush()
+
+    if unchanged:
+        print(f"{unchanged:,} unchanged profiles skipped")
+
+    if embeddings is not None:
+        print(
+            f"{embeddings.upserted:,} nodes upserted, {embeddings.embedded:,} "
+            f"embedded and {embeddings.cached:,} from the embedding cache"
+        )
+
+
+class Pipeline:
+    """reader (this process) -> transform processes -> writer processes, connected
+    by bounded queues so a slow stage applies backpressure instead of buffering
+    the whole file in memory.
+
+    Writers finish chunks out of order, the checkpoint only advances over the
+    contiguous run of committed chunks so a resume never skips unwritten lines.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        workers: int,
+        writers: int,
+        checkpoint: Checkpoint,
+        checkpoint_path: str,
+        dead_letters: DeadLetters,
+        index_path: str | None,
+        embedding_stage: Callable[[], EmbeddingStage] | None = None,
+        entity_cache_size: int = 0,
+        checkpoint_every: int = 20,
+    ) -> None:
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.checkpoint_path = checkpoint_path
+        self.dead_letters = dead_letters
+
+        self.chunks: multiprocessing.Queue = multiprocessing.Queue(maxsize=workers * 2)
+        self.transformed: multiprocessing.Queue = multiprocessing.Queue(
+            maxsize=writers * 2
+        )
+        self.results: multiprocessing.Queue = multiprocessing.Queue()
+
+        self.transformers = [
+            multiprocessing.Process(
+                target=_transform_worker,
+                args=(self.chunks, self.transformed, self.results),
+                daemon=True,
+            )
+            for _ in range(workers)
+        ]
+        self.writers = [
+            multiprocessing.Process(
+                target=_writer_worker,
+                args=(
+                    self.transformed,
+                    self.results,
+                    index_path,
+                    embedding_stage,
+                    entity_cache_size,
+                    checkpoint_every,
+                ),
+                daemon=True,
+            )
+            for _ in range(writers)
+        ]
+
+        self.stages: list[StageStats] = []
+        self.committed: dict[int, tuple[int, int]] = {}
+        self.next_seq = 0
+
+    def _handle(self, result: tuple) -> None:
+        kind, *payload = result
+        if kind == "dead":
+            self.dead_letters.add(*payload)
+        elif kind == "stats":
+            self.stages.append(payload[0])
+        elif kind == "done":
+            seq, *committed = payload
+            self.committed[seq] = tuple(committed)
+
+            # advance the checkpoint over every contiguous committed chunk
+            while self.next_seq in self.committed:
+                source, end, profiles = self.committed.pop(self.next_seq)
+                self.checkpoint.commit(self.checkpoint_path, source, end, profiles)
+                self.next_seq += 1
+
+    def _poll(self, timeout: float | None = None) -> bool:
+        """Handles pending results, True when one was received"""
+        try:
+            if timeout:
+                result = self.results.get(timeout=timeout)
+            else:
+                result = self.results.get_nowait()
+        except Empty:
+            return False
+
+        self._handle(result)
+        return True
+
+    def _check(self) -> None:
+        if any(process.exitcode for process in self.transformers + self.writers):
+            raise RuntimeError("a pipeline worker exited unexpectedly")
+
+    def _put(self, queue: multiprocessing.Queue, item) -> float:
+        """Blocking put that keeps handling results while it waits, returns the wait"""
+        started = time.perf_counter()
+        while True:
+            try:
+                queue.put(item, timeout=1)
+                break
+            except Full:
+                self._check()
+
+        waited = time.perf_counter() - started
+        while self._poll():
             pass
 
-        # try:
-        #     # index our document(s)
-        #     if len(documents) > 1:
-        #         VectorStoreIndex.from_documents(
-        #             documents=documents,
-        #             storage_context=storage_context,
-        #         )
-        # except Exception as e:
-        #     print(f"Error indexing: {e}")
-        #     return
-
-    except json.JSONDecodeError as e:
-        print(f"Error decoding json: {e}")
-        return
-    except Exception as e:
-        print(f"Error: {e}")
-        return
+        return waited
+
+    def _wait(self, processes: list, stage: str) -> None:
+        """Keeps handling results until every process of a stage reported its stats"""
+        while sum(1 for s in self.stages if s.stage == stage) < len(processes):
+            if not self._poll(timeout=1):
+                self._check()
+
+        for process in processes:
+            process.join()
+
+    def run(self, lines: Iterable[tuple[str, int, bytes]]) -> None:
+        for process in self.writers + self.transformers:
+            process.start()
+
+        reader = StageStats("read")
+        started = time.perf_counter()
+
+        # hand out lines in batch sized chunks to keep the IPC overhead down
+        chunk = Chunk(seq=0, source=self.checkpoint.source, end=self.checkpoint.offset)
+        busy = time.perf_counter()
+        for source, offset, line in lines:
+            chunk.lines.append((source, offset, line))
+            chunk.source, chunk.end = source, offset + len(line)
+            if len(chunk.lines) >= self.batch_size:
+                reader.items += len(chunk.lines)
+                reader.busy += time.perf_counter() - busy
+                reader.blocked += self._put(self.chunks, chunk)
+                busy = time.perf_counter()
+                chunk = Chunk(seq=chunk.seq + 1, source=source, end=chunk.end)
+
+        reader.items += len(chunk.lines)
+        reader.busy += time.perf_counter() - busy
+        if chunk.lines:
+            reader.blocked += self._put(self.chunks, chunk)
+        self.stages.append(reader)
+
+        # drain the pipeline stage by stage
+        for _ in self.transformers:
+            self._put(self.chunks, None)
+        self._wait(self.transformers, "transform")
+
+        for _ in self.writers:
+            self._put(self.transformed, None)
+        self._wait(self.writers, "write")
+
+        # results the writers queued right before their stats
+        while self._poll():
+            pass
+
+        report_stages(self.stages, time.perf_counter() - started)
 
 
 def app():
+    parser = argparse.ArgumentParser(
+        description="Import LinkDB person profiles into memgraph"
+    )
+    parser.add_argument(
+        "--source",
+        nargs="+",
+        default=["/workspaces/api/tests/data/us_person_profile.txt"],
+        help="LinkDB jsonl files or globs of shards, optionally .gz/.bz2/.zst "
+        "compressed (or dead letter files with --replay)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="number of profiles written per UNWIND flush (1 writes each profile on its own)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="parse/transform processes, 0 runs everything sequentially in this process",
+    )
+    parser.add_argument(
+        "--writers",
+        type=int,
+        default=1,
+        help="writer processes, each with its own memgraph connection (pipeline mode only)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue from the offset stored in the checkpoint file",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="checkpoint file, defaults to <source>.checkpoint.json "
+        "(import-us-persons.checkpoint.json next to the first shard)",
+    )
+    parser.add_argument(
+        "--dead-letter",
+        help="file failed lines are appended to, defaults to "
+        "<source>.dead-letter.jsonl (or next to the first shard)",
+    )
+    parser.add_argument(
+        "--hash-index",
+        help="sqlite index of imported profile hashes, used to skip unchanged "
+        "profiles, defaults to import-us-persons.hashes.sqlite next to the "
+        "(first) source, so each week's dump finds the previous imports",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="rewrite every profile, even the ones the hash index says are unchanged",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="the source is a dead letter file, import the lines it recorded",
+    )
+    parser.add_argument(
+        "--entity-cache-size",
+        type=int,
+        default=500_000,
+        help="shared nodes (companies, skills, ...) each writer remembers as "
+        "already merged, 0 merges them for every batch",
+    )
+    parser.add_argument(
+        "--embed",
+        action="store_true",
+        help="also embed the profile documents and upsert them to qdrant",
+    )
+    parser.add_argument(
+        "--embed-batch-size",
+        type=int,
+        default=32,
+        help="texts sent to the embedding server per request",
+    )
+    parser.add_argument(
+        "--embed-concurrency",
+        type=int,
+        default=4,
+        help="embedding requests in flight per writer",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=20,
+        help="with --embed, batches written between checkpoints, the embedding "
+        "stage is drained (and the hash index updated) at each checkpoint",
+    )
+    parser.add_argument(
+        "--embedding-cache",
+        help="sqlite cache of embeddings by text hash, defaults to "
+        "<source>.embeddings.sqlite",
+    )
+    parser.add_argument(
+        "--schema-only",
+        action="store_true",
+        help="only create (and verify) the memgraph indexes and constraints",
+    )
+    args = parser.parse_args()
+
     # print(pydantic_schema)
     # return
-    with GraphDatabase.driver("bolt://memgraph-platform:7687", auth=("", "")) as client:
-        # open the source file
-        source_file = "/workspaces/api/tests/data/us_person_profile.txt"
-
-        # count the number of lines
-        with open(source_file) as f_in:
-            num_lines = sum(1 for _ in f_in)
-
-        # read the file
-        with open(source_file) as f_in:
-            # each line is a json object
-            for _idx, line in tqdm(enumerate(f_in), total=num_lines):
-                process_person(client, line)
-
-                # if idx > 100:
-                #     break
+
+    # every MERGE relies on the id indexes, make sure they exist before writing
+    with graph_driver() as client:
+        ensure_schema(client)
+
+    if args.schema_only:
+        return
+
+    # find the source file(s)
+    files = resolve_sources(args.source)
+    base = (
+        files[0]
+        if len(files) == 1
+        else os.path.join(os.path.dirname(files[0]), "import-us-persons")
+    )
+    checkpoint_path = args.checkpoint or f"{base}.checkpoint.json"
+    dead_letters = DeadLetters(args.dead_letter or f"{base}.dead-letter.jsonl")
+    # not named after the source, the weekly dump arrives under a new name and
+    # has to be compared against what the previous ones imported
+    index_path = (
+        None
+        if args.full
+        else args.hash_index
+        or os.path.join(os.path.dirname(files[0]), "import-us-persons.hashes.sqlite")
+    )
+    embedding_cache = args.embedding_cache or f"{base}.embeddings.sqlite"
+    embedding_stage = (
+        functools.partial(
+            tei_embedding_stage,
+            embedding_cache,
+            args.embed_batch_size,
+            args.embed_concurrency,
+        )
+        if args.embed
+        else None
+    )
+
+    # a shard glob may also match our own bookkeeping files (and their
+    # .tmp / -wal siblings)
+    bookkeeping = tuple(
+        os.path.abspath(path)
+        for path in (checkpoint_path, dead_letters.path, index_path, embedding_cache)
+        if path
+    )
+    files = [path for path in files if not path.startswith(bookkeeping)]
+
+    checkpoint = Checkpoint(source=files[0])
+    if args.resume:
+        previous = Checkpoint.load(checkpoint_path)
+        if previous is None:
+            print(f"No checkpoint at {checkpoint_path}, starting from the beginning")
+        elif previous.source not in files:
+            raise SystemExit(
+                f"{checkpoint_path} is for {previous.source}, "
+                "which is not part of this import"
+            )
+        else:
+            checkpoint = previous
+            print(
+                f"Resuming {checkpoint.source} at byte {checkpoint.offset:,} "
+                f"({checkpoint.batches:,} batches / {checkpoint.profiles:,} profiles committed)"
+            )
+
+    # read the file(s), once, progress is measured in bytes read from disk
+    try:
+        with tqdm(
+            total=sum(os.path.getsize(path) for path in files),
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024,
+        ) as progress:
+            lines = read_sources(files, checkpoint, args.replay, progress)
+            if args.workers > 0:
+                Pipeline(
+                    batch_size=args.batch_size,
+                    workers=args.workers,
+                    writers=max(1, args.writers),
+                    checkpoint=checkpoint,
+                    checkpoint_path=checkpoint_path,
+                    dead_letters=dead_letters,
+                    index_path=index_path,
+                    embedding_stage=embedding_stage,
+                    entity_cache_size=args.entity_cache_size,
+                    checkpoint_every=args.checkpoint_every,
+                ).run(lines)
+            else:
+                index = HashIndex(index_path) if index_path else None
+                embeddings = embedding_stage() if embedding_stage else None
+                run_sequential(
+                    lines,
+                    batch_size=args.batch_size,
+                    checkpoint=checkpoint,
+                    checkpoint_path=checkpoint_path,
+                    dead_letters=dead_letters,
+                    index=index,
+                    embeddings=embeddings,
+                    entities=EntityCache(args.entity_cache_size)
+                    if args.entity_cache_size > 0
+                    else None,
+                    checkpoint_every=args.checkpoint_every,
+                )
+                if index is not None:
+                    index.close()
+                if embeddings is not None:
+                    embeddings.close()
+    finally:
+        dead_letters.close()
+        if dead_letters.count:
+            print(f"{dead_letters.count:,} lines written to {dead_letters.path}")
 
 
 if __name__ == "__main__":
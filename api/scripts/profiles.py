@@ -0,0 +1,224 @@
+"""
+Deterministic synthetic LinkDB person profiles.
+
+    python profiles.py profiles.jsonl [--count 10000] [--seed 0] [--experiences 5]
+
+Generates jsonl with the fields import-us-persons.py reads, so the importer
+can be benchmarked without the real dump. The same seed and shape always
+produce the same bytes. Companies, schools and skills are drawn from small
+pools with a skew towards the first entries, like the real data where a few
+companies ("Google") and skills ("Python") are shared by many people.
+"""
+import argparse
+import dataclasses
+import json
+import random
+from collections.abc import Iterator
+
+from skills import ALLOWED_SKILLS
+
+FIRST_NAMES = [
+    "James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael",
+    "Linda", "David", "Elizabeth", "William", "Barbara", "Richard", "Susan",
+    "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Karen", "Wei", "Priya",
+]  # fmt: skip
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller",
+    "Davis", "Rodriguez", "Martinez", "Hernandez", "Lopez", "Gonzalez",
+    "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Chen", "Patel",
+]  # fmt: skip
+COMPANIES = [
+    "Google", "Amazon", "Microsoft", "Walmart", "Apple", "Meta", "Target",
+    "Starbucks", "IBM", "Oracle", "Deloitte", "Accenture", "Salesforce",
+    "Bank of America", "Wells Fargo", "JPMorgan Chase", "Kaiser Permanente",
+    "The Home Depot", "United States Army", "Self-employed",
+]  # fmt: skip
+TITLES = [
+    "Software Engineer", "Senior Software Engineer", "Data Scientist",
+    "Product Manager", "Sales Associate", "Store Manager", "Consultant",
+    "Registered Nurse", "Account Executive", "Marketing Manager", "Intern",
+    "Director of Engineering", "Teacher", "Project Manager", "Analyst",
+]  # fmt: skip
+CITIES = [
+    ("San Francisco", "California"), ("New York", "New York"),
+    ("Seattle", "Washington"), ("Austin", "Texas"), ("Chicago", "Illinois"),
+    ("Boston", "Massachusetts"), ("Denver", "Colorado"), ("Atlanta", "Georgia"),
+    ("Miami", "Florida"), ("Portland", "Oregon"),
+]  # fmt: skip
+SCHOOLS = [
+    "University of California, Berkeley", "Stanford University",
+    "Massachusetts Institute of Technology", "University of Texas at Austin",
+    "University of Washington", "Georgia Institute of Technology",
+    "New York University", "Arizona State University", "Ohio State University",
+    "University of Michigan",
+]  # fmt: skip
+DEGREES = [
+    "Bachelor of Science - BS", "Bachelor of Arts - BA",
+    "Master of Science - MS", "Master of Business Administration - MBA",
+    "Doctor of Philosophy - PhD", "Associate's degree",
+]  # fmt: skip
+FIELDS = [
+    "Computer Science", "Business Administration", "Economics", "Nursing",
+    "Mechanical Engineering", "Psychology", "Marketing", "Mathematics",
+]  # fmt: skip
+LANGUAGES = [
+    "English", "Spanish", "French", "German", "Chinese", "Hindi", "Portuguese",
+    "Japanese", "Korean", "Arabic",
+]  # fmt: skip
+# the skills shared by most profiles first, then the rest of the table
+POPULAR_SKILLS = ["Python", "JavaScript", "SQL", "Java", "AWS", "React", "Docker"]
+SKILLS = POPULAR_SKILLS + [
+    skill for skill in ALLOWED_SKILLS if skill not in POPULAR_SKILLS
+]
+WORDS = (
+    "responsible for building maintaining and improving the team platform "
+    "customers services products using with across working closely on daily "
+    "operations reporting designed delivered led managed supported migrated "
+    "scalable reliable internal tools data pipelines stakeholders quarterly"
+).split()
+
+
+@dataclasses.dataclass
+class ProfileShape:
+    """Upper bounds per profile, counts are drawn uniformly up to them"""
+
+    experiences: int = 5
+    education: int = 2
+    languages: int = 2
+    projects: int = 1
+    # words per experience / project description, a sixth of them skills
+    description_words: int = 60
+
+
+def _skewed(rng: random.Random, values: list):
+    # the first entries are picked far more often than the last ones
+    return values[min(int(rng.paretovariate(1.2)) - 1, len(values) - 1)]
+
+
+def _date(rng: random.Random, year: int) -> dict:
+    return {"day": rng.randint(1, 28), "month": rng.randint(1, 12), "year": year}
+
+
+def _description(rng: random.Random, words: int) -> str | None:
+    if words <= 0:
+        return None
+
+    text = [
+        _skewed(rng, SKILLS) if rng.random() < 1 / 6 else rng.choice(WORDS)
+        for _ in range(words)
+    ]
+    return " ".join(text).capitalize() + "."
+
+
+def _linkedin(kind: str, name: str) -> str:
+    return f"https://www.linkedin.com/{kind}/{name.lower().replace(' ', '-')}"
+
+
+def generate_profile(rng: random.Random, index: int, shape: ProfileShape) -> dict:
+    first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    city, state = rng.choice(CITIES)
+    occupation = f"{rng.choice(TITLES)} at {_skewed(rng, COMPANIES)}"
+
+    experiences = []
+    year = 2024
+    for _ in range(rng.randint(1, max(1, shape.experiences))):
+        company = _skewed(rng, COMPANIES)
+        starts = year - rng.randint(1, 4)
+        experiences.append(
+            {
+                "starts_at": _date(rng, starts),
+                "ends_at": None if year == 2024 else _date(rng, year),
+                "company": company,
+                "company_linkedin_profile_url": _linkedin("company", company),
+                "title": rng.choice(TITLES),
+                "description": _description(rng, shape.description_words),
+                "location": f"{rng.choice(CITIES)[0]}, United States",
+                "logo_url": None,
+            }
+        )
+        year = starts
+
+    education = []
+    for _ in range(rng.randint(0, shape.education)):
+        school = _skewed(rng, SCHOOLS)
+        education.append(
+            {
+                "starts_at": _date(rng, year - 4),
+                "ends_at": _date(rng, year),
+                "field_of_study": rng.choice(FIELDS),
+                "degree_name": rng.choice(DEGREES),
+                "school": school,
+                "school_linkedin_profile_url": _linkedin("school", school),
+                "description": None,
+                "logo_url": None,
+            }
+        )
+        year -= 4
+
+    return {
+        "public_identifier": f"{first_name}-{last_name}-{index:08d}".lower(),
+        "profile_pic_url": f"https://example.com/pictures/{index:08d}.jpg",
+        "first_name": first_name,
+        "last_name": last_name,
+        "full_name": f"{first_name} {last_name}",
+        "occupation": occupation,
+        "headline": occupation,
+        "summary": _description(rng, shape.description_words),
+        "country": "US",
+        "country_full_name": "United States of America",
+        "city": city,
+        "state": state,
+        "connections": rng.randint(0, 500),
+        "experiences": experiences,
+        "education": education,
+        "languages": rng.sample(LANGUAGES, rng.randint(0, shape.languages)),
+        "accomplishment_projects": [
+            {
+                "title": "Project",
+                "description": _description(rng, shape.description_words),
+            }
+            for _ in range(rng.randint(0, shape.projects))
+        ],
+    }
+
+
+def generate_profiles(
+    count: int, seed: int = 0, shape: ProfileShape | None = None
+) -> Iterator[dict]:
+    rng = random.Random(seed)
+    shape = shape or ProfileShape()
+    for index in range(count):
+        yield generate_profile(rng, index, shape)
+
+
+def write_profiles(
+    path: str, count: int, seed: int = 0, shape: ProfileShape | None = None
+) -> None:
+    with open(path, "w") as f_out:
+        for profile in generate_profiles(count, seed, shape):
+            f_out.write(json.dumps(profile) + "\n")
+
+
+def app():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("destination", help="jsonl file to write")
+    parser.add_argument("--count", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    for field in dataclasses.fields(ProfileShape):
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}", type=int, default=field.default
+        )
+    args = parser.parse_args()
+
+    shape = ProfileShape(
+        **{
+            field.name: getattr(args, field.name)
+            for field in dataclasses.fields(ProfileShape)
+        }
+    )
+    write_profiles(args.destination, args.count, args.seed, shape)
+    print(f"{args.count:,} profiles written to {args.destination}")
+
+
+if __name__ == "__main__":
+    app()
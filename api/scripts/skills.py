@@ -0,0 +1,362 @@
+"""
+Skill extraction for the LinkDB importer.
+
+The skill table is compiled once at import time into a token n-gram index so
+a description is matched in a single pass over its tokens, including
+multi-word skills such as "React Native" or "Machine Learning".
+"""
+import re
+from collections.abc import Iterable
+
+from slugify import slugify
+
+# canonical skill names, matched case-insensitively
+ALLOWED_SKILLS = [
+    "3D Modeling",
+    "API",
+    "ASP.NET",
+    "AWS",
+    "Active Record",
+    "AdonisJS",
+    "Agile Methodologies",
+    "Ajax",
+    "POLARDDB",
+    "DocumentDB",
+    "DynamoDB",
+    "RDS",
+    "Android",
+    "Angular",
+    "Ant Design",
+    "Cassandra",
+    "Spark",
+    "AppleScript",
+    "Arduino",
+    "Artificial Intelligence",
+    "Assembly",
+    "Azure",
+    "Azure Cosmos DB (API for MongoDB)",
+    "Azure Cosmos DB (Core SQL API)",
+    "Bash",
+    "Beego",
+    "Blazor",
+    "Blockchain Technology",
+    "Bootstrap",
+    "Bulma",
+    "C",
+    "C#",
+    "C++",
+    "CSS",
+    "CakePHP",
+    "Chakra UI",
+    "ClickHouse",
+    "Cloudera Impala",
+    "CodeIgniter",
+    "Couchbase Server",
+    "Crystal",
+    "Cybersecurity",
+    "Dart",
+    "Data Analysis",
+    "DataStax Astra DB",
+    "Deno",
+    "DevOps",
+    "Django",
+    "Docker",
+    "Dockerfile",
+    "Druid",
+    "Echo",
+    "Elasticsearch",
+    "Element Plus",
+    "Elm",
+    "Emacs Lisp",
+    "Erlang",
+    "Express.js",
+    "F#",
+    "Facebook Presto",
+    "FastAPI",
+    "FeathersJS",
+    "Firebase",
+    "Firebird",
+    "Flask",
+    "Flutter",
+    "Fortran",
+    "Foundation",
+    "Frameworx",
+    "Game Development",
+    "GameMaker Language",
+    "Gin",
+    "Git",
+    "GitHub",
+    "Glsl",
+    "Go",
+    "Firestore",
+    "Google Cloud",
+    "GraphQL",
+    "Graphic Design",
+    "Greenplum",
+    "H2 Database",
+    "HBase",
+    "HDFS",
+    "HTML",
+    "Hadoop",
+    "Haml",
+    "Handlebars.js",
+    "Harbor",
+    "Haskell",
+    "Hazelcast",
+    "HeadlessUI",
+    "Hyperledger",
+    "Db2",
+    "InfluxDB",
+    "Inform7",
+    "Information Security",
+    "Ionic Framework",
+    "Java",
+    "JavaScript",
+    "JeffersonDB",
+    "Julia",
+    "Kafka",
+    "KairosDB",
+    "Kendo UI",
+    "Keycloak",
+    "Knox",
+    "Kohana",
+    "Kotlin",
+    "Kubernetes",
+    "LaTeX",
+    "Laravel",
+    "Less",
+    "LevelDB",
+    "LiteSpeed",
+    "Lua",
+    "LuaJIT",
+    "Lumen",
+    "MATLAB",
+    "Machine Learning",
+    "Makefile",
+    "Mapbox GL JS",
+    "MariaDB",
+    "Markdown",
+    "Material UI",
+    "Materialize CSS",
+    "Matplotlib",
+    "Memcached",
+    "Mermaid",
+    "Microsoft SQL Server",
+    "MongoDB",
+    "Mongoose",
+    "MySQL",
+    "NGINX",
+    "NativeScript",
+    "Neo4j",
+    "Network Security",
+    "NewSQL",
+    "Next.js",
+    "Nim",
+    "Node.js",
+    "NumPy",
+    "NuoDB",
+    "Nuxt.js",
+    "OCaml",
+    "ORM",
+    "Objective-C",
+    "OceanBase",
+    "Onsen UI",
+    "OpenCV",
+    "OpenSearch",
+    "Opentelemetry",
+    "Oracle",
+    "PHP",
+    "Pandas",
+    "Penetration Testing",
+    "Percona",
+    "Perl",
+    "Phabricator",
+    "PhoneGap",
+    "PlainText",
+    "PlanetScale",
+    "PostgreSQL",
+    "PowerShell",
+    "Preact",
+    "Prisma",
+    "Processing",
+    "Prometheus",
+    "Protobuf",
+    "Proxysql",
+    "Puppet",
+    "PureBasic",
+    "Python",
+    "QML",
+    "Quest",
+    "R",
+    "Racket",
+    "Radix",
+    "Rails",
+    "React",
+    "React Native",
+    "Redis",
+    "Redshift",
+    "Remix",
+    "RethinkDB",
+    "Riak",
+    "RoachDB",
+    "RobotFramework",
+    "Rpkg",
+    "Ruby",
+    "Rust",
+    "SQL",
+    "SQLite",
+    "Sanic",
+    "Sapientia",
+    "Sass",
+    "Scala",
+    "Scheme",
+    "Scikit-learn",
+    "Scrum",
+    "ScyllaDB",
+    "Selenium",
+    "Sencha Touch",
+    "Sequelize",
+    "Shaders",
+    "Shell",
+    "Sidekiq",
+    "SignalR",
+    "Snowflake",
+    "Socket.io",
+    "SocketCluster",
+    "Solidity",
+    "Spanner",
+    "Spring Boot",
+    "Supabase",
+    "Svelte",
+    "Swift",
+    "Sybase",
+    "Symfony",
+    "Tailwind CSS",
+    "Tcl",
+    "TensorFlow",
+    "Texinfo",
+    "Themeross",
+    "Thrift",
+    "TiDB",
+    "TimescaleDB",
+    "TinyDB",
+    "TokuMX",
+    "Traefik",
+    "TrueNAS",
+    "Twig",
+    "TypeDocs",
+    "TypeORM",
+    "TypeScript",
+    "Unity",
+    "Unreal Engine",
+    "UnrealScript",
+    "Upside",
+    "VBScript",
+    "VHDL",
+    "Vala",
+    "Vant",
+    "Verilog",
+    "Vite",
+    "Visual Basic .NET",
+    "VoltDB",
+    "Vue",
+    "Vuetify",
+    "VMware",
+    "WebAssembly",
+    "Websockets",
+    "Wren",
+    "Xamarin",
+    "YAML",
+    "Yii Framework",
+    "ZooKeeper",
+    "jQuery",
+]
+
+# alternative spellings, mapped to their canonical name
+SKILL_ALIASES = {
+    "Agile": "Agile Methodologies",
+    "Amazon Web Services": "AWS",
+    "CPP": "C++",
+    "ExpressJS": "Express.js",
+    "GCP": "Google Cloud",
+    "Golang": "Go",
+    "K8s": "Kubernetes",
+    "MSSQL": "Microsoft SQL Server",
+    "NextJS": "Next.js",
+    "NodeJS": "Node.js",
+    "NuxtJS": "Nuxt.js",
+    "OracleDB": "Oracle",
+    "Postgres": "PostgreSQL",
+    "React.js": "React",
+    "ReactJS": "React",
+    "Sklearn": "Scikit-learn",
+    "SQL Server": "Microsoft SQL Server",
+    "Tailwind": "Tailwind CSS",
+    "Vue.js": "Vue",
+    "VueJS": "Vue",
+}
+
+# words made of letters, digits, "#" and "+" optionally joined by "." or "-",
+# so "C++", "C#", "Node.js", "ASP.NET" and "Scikit-learn" stay a single token
+# while sentence punctuation ("... in Python.") is dropped
+_TOKEN = re.compile(r"[a-z0-9#+]+(?:[.\-][a-z0-9#+]+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def skill_id(name: str) -> str:
+    """Stable Skill node id, "++" and "#" are spelled out so C, C++ and C# differ"""
+    return slugify(name, replacements=[["++", "pp"], ["#", "sharp"]])
+
+
+class SkillMatcher:
+    """Token n-gram index over skill names and aliases.
+
+    Phrases are bucketed by their first token, longest first, so matching is a
+    dict lookup per token plus a comparison for the (few) phrases that start
+    with it. The longest phrase at a position wins and the scan resumes after
+    it, "React Native" therefore yields React Native and not React.
+    """
+
+    def __init__(self, skills: Iterable[str], aliases: dict[str, str]) -> None:
+        # skill id -> canonical name
+        self.names: dict[str, str] = {}
+        self._phrases: dict[str, list[tuple[tuple[str, ...], str]]] = {}
+
+        for name in skills:
+            self.names[skill_id(name)] = name
+            self._add(name, skill_id(name))
+
+        for alias, name in aliases.items():
+            self._add(alias, skill_id(name))
+
+        for phrases in self._phrases.values():
+            phrases.sort(key=lambda phrase: len(phrase[0]), reverse=True)
+
+    def _add(self, phrase: str, s_id: str) -> None:
+        tokens = tuple(tokenize(phrase))
+        if tokens:
+            self._phrases.setdefault(tokens[0], []).append((tokens, s_id))
+
+    def match(self, text: str) -> set[str]:
+        """Returns the ids of every skill mentioned in text"""
+        tokens = tokenize(text)
+        found = set()
+
+        idx = 0
+        while idx < len(tokens):
+            step = 1
+            for phrase, s_id in self._phrases.get(tokens[idx], ()):
+                if len(phrase) == 1 or tuple(tokens[idx : idx + len(phrase)]) == phrase:
+                    found.add(s_id)
+                    step = len(phrase)
+                    break
+
+            idx += step
+
+        return found
+
+
+skill_matcher = SkillMatcher(ALLOWED_SKILLS, SKILL_ALIASES)
@@ -1,4 +1,9 @@
+from collections.abc import Iterable, Sequence
+from typing import Any
+
 from faststream.redis.fastapi import RedisRouter
+from redis.asyncio import Redis
+from redis.typing import EncodableT
 
 from src.common.config import settings
 
@@ -7,3 +12,25 @@ router = RedisRouter(
 )
 
 broker = router.broker
+
+
+def redis_connection() -> Redis:
+    """The broker's connection, also used for the app's own keys (the redis
+    lifespan opens it)"""
+    if broker._connection is None:
+        raise RuntimeError("Redis is not connected")
+    return broker._connection
+
+
+async def run_script(
+    script: str, keys: Sequence[str], args: Iterable[EncodableT] = ()
+) -> Any:
+    """Runs a lua script by its sha (loading it the first time)"""
+    return await redis_connection().register_script(script)(keys, args)
+
+
+def stop_consuming() -> None:
+    """Stops taking new messages, the ones being handled finish (unlike
+    handler.close(), which cancels them), the lifespan closes the rest"""
+    for handler in broker.handlers.values():
+        handler.running = False
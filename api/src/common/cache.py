@@ -0,0 +1,268 @@
+"""
+Cache: short lived response cache in redis
+Entries are served fresh for ttl seconds and stale for another stale_ttl
+seconds while one background task refreshes them. Concurrent misses for the
+same key in a worker share a single load (single-flight).
+The keys of a scope (e.g. a grant) are also kept in a set, so invalidating a
+scope deletes exactly its keys instead of scanning the keyspace, and bumps the
+scope's generation so loads that started before are not cached.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections.abc import Awaitable, Callable
+from typing import Any, Generic, Protocol, TypeVar
+
+from loguru import logger
+from pydantic import TypeAdapter
+
+from .broker import redis_connection, run_script
+from .metrics import Counter, registry, timed
+
+T = TypeVar("T")
+
+CACHE_REQUESTS = registry.register(
+    Counter(
+        "cache_requests_total",
+        "Response cache lookups by result (hit, stale, miss)",
+        ("cache", "result"),
+    )
+)
+
+
+class CacheBackend(Protocol):
+    async def get(self, key: str) -> bytes | None:
+        ...
+
+    async def generation(self, group: str) -> int:
+        """Bumped every time the group is deleted"""
+        ...
+
+    async def set(
+        self, key: str, value: bytes, ttl: int, group: str, generation: int
+    ) -> bool:
+        """Stores value and adds key to the group, unless the group was deleted
+        since generation was read. Whether it was stored."""
+        ...
+
+    async def delete_group(self, group: str) -> None:
+        """Deletes every key of the group and bumps its generation"""
+        ...
+
+
+# stores the entry only if the group's generation is still the one read
+# before loading it
+SET_IF_CURRENT = """
+if tonumber(redis.call('GET', KEYS[3]) or '0') ~= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('SADD', KEYS[2], KEYS[1])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+DELETE_GROUP = """
+local keys = redis.call('SMEMBERS', KEYS[1])
+for i = 1, #keys, 500 do
+    redis.call('UNLINK', unpack(keys, i, math.min(i + 499, #keys)))
+end
+redis.call('DEL', KEYS[1])
+return redis.call('INCR', KEYS[2])
+"""
+
+
+def _generation_key(group: str) -> str:
+    # entry keys end in a hex digest, they can't collide with it
+    return f"{group}:generation"
+
+
+class RedisBackend:
+    """The redis behind the faststream broker, connected by its lifespan"""
+
+    async def get(self, key: str) -> bytes | None:
+        with timed("redis", "cache.get"):
+            value: bytes | None = await redis_connection().get(key)
+        return value
+
+    async def generation(self, group: str) -> int:
+        with timed("redis", "cache.generation"):
+            value = await redis_connection().get(_generation_key(group))
+        return int(value or 0)
+
+    async def set(
+        self, key: str, value: bytes, ttl: int, group: str, generation: int
+    ) -> bool:
+        # the group outlives its newest key, expired keys in it are harmless
+        # (unlinking them is a no-op)
+        with timed("redis", "cache.set"):
+            stored = await run_script(
+                SET_IF_CURRENT,
+                [key, group, _generation_key(group)],
+                [value, ttl, generation],
+            )
+        return bool(stored)
+
+    async def delete_group(self, group: str) -> None:
+        with timed("redis", "cache.delete_group"):
+            await run_script(DELETE_GROUP, [group, _generation_key(group)])
+
+
+class MemoryBackend:
+    """In-process backend for tests"""
+
+    def __init__(self, clock: Callable[[], float] = time.time) -> None:
+        self.clock = clock
+        self.values: dict[str, tuple[bytes, float]] = {}
+        self.groups: dict[str, set[str]] = {}
+        self.generations: dict[str, int] = {}
+
+    async def get(self, key: str) -> bytes | None:
+        value, expires = self.values.get(key, (None, 0.0))
+        if value is None or expires <= self.clock():
+            self.values.pop(key, None)
+            return None
+        return value
+
+    async def generation(self, group: str) -> int:
+        return self.generations.get(group, 0)
+
+    async def set(
+        self, key: str, value: bytes, ttl: int, group: str, generation: int
+    ) -> bool:
+        if self.generations.get(group, 0) != generation:
+            return False
+        self.values[key] = (value, self.clock() + ttl)
+        self.groups.setdefault(group, set()).add(key)
+        return True
+
+    async def delete_group(self, group: str) -> None:
+        for key in self.groups.pop(group, set()):
+            self.values.pop(key, None)
+        self.generations[group] = self.generations.get(group, 0) + 1
+
+
+class ResponseCache(Generic[T]):
+    def __init__(
+        self,
+        name: str,
+        adapter: TypeAdapter[T],
+        backend: CacheBackend,
+        ttl: int = 30,
+        stale_ttl: int = 300,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.name = name
+        self.adapter = adapter
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+
+        # loads in flight (misses and refreshes) by key
+        self._loads: dict[str, asyncio.Task[T]] = {}
+
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+
+    def group(self, scope: str) -> str:
+        """The set of the scope's keys"""
+        return f"cache:{self.name}:{scope}"
+
+    def key(self, scope: str, params: dict[str, Any]) -> str:
+        digest = hashlib.sha256(
+            json.dumps(params, sort_keys=True, default=str).encode()
+        ).hexdigest()[:32]
+        return f"{self.group(scope)}:{digest}"
+
+    async def _load(
+        self, scope: str, key: str, loader: Callable[[], Awaitable[T]]
+    ) -> T:
+        group = self.group(scope)
+        # read before loading, an invalidation while loading bumps it and the
+        # (possibly outdated) value isn't cached
+        try:
+            generation: int | None = await self.backend.generation(group)
+        except Exception as e:
+            logger.warning(f"Cache {self.name}: {e}")
+            generation = None
+
+        value = await loader()
+        if generation is None:
+            return value
+
+        entry = json.dumps(
+            {
+                "stored_at": self.clock(),
+                # field names, not aliases, that is what the models validate
+                "value": json.loads(self.adapter.dump_json(value)),
+            }
+        )
+        try:
+            await self.backend.set(
+                key, entry.encode(), self.ttl + self.stale_ttl, group, generation
+            )
+        except Exception as e:
+            # the value is still good, only caching it failed
+            logger.warning(f"Cache {self.name}: {e}")
+        return value
+
+    def _single_flight(
+        self, scope: str, key: str, loader: Callable[[], Awaitable[T]]
+    ) -> asyncio.Future[T]:
+        task = self._loads.get(key)
+        # a finished load is dropped by its callback, which may not have run yet
+        if task is None or task.done():
+            task = asyncio.ensure_future(self._load(scope, key, loader))
+            self._loads[key] = task
+            task.add_done_callback(lambda done: self._loaded(key, done))
+        return task
+
+    def _loaded(self, key: str, task: asyncio.Future[Any]) -> None:
+        if self._loads.get(key) is task:
+            del self._loads[key]
+        # background refreshes have nobody waiting on them
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Cache {self.name}: loading failed: {task.exception()}")
+
+    def _count(self, result: str) -> None:
+        setattr(self, result, getattr(self, result) + 1)
+        CACHE_REQUESTS.inc(self.name, result)
+
+    async def get_or_load(
+        self, scope: str, params: dict[str, Any], loader: Callable[[], Awaitable[T]]
+    ) -> T:
+        """The cached value for (scope, params), loaded with loader when missing
+        or expired. Stale values are returned as is and refreshed in the
+        background.
+        """
+        key = self.key(scope, params)
+        try:
+            entry = await self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Cache {self.name}: {e}")
+            entry = None
+
+        if entry is not None:
+            cached = json.loads(entry)
+            value = self.adapter.validate_python(cached["value"])
+            if self.clock() - cached["stored_at"] < self.ttl:
+                self._count("hits")
+            else:
+                self._count("stale")
+                self._single_flight(scope, key, loader)
+            return value
+
+        self._count("misses")
+        # shielded, a cancelled request must not cancel the load others wait on
+        return await asyncio.shield(self._single_flight(scope, key, loader))
+
+    async def invalidate(self, scope: str) -> None:
+        """Drops every cached entry of scope (e.g. a grant), loads of the scope
+        already in flight are neither shared with later requests nor cached"""
+        group = self.group(scope)
+        for key in [key for key in self._loads if key.startswith(f"{group}:")]:
+            del self._loads[key]
+        await self.backend.delete_group(group)
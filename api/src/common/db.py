@@ -1,3 +1,125 @@
+"""
+Database: the prisma client
+The query engine's pool is sized from the settings (it is per worker, so the
+database sees workers * db_connection_limit connections). Every query goes
+through _execute, which times it by model and action, applies the query
+timeout and logs slow queries with their shape (arguments without values).
+Cancelling the query there doesn't stop it in postgres, so the connections
+also get a statement_timeout, the longest of the query timeouts.
+"""
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+
+from loguru import logger
 from prisma import Prisma
+from pydantic import BaseModel
+
+from .config import settings
+from .metrics import Counter, registry, timed
+
+SLOW_QUERIES = registry.register(
+    Counter(
+        "db_slow_queries_total",
+        "Queries slower than db_slow_query_ms by model and action",
+        ("model", "action"),
+    )
+)
+
+
+def datasource_url(
+    url: str,
+    connection_limit: int | None = None,
+    pool_timeout: int | None = None,
+    statement_timeout: float | None = None,
+) -> str:
+    """The database url with the query engine's pool parameters and postgres'
+    statement_timeout (seconds) set"""
+    parts = urlsplit(url)
+    params = dict(parse_qsl(parts.query))
+    if connection_limit is not None:
+        params["connection_limit"] = str(connection_limit)
+    if pool_timeout is not None:
+        params["pool_timeout"] = str(pool_timeout)
+    if statement_timeout is not None:
+        option = f"-c statement_timeout={round(statement_timeout * 1000)}"
+        params["options"] = " ".join(filter(None, [params.get("options"), option]))
+    return urlunsplit(parts._replace(query=urlencode(params, quote_via=quote)))
+
+
+def query_shape(value: Any) -> Any:
+    """The arguments of a query with the values left out, for logging"""
+    if isinstance(value, dict):
+        return {
+            key: query_shape(item) for key, item in value.items() if item is not None
+        }
+    if isinstance(value, list | tuple):
+        return [query_shape(value[0])] if value else []
+    return "?"
+
+
+class InstrumentedPrisma(Prisma):
+    async def _execute(
+        self,
+        method: Any,
+        arguments: dict[str, Any],
+        model: type[BaseModel] | None = None,
+        root_selection: list[str] | None = None,
+    ) -> Any:
+        name = model.__name__ if model is not None else None
+        operation = f"{name}.{method}" if name else str(method)
+        timeout = settings.db_query_timeouts.get(operation, settings.db_query_timeout)
+
+        started = time.perf_counter()
+        try:
+            with timed("prisma", operation):
+                return await asyncio.wait_for(
+                    super()._execute(
+                        method=method,
+                        arguments=arguments,
+                        model=model,
+                        root_selection=root_selection,
+                    ),
+                    timeout,
+                )
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            if duration >= settings.db_slow_query_ms:
+                SLOW_QUERIES.inc(name or "raw", str(method))
+                logger.warning(
+                    f"Slow query {operation} took {duration:.0f}ms: "
+                    f"{query_shape(arguments)}"
+                )
+
+
+def statement_timeout() -> float | None:
+    """The server side limit, long enough for every query's own timeout"""
+    if settings.db_query_timeout is None:
+        return None
+    return max([settings.db_query_timeout, *settings.db_query_timeouts.values()])
+
+
+prisma = InstrumentedPrisma(
+    datasource={
+        "url": datasource_url(
+            settings.database_url,
+            connection_limit=settings.db_connection_limit,
+            pool_timeout=settings.db_pool_timeout,
+            statement_timeout=statement_timeout(),
+        )
+    },
+    connect_timeout=timedelta(seconds=settings.db_connect_timeout),
+)
+
+
+async def pool_metrics() -> str:
+    """The query engine's own metrics, including the connection pool (busy,
+    idle, wait time), in the prometheus format"""
+    if not prisma.is_connected():
+        return ""
+    return await prisma.get_metrics(format="prometheus")
+
 
-prisma = Prisma()
+registry.collect(pool_metrics)
@@ -0,0 +1,119 @@
+"""
+Grants: which nylas account (grant) a user's mailbox requests go to
+Resolved with a narrow query (the user's active accounts only, no joins) and
+kept in a small in-process TTL / LRU cache. Whoever changes nylas_account rows
+publishes the user id on ACCOUNTS_CHANNEL and every worker drops its entry.
+"""
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from datetime import datetime, timezone
+from typing import Any
+
+from prisma.models import nylas_account
+from pydantic import BaseModel
+
+from .broker import router as redis_router
+from .config import settings
+from .db import prisma
+
+ACCOUNTS_CHANNEL = "nylas.accounts.changed"
+
+
+class AccountChanged(BaseModel):
+    user_id: str
+
+
+class GrantCache:
+    """Active accounts by user id, oldest first"""
+
+    def __init__(
+        self,
+        max_size: int = 10_000,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries: OrderedDict[
+            str, tuple[list[nylas_account], float]
+        ] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, user_id: str) -> bool:
+        entry = self.entries.get(user_id)
+        if entry is not None and entry[1] <= self.clock():
+            del self.entries[user_id]
+            return False
+        return entry is not None
+
+    def get(self, user_id: str) -> list[nylas_account]:
+        """The cached accounts, check membership first"""
+        self.entries.move_to_end(user_id)
+        return self.entries[user_id][0]
+
+    def set(self, user_id: str, accounts: list[nylas_account]) -> None:
+        self.entries[user_id] = (accounts, self.clock() + self.ttl)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        self.entries.pop(user_id, None)
+
+
+grant_cache = GrantCache(
+    max_size=settings.grant_cache_size,
+    ttl=settings.grant_cache_ttl,
+)
+
+
+async def resolve_accounts(user_id: str) -> list[nylas_account]:
+    """The user's active (not deleted, not expired) nylas accounts, oldest first"""
+    if user_id in grant_cache:
+        return grant_cache.get(user_id)
+
+    accounts = await prisma.nylas_account.find_many(
+        where={"user_id": user_id, "deleted_at": None, "expired": False},
+        order={"created_at": "asc"},
+    )
+
+    grant_cache.set(user_id, accounts)
+    return accounts
+
+
+async def resolve_account(user_id: str) -> nylas_account | None:
+    """The user's first active nylas account"""
+    accounts = await resolve_accounts(user_id)
+    return accounts[0] if accounts else None
+
+
+async def account_changed(user_id: str) -> None:
+    """Call after changing a nylas_account row of the user"""
+    # this worker forgets right away, the others once the message arrives
+    grant_cache.invalidate(user_id)
+    await redis_router.broker.publish(
+        AccountChanged(user_id=user_id), channel=ACCOUNTS_CHANNEL
+    )
+
+
+async def grant_revoked(grant_id: str, deleted: bool = False) -> None:
+    """Marks the accounts of a grant expired (or deleted)"""
+    accounts = await prisma.nylas_account.find_many(where={"grant_id": grant_id})
+
+    data: dict[str, Any] = (
+        {"deleted_at": datetime.now(timezone.utc)} if deleted else {"expired": True}
+    )
+    await prisma.nylas_account.update_many(where={"grant_id": grant_id}, data=data)
+
+    for user_id in {account.user_id for account in accounts}:
+        await account_changed(user_id)
+
+
+# pub/sub, so every worker gets every message
+@redis_router.subscriber(channel=ACCOUNTS_CHANNEL)
+async def on_account_changed(message: AccountChanged) -> None:
+    grant_cache.invalidate(message.user_id)
@@ -0,0 +1,113 @@
+"""
+Health: dependency probes run in the background
+Each dependency is probed on an interval (with a timeout) and the latest result
+is kept in memory, so health endpoints answer from that state without touching
+the dependencies themselves.
+"""
+import asyncio
+import contextlib
+import time
+from collections.abc import Awaitable, Callable
+
+from loguru import logger
+from pydantic import BaseModel
+
+
+class DependencyHealth(BaseModel):
+    healthy: bool
+    # readiness only depends on critical dependencies
+    critical: bool = True
+    latency_ms: float | None = None
+    error: str | None = None
+    # unix seconds, None until the first probe finished
+    checked_at: float | None = None
+
+
+class Probe:
+    def __init__(
+        self,
+        name: str,
+        check: Callable[[], Awaitable[object]],
+        critical: bool = True,
+    ) -> None:
+        self.name = name
+        self.check = check
+        self.critical = critical
+
+
+class HealthMonitor:
+    def __init__(
+        self,
+        probes: list[Probe],
+        interval: float = 10.0,
+        timeout: float = 2.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.probes = probes
+        self.interval = interval
+        self.timeout = timeout
+        self.clock = clock
+
+        self.status = {
+            probe.name: DependencyHealth(
+                healthy=False, critical=probe.critical, error="not probed yet"
+            )
+            for probe in probes
+        }
+        self._task: asyncio.Task[None] | None = None
+
+    async def _probe(self, probe: Probe) -> None:
+        started = time.perf_counter()
+        error = None
+        try:
+            await asyncio.wait_for(probe.check(), self.timeout)
+        except asyncio.TimeoutError:
+            error = f"timed out after {self.timeout}s"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        if error and self.status[probe.name].healthy:
+            logger.warning(f"Health: {probe.name} is down: {error}")
+        self.status[probe.name] = DependencyHealth(
+            healthy=error is None,
+            critical=probe.critical,
+            latency_ms=round((time.perf_counter() - started) * 1000, 3),
+            error=error,
+            checked_at=self.clock(),
+        )
+
+    async def probe(self) -> None:
+        """Probes every dependency once, concurrently"""
+        await asyncio.gather(*(self._probe(probe) for probe in self.probes))
+
+    async def _run(self) -> None:
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.interval)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def ready(self) -> bool:
+        """Every critical dependency answered its latest, recent enough, probe"""
+        # a stuck prober must not keep reporting the last good state
+        oldest = self.clock() - 3 * self.interval - self.timeout
+        return all(
+            status.healthy
+            and status.checked_at is not None
+            and status.checked_at >= oldest
+            for status in self.status.values()
+            if status.critical
+        )
@@ -1,11 +1,22 @@
 """
 Routes: Healthcheck
+Served from the health monitor's last probes, the dependencies are probed in
+the background (see health.py), not on every request.
 """
-from fastapi import APIRouter
+import contextlib
+from collections.abc import AsyncIterator
+from typing import Any
+
+from fastapi import APIRouter, FastAPI, Response, status
 from pydantic import BaseModel
 
-from .broker import router as redis_router
+from .broker import redis_connection
+from .config import settings
 from .db import prisma
+from .health import DependencyHealth, HealthMonitor, Probe
+from .lifespans import in_flight
+from .metrics import timed
+from .nylas import nylas_client
 
 # no auth for healthcheck
 router = APIRouter(tags=["healthcheck"])
@@ -15,20 +26,65 @@ class HealthCheckResponse(BaseModel):
     """Health check response model"""
 
     healthy: bool
+    dependencies: dict[str, DependencyHealth] = {}
+
+
+async def _postgres() -> None:
+    # ensure we can query the db
+    await prisma.query_raw("SELECT 1")
+
+
+async def _redis() -> None:
+    with timed("redis", "ping"):
+        await redis_connection().ping()
+
+
+async def _nylas() -> None:
+    # reachability only, any http answer will do
+    with timed("nylas", "head"):
+        await nylas_client.client.head("/", timeout=settings.health_timeout)
+
+
+health_monitor = HealthMonitor(
+    [
+        Probe("postgres", _postgres),
+        Probe("redis", _redis),
+        # nylas being down degrades the mailbox routes, the pod is still ready
+        Probe("nylas", _nylas, critical=False),
+    ],
+    interval=settings.health_interval,
+    timeout=settings.health_timeout,
+)
+
+
+@contextlib.asynccontextmanager
+async def health_lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Probes in the background while the app is up"""
+    health_monitor.start()
+    yield
+    await health_monitor.stop()
+
+
+@router.get("/livez", response_model=HealthCheckResponse)
+async def livez() -> dict[str, Any]:
+    """The worker is up and its event loop is responsive"""
+    return {"healthy": True}
+
+
+@router.get("/readyz", response_model=HealthCheckResponse)
+async def readyz(response: Response) -> dict[str, Any]:
+    """Critical dependencies answered their latest probes, with per dependency
+    detail"""
+    # shutting down, the load balancer should stop sending requests
+    healthy = health_monitor.ready() and not in_flight.draining
+    if not healthy:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+
+    return {"healthy": healthy, "dependencies": health_monitor.status}
 
 
 @router.get("/healthcheck", response_model=HealthCheckResponse)
-async def healthcheck():
-    """Simple healthcheck endpoint, extend with downstream healthchecks"""
-    # downstream checks
-    try:
-        # ensure we can query the db
-        await prisma.query_raw("SELECT 1")
-
-        # how about redis?
-        # await redis_router.ping()
-        await redis_router.broker._connection.ping()
-
-        return {"healthy": True}
-    except Exception:
-        return {"healthy": False}
+async def healthcheck() -> dict[str, Any]:
+    """Simple healthcheck endpoint, kept for the existing checks (readiness,
+    always 200)"""
+    return {"healthy": health_monitor.ready(), "dependencies": health_monitor.status}
@@ -0,0 +1,65 @@
+"""
+Inbox: one listing over all of a user's grants
+Every grant is asked at the same time and whatever answered by the deadline
+is merged newest first, so a request takes about as long as the slowest grant
+(or the deadline), not the sum. Grants that failed or timed out are left out
+and reported by the caller.
+"""
+import asyncio
+import heapq
+import itertools
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Protocol, TypeVar
+
+T = TypeVar("T")
+
+
+class Dated(Protocol):
+    created_at: int | None
+
+
+P = TypeVar("P", bound=Dated)
+
+
+async def gather_grants(
+    grant_ids: Iterable[str],
+    fetch: Callable[[str], Awaitable[T]],
+    deadline: float,
+) -> dict[str, T | BaseException]:
+    """Runs fetch for every grant concurrently, returns each grant's result or
+    exception. Grants still running at the deadline are cancelled and missing.
+    """
+    tasks = {
+        grant_id: asyncio.ensure_future(fetch(grant_id))
+        for grant_id in dict.fromkeys(grant_ids)
+    }
+    if not tasks:
+        return {}
+
+    try:
+        await asyncio.wait(tasks.values(), timeout=deadline)
+    finally:
+        # also when the request itself is cancelled
+        for task in tasks.values():
+            task.cancel()
+
+    results: dict[str, T | BaseException] = {}
+    for grant_id, task in tasks.items():
+        # cancelling only takes effect on the next loop iteration
+        if not task.done() or task.cancelled():
+            continue
+        results[grant_id] = task.exception() or task.result()
+    return results
+
+
+def _newest(item: Dated) -> int:
+    return item.created_at or 0
+
+
+def merge_newest(pages: Iterable[list[P]], limit: int) -> list[P]:
+    """k-way merge of the grants' pages, newest first, up to limit items"""
+    # nylas pages are newest first already, sorting a sorted page is linear
+    ordered = [sorted(page, key=_newest, reverse=True) for page in pages]
+    return list(
+        itertools.islice(heapq.merge(*ordered, key=_newest, reverse=True), limit)
+    )
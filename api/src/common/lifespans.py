@@ -1,29 +1,242 @@
+"""
+Lifespans: starts and stops the app's lifespans
+Lifespans declare what they start after, independent ones start concurrently
+(each within a timeout) and a failing one cancels the rest. On shutdown the
+work in flight (requests, broker messages) is drained first, then the
+lifespans are exited in reverse order.
+"""
+import asyncio
 import contextlib
-from collections.abc import AsyncIterator, Callable, Sequence
+import time
+from collections.abc import AsyncIterator, Callable, Iterator, Sequence
 from contextlib import AbstractAsyncContextManager
 
 from fastapi import FastAPI
+from loguru import logger
 
+LifespanFactory = Callable[[FastAPI], AbstractAsyncContextManager[None]]
+# a started lifespan: its name, the event that stops it and the task running it
+_Entered = tuple[str, asyncio.Event, asyncio.Task[None]]
 
-@contextlib.asynccontextmanager
-async def _manager(
-    app: FastAPI,
-    lifespans: Sequence[Callable[[FastAPI], AbstractAsyncContextManager[None]]],
-) -> AsyncIterator[None]:
-    exit_stack = contextlib.AsyncExitStack()
-    async with exit_stack:
-        for lifespan in lifespans:
-            await exit_stack.enter_async_context(lifespan(app))
-        yield
+
+def _ms(started: float) -> int:
+    return round((time.perf_counter() - started) * 1000)
+
+
+class Lifespan:
+    def __init__(
+        self,
+        lifespan: LifespanFactory,
+        name: str | None = None,
+        after: Sequence[str] = (),
+        timeout: float | None = None,
+    ) -> None:
+        self.lifespan = lifespan
+        self.name = name or str(getattr(lifespan, "__name__", "lifespan"))
+        # names of lifespans that have to be started first
+        self.after = tuple(after)
+        # startup timeout in seconds, the Lifespans default when None
+        self.timeout = timeout
+
+
+class InFlight:
+    """Counts the work in flight (requests, broker messages) so shutdown can
+    wait for it to finish"""
+
+    def __init__(self) -> None:
+        self.active = 0
+        # set once shutdown started, readiness reports it
+        self.draining = False
+        # called when draining starts, to stop taking new work (e.g. consuming)
+        self.on_drain: list[Callable[[], None]] = []
+        self._idle: asyncio.Event | None = None
+
+    def start_draining(self) -> None:
+        """Readiness turns 503 and the on_drain callbacks run, once"""
+        if self.draining:
+            return
+
+        self.draining = True
+        for callback in self.on_drain:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"InFlight: on_drain callback failed: {e}")
+
+    @contextlib.contextmanager
+    def track(self) -> Iterator[None]:
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            if not self.active and self._idle is not None:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Waits for the work in flight, False when some is left at the timeout"""
+        if not self.active:
+            return True
+
+        self._idle = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._idle = None
+
+
+in_flight = InFlight()
 
 
 class Lifespans:
     def __init__(
         self,
-        lifespans: Sequence[Callable[[FastAPI], AbstractAsyncContextManager[None]]],
+        lifespans: Sequence[Lifespan | LifespanFactory],
+        in_flight: InFlight | None = None,
+        startup_timeout: float | None = 30.0,
+        drain_timeout: float = 10.0,
+        shutdown_timeout: float = 10.0,
     ) -> None:
-        self.lifespans = lifespans
+        # plain lifespans start after the one before them, like a stack
+        self.lifespans: list[Lifespan] = []
+        for lifespan in lifespans:
+            if not isinstance(lifespan, Lifespan):
+                previous = self.lifespans[-1:]
+                lifespan = Lifespan(lifespan, after=[s.name for s in previous])
+            self.lifespans.append(lifespan)
+
+        # dependencies have to be listed first, which also rules out cycles
+        names: set[str] = set()
+        for lifespan in self.lifespans:
+            unknown = set(lifespan.after) - names
+            if unknown:
+                raise ValueError(
+                    f"Lifespan {lifespan.name} starts after {sorted(unknown)}, "
+                    "which are not listed before it"
+                )
+            if lifespan.name in names:
+                raise ValueError(f"Lifespan {lifespan.name} is listed twice")
+            names.add(lifespan.name)
+
+        self.in_flight = in_flight
+        self.startup_timeout = startup_timeout
+        self.drain_timeout = drain_timeout
+        self.shutdown_timeout = shutdown_timeout
 
     def __call__(self, app: FastAPI) -> AbstractAsyncContextManager[None]:
         self.app = app
-        return _manager(app, lifespans=self.lifespans)
+        return self._manager(app)
+
+    @contextlib.asynccontextmanager
+    async def _manager(self, app: FastAPI) -> AsyncIterator[None]:
+        started = time.perf_counter()
+        entered = await self._start(app)
+        logger.info(f"Lifespans: startup took {_ms(started)}ms")
+
+        try:
+            yield
+        finally:
+            started = time.perf_counter()
+            await self._drain()
+            await self._stop(entered)
+            logger.info(f"Lifespans: shutdown took {_ms(started)}ms")
+
+    async def _start(self, app: FastAPI) -> list[_Entered]:
+        # in the order they finished starting, a valid order to stop them in
+        entered: list[_Entered] = []
+        started: dict[str, asyncio.Future[None]] = {}
+        tasks: dict[str, asyncio.Task[None]] = {}
+
+        async def run(lifespan: Lifespan, stop: asyncio.Event) -> None:
+            # entered and exited in this one task, lifespans using cancel
+            # scopes, task groups or contextvars rely on it
+            try:
+                if lifespan.after:
+                    await asyncio.gather(*(started[name] for name in lifespan.after))
+
+                began = time.perf_counter()
+                manager = lifespan.lifespan(app)
+                timeout = lifespan.timeout or self.startup_timeout
+                try:
+                    async with asyncio.timeout(timeout):
+                        await manager.__aenter__()
+                except TimeoutError as e:
+                    raise TimeoutError(
+                        f"Lifespan {lifespan.name} did not start within {timeout}s"
+                    ) from e
+            except asyncio.CancelledError:
+                started[lifespan.name].cancel()
+                raise
+            except BaseException as e:
+                started[lifespan.name].set_exception(e)
+                raise
+
+            entered.append((lifespan.name, stop, tasks[lifespan.name]))
+            started[lifespan.name].set_result(None)
+            logger.info(f"Lifespans: started {lifespan.name} in {_ms(began)}ms")
+
+            await stop.wait()
+            began = time.perf_counter()
+            try:
+                async with asyncio.timeout(self.shutdown_timeout):
+                    await manager.__aexit__(None, None, None)
+            except TimeoutError:
+                logger.error(
+                    f"Lifespans: {lifespan.name} did not stop within "
+                    f"{self.shutdown_timeout}s"
+                )
+            except Exception as e:
+                logger.error(f"Lifespans: stopping {lifespan.name} failed: {e}")
+            else:
+                logger.info(f"Lifespans: stopped {lifespan.name} in {_ms(began)}ms")
+
+        loop = asyncio.get_running_loop()
+        for lifespan in self.lifespans:
+            started[lifespan.name] = loop.create_future()
+            tasks[lifespan.name] = asyncio.create_task(run(lifespan, asyncio.Event()))
+
+        try:
+            done, _ = await asyncio.wait(
+                started.values(), return_when=asyncio.FIRST_EXCEPTION
+            )
+            for future in done:
+                if not future.cancelled() and future.exception() is not None:
+                    raise future.exception()  # type: ignore[misc]
+        except BaseException as e:
+            logger.error(f"Lifespans: startup failed: {e}")
+            # the ones still starting are cancelled, the started ones stopped
+            names = {name for name, _, _ in entered}
+            starting = [task for name, task in tasks.items() if name not in names]
+            for task in starting:
+                task.cancel()
+            await asyncio.gather(*starting, return_exceptions=True)
+            for future in started.values():
+                if future.done() and not future.cancelled():
+                    future.exception()
+            await self._stop(entered)
+            raise
+
+        return entered
+
+    async def _drain(self) -> None:
+        if self.in_flight is None:
+            return
+
+        started = time.perf_counter()
+        # the server may have started draining already, on SIGTERM
+        self.in_flight.start_draining()
+        if await self.in_flight.wait_idle(self.drain_timeout):
+            logger.info(f"Lifespans: drained in {_ms(started)}ms")
+        else:
+            logger.warning(
+                f"Lifespans: {self.in_flight.active} still in flight after "
+                f"{self.drain_timeout}s, shutting down anyway"
+            )
+
+    async def _stop(self, entered: list[_Entered]) -> None:
+        for _, stop, task in reversed(entered):
+            stop.set()
+            await asyncio.gather(task, return_exceptions=True)
@@ -1,14 +1,28 @@
-import json
+import atexit
+import contextlib
 import logging
+import os
+import queue
 import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import AsyncIterator
 from datetime import datetime
+from typing import Any, Literal, TextIO
 
+import ujson
+from fastapi import FastAPI
 from loguru import logger
+from starlette.concurrency import run_in_threadpool
 
+from src.common.config import settings
 
-def sink_serializer(message):
-    """Very simplified serializer for json logging"""
-    record = message.record
+OverflowPolicy = Literal["drop_debug_first", "block", "sample"]
+
+
+def _simplify(record: dict[str, Any]) -> dict[str, Any]:
+    """Very simplified record for json logging"""
     simplified = {
         "level": record["level"].name,
         "msg": record["message"],
@@ -33,8 +47,157 @@ def sink_serializer(message):
             if not isinstance(record["message"], str) or len(record["message"]) == 0:
                 del simplified["msg"]
 
-    serialized = json.dumps(simplified)
-    print(serialized, file=sys.stdout)
+    return simplified
+
+
+class JsonLogSink:
+    """Non-blocking loguru sink, the calling (event loop) thread only puts the
+    record on a bounded queue. A background thread serializes records with
+    ujson and writes them in newline delimited chunks of up to flush_size
+    bytes, at least every flush_interval seconds.
+
+    When the queue is full the overflow policy decides:
+        drop_debug_first: drop records below INFO, block for the others
+        block: always wait for room
+        sample: keep (wait for) one in sample_rate records, drop the rest
+
+    The writer is a daemon thread, an atexit hook drains it so records logged
+    outside the app's lifespan (startup failures, the supervisor, uvicorn's
+    last lines) are written too.
+    """
+
+    def __init__(
+        self,
+        stream: TextIO | None = None,
+        queue_size: int = 10_000,
+        flush_size: int = 64 * 1024,
+        flush_interval: float = 0.5,
+        overflow: OverflowPolicy = "drop_debug_first",
+        sample_rate: int = 10,
+    ) -> None:
+        self.stream = stream
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.sample_rate = max(1, sample_rate)
+
+        self.queue: queue.Queue[dict[str, Any] | None] = queue.Queue(maxsize=queue_size)
+        # records dropped per level name
+        self.dropped: Counter[str] = Counter()
+        self._overflowed = 0
+        self._thread: threading.Thread | None = None
+        self._pid = 0
+        # the process the queue's records were logged in
+        self._queue_pid = os.getpid()
+        self._atexit_pid = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, message: Any) -> None:
+        self._ensure_started()
+        record = message.record
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        self._overflowed += 1
+        if (
+            self.overflow == "block"
+            or (
+                self.overflow == "drop_debug_first"
+                and record["level"].no >= logging.INFO
+            )
+            or (self.overflow == "sample" and self._overflowed % self.sample_rate == 0)
+        ):
+            self.queue.put(record)
+        else:
+            self.dropped[record["level"].name] += 1
+
+    def _ensure_started(self) -> None:
+        # (re)start the writer lazily, threads don't survive a fork into workers
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._lock:
+            if self._pid != pid:
+                # a forked child starts empty, the parent writes its own
+                # records. Restarted after close() in the same process, what
+                # is still queued is written first.
+                if self._queue_pid != pid:
+                    self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                    self._queue_pid = pid
+                if self._atexit_pid != pid:
+                    atexit.register(self.close)
+                    self._atexit_pid = pid
+
+                self._thread = threading.Thread(
+                    target=self._run, name="log-sink", daemon=True
+                )
+                self._thread.start()
+                self._pid = pid
+
+    def _run(self) -> None:
+        stream = self.stream or sys.stdout
+        chunk: list[str] = []
+        size = 0
+        deadline = time.monotonic() + self.flush_interval
+        running = True
+
+        while running:
+            try:
+                record = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if record is None:
+                    running = False
+                else:
+                    line = (
+                        ujson.dumps(_simplify(record), escape_forward_slashes=False)
+                        + "\n"
+                    )
+                    chunk.append(line)
+                    size += len(line)
+            except queue.Empty:
+                pass
+
+            if size >= self.flush_size or time.monotonic() >= deadline or not running:
+                if chunk:
+                    stream.write("".join(chunk))
+                    stream.flush()
+                    chunk, size = [], 0
+                deadline = time.monotonic() + self.flush_interval
+
+    def close(self) -> None:
+        """Writes everything queued so far and stops the writer, logging again
+        restarts it"""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+
+            self.queue.put(None)
+            self._thread.join()
+            self._thread, self._pid = None, 0
+
+        if self.dropped:
+            dropped = ", ".join(f"{level}={n}" for level, n in self.dropped.items())
+            print(f"log sink dropped records: {dropped}", file=sys.stderr)
+
+
+# the sink main.py hands to loguru, drained by log_sink_lifespan
+log_sink = JsonLogSink(
+    queue_size=settings.log_queue_size,
+    flush_size=settings.log_flush_size,
+    flush_interval=settings.log_flush_interval,
+    overflow=settings.log_overflow,
+    sample_rate=settings.log_sample_rate,
+)
+
+
+@contextlib.asynccontextmanager
+async def log_sink_lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Drains the log sink on shutdown, first in Lifespans so it exits last"""
+    yield
+    await run_in_threadpool(log_sink.close)
 
 
 class InterceptHandler(logging.Handler):
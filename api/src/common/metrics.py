@@ -0,0 +1,215 @@
+"""
+Metrics: in-process registry exposed in the prometheus text format
+Values are kept per worker process (scrape every worker, or sum them), updates
+are plain dict updates on the event loop thread so no locks are taken.
+"""
+import abc
+import bisect
+import contextlib
+import time
+from collections.abc import Awaitable, Callable, Iterator, Sequence
+from typing import TypeVar
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from loguru import logger
+
+# seconds, the prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+class Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[str]:
+        """The exposition lines of every label set"""
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels: str) -> None:
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (+inf last), sum]
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+
+        # only the matching bucket is incremented, they are summed up on render
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def samples(self) -> Iterator[str]:
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts, strict=True):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                bucket = _labels(self.labelnames, labels, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total[0]!r}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+        # exposition text from elsewhere (e.g. the query engine), added as is
+        self.collectors: list[Callable[[], Awaitable[str]]] = []
+
+    def register(self, metric: M) -> M:
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self, collector: Callable[[], Awaitable[str]]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render())
+
+
+registry = Registry()
+
+# requests, labelled by the route template (/v1/users/{user_id}) not the url
+REQUEST_LATENCY = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Request latency by route",
+        ("method", "route"),
+    )
+)
+REQUESTS_IN_FLIGHT = registry.register(
+    Gauge("http_requests_in_flight", "Requests currently being handled", ("method",))
+)
+RESPONSES = registry.register(
+    Counter(
+        "http_responses_total",
+        "Responses by route and status",
+        ("method", "route", "status"),
+    )
+)
+RESPONSE_BYTES = registry.register(
+    Counter(
+        "http_response_bytes_total",
+        "Response body bytes sent by route",
+        ("method", "route"),
+    )
+)
+
+# downstream calls: prisma, nylas, redis
+DEPENDENCY_LATENCY = registry.register(
+    Histogram(
+        "dependency_call_duration_seconds",
+        "Latency of calls to downstream dependencies",
+        ("dependency", "operation"),
+    )
+)
+DEPENDENCY_ERRORS = registry.register(
+    Counter(
+        "dependency_call_errors_total",
+        "Failed calls to downstream dependencies",
+        ("dependency", "operation"),
+    )
+)
+
+
+@contextlib.contextmanager
+def timed(dependency: str, operation: str) -> Iterator[None]:
+    """Times a downstream call, works around sync and async code alike
+    >>> with timed("nylas", "messages.list"):
+    ...     messages = await nylas_client.request(...)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        DEPENDENCY_ERRORS.inc(dependency, operation)
+        raise
+    finally:
+        DEPENDENCY_LATENCY.observe(time.perf_counter() - started, dependency, operation)
+
+
+# no auth for metrics, like the healthcheck
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    """Prometheus text exposition of this worker's metrics"""
+    text = registry.render() + "\n"
+    for collector in registry.collectors:
+        try:
+            collected = await collector()
+        except Exception as e:
+            logger.warning(f"Metrics: collecting {collector.__name__} failed: {e}")
+            continue
+        if collected:
+            text += collected.rstrip("\n") + "\n"
+
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
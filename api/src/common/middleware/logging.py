@@ -1,15 +1,14 @@
-import dataclasses
 import http
 import logging
 import math
+import random
 import time
-from typing import ClassVar
 
-from fastapi import Request, Response
 from loguru import logger
 from pydantic import BaseModel
-from starlette.middleware.base import RequestResponseEndpoint
-from starlette.types import Receive
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.common.config import settings
 
 EMPTY_VALUE = ""
 PORT = "8000"
@@ -17,6 +16,9 @@ PASS_ROUTES = [
     "/openapi.json",
     "/docs",
     "/healthcheck",
+    "/livez",
+    "/readyz",
+    "/metrics",
 ]
 
 
@@ -29,99 +31,143 @@ class RequestJsonLogSchema(BaseModel):
     path: str
     status: int
     latency: int
+    # body bytes sent
+    response_bytes: int
 
     module: str
     function: str
 
 
-@dataclasses.dataclass
-class ReceiveProxy:
-    """Proxy to starlette.types.Receive.__call__ with caching first receive call.
-    https://github.com/tiangolo/fastapi/issues/394#issuecomment-994665859
-    """
-
-    receive: Receive
-    cached_body: bytes
-    _is_first_call: ClassVar[bool] = True
+def _always_kept(status: int, duration: int) -> bool:
+    """Errors and slow requests are logged whatever the route's sampling or
+    level"""
+    if settings.access_log_errors and status >= 500:
+        return True
+    return duration >= settings.access_log_slow_ms
 
-    async def __call__(self):
-        # First call will be for getting request body => returns cached result
-        if self._is_first_call:
-            self._is_first_call = False
-            return {
-                "type": "http.request",
-                "body": self.cached_body,
-                "more_body": False,
-            }
 
-        return await self.receive()
+def _sampled(route: str) -> bool:
+    """Whether the access log line for an ordinary request is written at all"""
+    rate = settings.access_log_route_sample_rates.get(
+        route, settings.access_log_sample_rate
+    )
+    return rate >= 1 or random.random() < rate
 
 
 class LoggingMiddleware:
-    """Middleware that saves logs to JSON
-    The main problem is
-    After getting request_body
-        body = await request.body()
-    Body is removed from requests. I found solution as ReceiveProxy
+    """Pure ASGI middleware that saves access logs to JSON
+    Only send is wrapped to capture the status and the bytes sent, the body is
+    passed through untouched so streaming responses keep streaming.
     """
 
-    async def __call__(
-        self, request: Request, call_next: RequestResponseEndpoint, *args, **kwargs
-    ):
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+        # routes logged below the sink's level are skipped before building
+        # the log line, like unsampled ones
+        minimum = logger.level(settings.log_level.upper()).no
+        self.levels = {
+            route: level.upper()
+            for route, level in settings.access_log_route_levels.items()
+        }
+        self.muted = {
+            route
+            for route, level in self.levels.items()
+            if logger.level(level).no < minimum
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # pass /openapi.json /docs (and anything that is not a request)
+        if scope["type"] != "http" or scope["path"] in PASS_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
         # logger.debug(f"Started Middleware: {__name__}")
-        start_time = time.time()
+        start_time = time.perf_counter()
         exception_object = None
-        request_headers: dict = dict(request.headers.items())
+        status = http.HTTPStatus.INTERNAL_SERVER_ERROR.value
+        started = False
+        size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, started, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                started = True
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+
+            await send(message)
 
-        # Response Side
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_wrapper)
         except Exception as ex:
             logging.error(f"Exception: {ex}")
-            response_body = bytes(http.HTTPStatus.INTERNAL_SERVER_ERROR.phrase.encode())
-            response = Response(
-                content=response_body,
-                status_code=http.HTTPStatus.INTERNAL_SERVER_ERROR.real,
-            )
             exception_object = ex
-        else:
-            dict(response.headers.items())
-            response_body = b""
-
-            async for chunk in response.body_iterator:
-                response_body += chunk
-
-            response = Response(
-                content=response_body,
-                status_code=response.status_code,
-                headers=dict(response.headers),
-                media_type=response.media_type,
+            status = http.HTTPStatus.INTERNAL_SERVER_ERROR.value
+
+            # too late to turn it into a 500 once the response started
+            if started:
+                raise
+
+            response_body = http.HTTPStatus.INTERNAL_SERVER_ERROR.phrase.encode()
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": status,
+                    "headers": [
+                        (b"content-length", str(len(response_body)).encode()),
+                        (b"content-type", b"text/plain; charset=utf-8"),
+                    ],
+                }
             )
+            await send({"type": "http.response.body", "body": response_body})
+            size = len(response_body)
+        finally:
+            duration: int = math.ceil((time.perf_counter() - start_time) * 1000)
+            self.log(scope, status, duration, size, exception_object)
+
+    def log(
+        self,
+        scope: Scope,
+        status: int,
+        duration: int,
+        size: int,
+        exception: Exception | None,
+    ) -> None:
+        path: str = scope["path"]
+        route: str = getattr(scope.get("route"), "path", path)
+        kept = exception is not None or _always_kept(status, duration)
+        if not kept and (route in self.muted or not _sampled(route)):
+            return
+
+        # a muted route's level would be filtered out by the sink
+        level = (
+            settings.log_level.upper()
+            if route in self.muted
+            else self.levels.get(route, "INFO")
+        )
 
-        # pass /openapi.json /docs
-        if request.url.path in PASS_ROUTES:
-            return response
-
-        duration: int = math.ceil((time.time() - start_time) * 1000)
+        endpoint = scope.get("endpoint")
 
         # Initializing of json fields
         request_json_fields = RequestJsonLogSchema(
             # Request side
-            method=request.method,
-            path=request.url.path,
-            request_headers=request_headers,
-            module=request.scope["endpoint"].__module__,
-            function=request.scope["endpoint"].__name__,
+            method=scope["method"],
+            path=scope["path"],
+            module=getattr(endpoint, "__module__", EMPTY_VALUE),
+            function=getattr(endpoint, "__name__", EMPTY_VALUE),
             # Response side
-            status=response.status_code,
+            status=status,
             latency=duration,
+            response_bytes=size,
         ).model_dump()
 
-        logger.info(
+        logger.log(
+            level,
             "",
             extra={
                 "request_json_fields": request_json_fields,
             },
-            exc_info=exception_object,
+            exc_info=exception,
         )
-        return response
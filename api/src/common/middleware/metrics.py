@@ -0,0 +1,56 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.common.lifespans import in_flight
+from src.common.metrics import (
+    REQUEST_LATENCY,
+    REQUESTS_IN_FLIGHT,
+    RESPONSE_BYTES,
+    RESPONSES,
+)
+
+from .logging import PASS_ROUTES
+
+# requests that did not match a route share one label instead of one per url
+UNMATCHED_ROUTE = "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request metrics by route template"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in PASS_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        start_time = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(method)
+        try:
+            # shutdown waits for these to finish
+            with in_flight.track():
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec(method)
+
+            # the router sets the matched route on the scope
+            route = getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+            REQUEST_LATENCY.observe(time.perf_counter() - start_time, method, route)
+            RESPONSES.inc(method, route, str(status))
+            RESPONSE_BYTES.inc(method, route, amount=size)
@@ -0,0 +1,276 @@
+"""
+Mirror: local copy of the nylas mailboxes in postgres
+A sync worker (a redis list consumer, so only one worker picks up each job)
+pages through the messages received since the account's watermark and
+upserts them in bulk, then compares the unread listing with the messages
+mirrored as unread, so older ones read or deleted since are marked read.
+Between syncs the message webhooks apply flag changes and deletes (see
+apply_message_event). Listings read the mirror while it is fresh and fall
+back to nylas while it is cold or stale.
+"""
+import contextlib
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from loguru import logger
+from prisma import Json
+from prisma.models import email_message, nylas_account
+from pydantic import BaseModel
+
+from src.models.nylas import Message, MessagePreview
+
+from .broker import redis_connection
+from .broker import router as redis_router
+from .config import settings
+from .db import prisma
+from .grants import account_changed
+from .lifespans import in_flight
+from .metrics import timed
+from .nylas import nylas_client
+
+SYNC_LIST = "nylas.messages.sync"
+
+# messages received shortly before the watermark are synced again, so flags
+# (unread, starred) of recent messages are picked up too
+SYNC_OVERLAP = 24 * 60 * 60
+
+# ids per statement when reconciling, well below postgres' bind parameter limit
+RECONCILE_CHUNK = 1000
+
+
+class SyncRequest(BaseModel):
+    nylas_account_id: str
+    grant_id: str
+
+
+def _datetime(timestamp: int | None) -> datetime:
+    return datetime.fromtimestamp(timestamp or 0, tz=timezone.utc)
+
+
+def is_fresh(account: nylas_account) -> bool:
+    """Whether listings for the account can be served from the mirror"""
+    if account.messages_synced_at is None:
+        return False
+
+    age = datetime.now(timezone.utc) - account.messages_synced_at
+    return age < timedelta(seconds=settings.nylas_mirror_max_age)
+
+
+async def request_sync(account: nylas_account) -> None:
+    """Queues a sync for the account unless one was queued recently"""
+    # the marker expires on its own, a crashed sync doesn't block the next one
+    with timed("redis", "mirror.queue_marker"):
+        queued = await redis_connection().set(
+            f"{SYNC_LIST}:{account.id}", 1, nx=True, ex=settings.nylas_mirror_max_age
+        )
+    if queued:
+        await redis_router.broker.publish(
+            SyncRequest(nylas_account_id=account.id, grant_id=account.grant_id),
+            list=SYNC_LIST,
+        )
+
+
+async def upsert_messages(nylas_account_id: str, messages: list[Message]) -> None:
+    """Writes a page of messages (and their attachments) in one transaction"""
+    async with prisma.batch_() as batcher:
+        for message in messages:
+            data = {
+                "thread_id": message.thread_id,
+                "object": message.object,
+                "subject": message.subject,
+                "snippet": message.snippet,
+                "body": message.body,
+                "from_": Json([sender.model_dump() for sender in message.from_]),
+                "to": Json([to.model_dump() for to in message.to or []]),
+                "folders": message.folders or [],
+                "unread": bool(message.unread),
+                "starred": bool(message.starred),
+                "has_attachments": bool(message.attachments),
+                "date": _datetime(message.date or message.created_at),
+                "created_at": _datetime(message.created_at or message.date),
+            }
+            batcher.email_message.upsert(
+                where={"id": message.id},
+                data={
+                    "create": {
+                        "id": message.id,
+                        "nylas_account_id": nylas_account_id,
+                        **data,
+                    },
+                    "update": data,
+                },
+            )
+
+        attachments = [
+            {
+                "nylas_id": attachment.id,
+                "message_id": message.id,
+                "filename": attachment.filename,
+                "size": attachment.size,
+                "content_type": attachment.content_type,
+                "is_inline": attachment.is_inline,
+                "content_disposition": attachment.content_disposition,
+            }
+            for message in messages
+            for attachment in message.attachments or []
+        ]
+        if attachments:
+            batcher.email_attachment.create_many(data=attachments, skip_duplicates=True)
+
+
+async def sync_account(nylas_account_id: str, grant_id: str) -> int:
+    """Pulls everything received since the watermark, returns the message count"""
+    account = await prisma.nylas_account.find_unique(where={"id": nylas_account_id})
+    if account is None or account.deleted_at is not None or account.expired:
+        return 0
+
+    now = datetime.now(timezone.utc)
+    watermark = account.messages_watermark
+    received_after = (
+        watermark - SYNC_OVERLAP
+        if watermark
+        else int((now - timedelta(days=settings.nylas_mirror_initial_days)).timestamp())
+    )
+
+    synced = 0
+    newest = watermark or 0
+    query_params = {
+        "limit": settings.nylas_mirror_page_size,
+        "received_after": received_after,
+    }
+    async for page in nylas_client.message_pages(grant_id, query_params):
+        messages = [message for message in page.data if message.id]
+        if messages:
+            await upsert_messages(nylas_account_id, messages)
+            synced += len(messages)
+            newest = max(newest, *(message.date or 0 for message in messages))
+
+    # the incremental pass only sees recent messages, the mirror serves the
+    # unread ones so their flags have to match before it is marked fresh
+    await reconcile_unread(nylas_account_id, grant_id)
+
+    await prisma.nylas_account.update(
+        where={"id": nylas_account_id},
+        data={"messages_watermark": newest or None, "messages_synced_at": now},
+    )
+    # cached accounts carry messages_synced_at, which the listings look at
+    await account_changed(account.user_id)
+    return synced
+
+
+async def reconcile_unread(nylas_account_id: str, grant_id: str) -> int:
+    """Compares nylas' unread listing (newest first, at most
+    nylas_mirror_reconcile_limit messages) with the messages mirrored as
+    unread: the ones missing from the mirror are synced, mirrored ones nylas no
+    longer lists were read or deleted since and are marked read. Returns how
+    many were marked read"""
+    # ids and dates only, the index on (nylas_account_id, unread, date) covers it
+    rows = await prisma.query_raw(
+        "SELECT id, EXTRACT(EPOCH FROM date)::bigint AS date FROM email_message "
+        "WHERE nylas_account_id = $1 AND unread",
+        nylas_account_id,
+    )
+    mirrored = {row["id"]: row["date"] for row in rows}
+
+    listed: set[str] = set()
+    oldest: int | None = None
+    complete = True
+    query_params = {"limit": settings.nylas_mirror_page_size, "unread": "true"}
+    pages = nylas_client.message_pages(grant_id, query_params)
+    async with contextlib.aclosing(pages):
+        async for page in pages:
+            messages = [message for message in page.data if message.id]
+            missing = [message for message in messages if message.id not in mirrored]
+            if missing:
+                await upsert_messages(nylas_account_id, missing)
+
+            listed.update(message.id for message in messages if message.id)
+            dates = [message.date or message.created_at or 0 for message in messages]
+            if dates:
+                oldest = min(dates) if oldest is None else min(oldest, *dates)
+
+            if len(listed) >= settings.nylas_mirror_reconcile_limit:
+                complete = page.next_cursor is None
+                break
+
+    # past the limit only what is at least as new as the listing can be judged
+    read = sorted(
+        message_id
+        for message_id, date in mirrored.items()
+        if message_id not in listed and (complete or date >= (oldest or 0))
+    )
+
+    marked = 0
+    for start in range(0, len(read), RECONCILE_CHUNK):
+        marked += await prisma.email_message.update_many(
+            where={"id": {"in": read[start : start + RECONCILE_CHUNK]}},
+            data={"unread": False},
+        )
+    return marked
+
+
+async def apply_message_event(event_type: str, message: dict[str, Any]) -> None:
+    """Applies a message webhook (message.updated, message.deleted) to the
+    mirrored row, if there is one. New messages wait for the next sync."""
+    message_id = message.get("id")
+    if not message_id:
+        return
+
+    if event_type == "message.deleted":
+        await prisma.email_message.delete_many(where={"id": message_id})
+        return
+
+    # flags only, truncated events (message.updated.truncated) have no body
+    if event_type.startswith("message.updated"):
+        data: dict[str, Any] = {
+            field: bool(message[field])
+            for field in ("unread", "starred")
+            if field in message
+        }
+        if message.get("folders") is not None:
+            data["folders"] = message["folders"]
+        if data:
+            await prisma.email_message.update_many(
+                where={"id": message_id},
+                data=data,
+            )
+
+
+@redis_router.subscriber(list=SYNC_LIST)
+async def on_sync_request(request: SyncRequest) -> None:
+    try:
+        # shutdown waits for the sync before closing the broker
+        with in_flight.track():
+            synced = await sync_account(request.nylas_account_id, request.grant_id)
+        logger.debug(f"Synced {synced} messages for {request.nylas_account_id}")
+    finally:
+        with timed("redis", "mirror.clear_marker"):
+            await redis_connection().delete(f"{SYNC_LIST}:{request.nylas_account_id}")
+
+
+def preview(message: email_message) -> MessagePreview:
+    return MessagePreview(
+        id=message.id,
+        from_=message.from_,
+        subject=message.subject,
+        snippet=message.snippet,
+        has_attachments=message.has_attachments,
+        created_at=int(message.created_at.timestamp()),
+    )
+
+
+async def list_previews(
+    account: nylas_account, limit: int = 10, unread: bool | None = None
+) -> list[MessagePreview]:
+    """Newest messages of the account from the mirror"""
+    where: dict[str, Any] = {"nylas_account_id": account.id}
+    if unread is not None:
+        where["unread"] = unread
+
+    messages = await prisma.email_message.find_many(
+        where=where,
+        order={"date": "desc"},
+        take=limit,
+    )
+
+    return [preview(message) for message in messages]
@@ -1,7 +1,254 @@
-from nylas import Client
+"""
+Nylas: async access to the v3 API
+One pooled (keep-alive) http client per worker, calls for the same grant are
+limited to a few at a time and 429 / 5xx responses are retried with jittered
+exponential backoff, honoring Retry-After. Requests that are not idempotent
+(sending a message) pass retry=False and are only retried when Nylas can't have
+acted on them. Failures that remain after retrying
+are raised as NylasApiError, including transport errors (timeouts, refused
+connections), so callers only have one exception to handle.
+"""
+import asyncio
+import contextlib
+import hashlib
+import hmac
+import random
+from collections import defaultdict
+from collections.abc import AsyncGenerator, AsyncIterator
+from typing import Any
+
+import httpx
+from fastapi import FastAPI
+
+from src.models.nylas import MessageListResponse
 
 from .config import settings
+from .metrics import timed
+
+# statuses worth retrying, anything else is returned / raised right away
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class NylasApiError(Exception):
+    """Nylas answered with an error status, or could not be reached (504 on a
+    timeout, 502 otherwise), after retrying"""
+
+    def __init__(self, status_code: int, message: str) -> None:
+        super().__init__(f"Nylas API error {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+def verify_signature(secret: str, body: bytes, signature: str) -> bool:
+    """Whether a webhook body carries the hmac (x-nylas-signature) of secret"""
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def _message(data: dict[str, Any]) -> dict[str, Any]:
+    # the models validate "from_" (as the sdk objects had it), the api sends "from"
+    data["from_"] = data.pop("from", None) or []
+    return data
+
+
+class AsyncNylas:
+    def __init__(
+        self,
+        api_key: str,
+        api_uri: str,
+        timeout: float = 10.0,
+        max_connections: int = 50,
+        grant_concurrency: int = 4,
+        retries: int = 3,
+        backoff: float = 0.25,
+        max_backoff: float = 5.0,
+    ) -> None:
+        self.api_key = api_key
+        self.api_uri = api_uri
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.grant_concurrency = grant_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._client: httpx.AsyncClient | None = None
+        self._grants: defaultdict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.grant_concurrency)
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # created on first use, inside the worker's event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_uri,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Accept": "application/json",
+                },
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+
+        return self._client
 
-nylas_client = Client(
-    api_key=settings.nylas_api_key, api_uri=settings.nylas_api_region_uri
+    def _delay(self, attempt: int, response: httpx.Response | None) -> float:
+        if response is not None and "retry-after" in response.headers:
+            with contextlib.suppress(ValueError):
+                return min(float(response.headers["retry-after"]), self.max_backoff)
+
+        # full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        grant_id: str,
+        params: dict[str, Any] | None = None,
+        json: Any = None,
+        timeout: float | None = None,
+        retry: bool = True,
+    ) -> dict[str, Any]:
+        """Sends a request on behalf of grant_id, returns the decoded json body
+        With retry=False only failed connections and 429s are retried, a
+        timeout or 5xx may come after nylas acted on the request.
+        """
+        retry_statuses = RETRY_STATUSES if retry else {429}
+        async with self._grants[grant_id]:
+            for attempt in range(self.retries + 1):
+                response = None
+                try:
+                    response = await self.client.request(
+                        method,
+                        path,
+                        params=params,
+                        json=json,
+                        timeout=timeout or self.timeout,
+                    )
+                except httpx.TransportError as e:
+                    if attempt == self.retries or not (
+                        retry or isinstance(e, httpx.ConnectError)
+                    ):
+                        status_code = (
+                            504 if isinstance(e, httpx.TimeoutException) else 502
+                        )
+                        raise NylasApiError(
+                            status_code, str(e) or type(e).__name__
+                        ) from e
+                else:
+                    if response.status_code < 400:
+                        body: dict[str, Any] = response.json()
+                        return body
+                    if (
+                        response.status_code not in retry_statuses
+                        or attempt == self.retries
+                    ):
+                        raise NylasApiError(response.status_code, response.text)
+
+                await asyncio.sleep(self._delay(attempt, response))
+
+        raise AssertionError("unreachable")
+
+    async def list_messages(
+        self,
+        grant_id: str,
+        query_params: dict[str, Any] | None = None,
+        timeout: float | None = None,
+    ) -> MessageListResponse:
+        with timed("nylas", "messages.list"):
+            body = await self.request(
+                "GET",
+                f"/v3/grants/{grant_id}/messages",
+                grant_id,
+                params=query_params,
+                timeout=timeout,
+            )
+
+        return MessageListResponse.model_validate(
+            {
+                "request_id": body.get("request_id", ""),
+                "data": [
+                    _message({"grant_id": grant_id, **message})
+                    for message in body.get("data") or []
+                ],
+                "next_cursor": body.get("next_cursor"),
+            }
+        )
+
+    async def send_message(
+        self,
+        grant_id: str,
+        to: list[dict[str, str]],
+        subject: str,
+        body: str,
+        timeout: float | None = None,
+    ) -> dict[str, Any]:
+        """Sends an email from the grant's mailbox, returns the sent message"""
+        with timed("nylas", "messages.send"):
+            # a retried send can reach the candidate twice
+            response = await self.request(
+                "POST",
+                f"/v3/grants/{grant_id}/messages/send",
+                grant_id,
+                json={"to": to, "subject": subject, "body": body},
+                timeout=timeout,
+                retry=False,
+            )
+
+        sent: dict[str, Any] = response.get("data") or {}
+        return sent
+
+    async def message_pages(
+        self,
+        grant_id: str,
+        query_params: dict[str, Any] | None = None,
+        timeout: float | None = None,
+    ) -> AsyncGenerator[MessageListResponse, None]:
+        """Walks every page of a listing. The next page is fetched while the
+        current one is consumed, so at most two pages are held at a time.
+        """
+        params = dict(query_params or {})
+        pending: asyncio.Future[MessageListResponse] | None = asyncio.ensure_future(
+            self.list_messages(grant_id, params, timeout)
+        )
+        try:
+            while pending is not None:
+                page = await pending
+                pending = None
+                if page.next_cursor:
+                    params = {**params, "page_token": page.next_cursor}
+                    pending = asyncio.ensure_future(
+                        self.list_messages(grant_id, params, timeout)
+                    )
+                yield page
+        finally:
+            # the consumer stopped early (or failed), don't leave the prefetch
+            if pending is not None:
+                pending.cancel()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+nylas_client = AsyncNylas(
+    api_key=settings.nylas_api_key,
+    api_uri=settings.nylas_api_region_uri,
+    timeout=settings.nylas_timeout,
+    max_connections=settings.nylas_max_connections,
+    grant_concurrency=settings.nylas_grant_concurrency,
+    retries=settings.nylas_retries,
 )
+
+
+@contextlib.asynccontextmanager
+async def nylas_lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Closes the pooled connections on shutdown"""
+    yield
+    await nylas_client.aclose()
@@ -0,0 +1,218 @@
+"""
+Outreach: runs the scheduler (see scheduler.py) against postgres and nylas
+A status is at one step of its sequence, the step is due delayDays after the
+status was created (the candidate entered the sequence). Steps are ordered by
+delayDays. Once a step is sent the status moves on to the next one, after the
+last step it is deactivated.
+Every worker runs the scheduling loop, the queue hands each due status to one
+of them. A rebuild can be requested by publishing on OUTREACH_LIST.
+"""
+import asyncio
+import contextlib
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from fastapi import FastAPI
+from loguru import logger
+from prisma.models import outreach_status
+from pydantic import BaseModel
+
+from .broker import router as redis_router
+from .config import settings
+from .db import prisma
+from .grants import resolve_account
+from .lifespans import in_flight
+from .nylas import nylas_client
+from .scheduler import (
+    DueStatus,
+    OutreachScheduler,
+    OutreachSend,
+    RedisDueQueue,
+    RedisRateLimiter,
+    Watermark,
+)
+
+OUTREACH_LIST = "outreach.rebuild"
+
+DAY = 24 * 60 * 60
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class RebuildRequest(BaseModel):
+    # all active statuses instead of the ones changed since the last rebuild
+    full: bool = False
+
+
+def _datetime(timestamp: float) -> datetime:
+    # whole milliseconds, like postgres has them, so watermarks compare equal
+    return EPOCH + timedelta(milliseconds=round(timestamp * 1000))
+
+
+def due_status(status: outreach_status) -> DueStatus:
+    due_at = None
+    if status.active and not status.replied and status.step is not None:
+        due_at = status.created_at.timestamp() + status.step.delayDays * DAY
+
+    return DueStatus(
+        status_id=status.id,
+        updated_at=status.updated_at.timestamp(),
+        due_at=due_at,
+    )
+
+
+class PrismaOutreachStore:
+    async def changed_since(
+        self, watermark: Watermark | None, limit: int, active_only: bool = False
+    ) -> list[DueStatus]:
+        where: dict[str, Any] = {}
+        if watermark is not None:
+            updated_at, status_id = watermark
+            after = _datetime(updated_at)
+            where["OR"] = [
+                {"updated_at": {"gt": after}},
+                {"updated_at": after, "id": {"gt": status_id}},
+            ]
+        if active_only:
+            where["active"] = True
+            where["replied"] = False
+
+        statuses = await prisma.outreach_status.find_many(
+            where=where,
+            include={"step": True},
+            order=[{"updated_at": "asc"}, {"id": "asc"}],
+            take=limit,
+        )
+        return [due_status(status) for status in statuses]
+
+    async def load(self, status_ids: list[str]) -> list[OutreachSend]:
+        statuses = await prisma.outreach_status.find_many(
+            where={"id": {"in": status_ids}, "active": True, "replied": False},
+            include={
+                "step": {
+                    "include": {
+                        "template": True,
+                        "sequence": {"include": {"project": True}},
+                    }
+                },
+                "candidate": {"include": {"person": True}},
+            },
+        )
+
+        sends = []
+        for status in statuses:
+            step = status.step
+            person = status.candidate.person if status.candidate else None
+            if step is None or step.template is None or not person or not person.email:
+                logger.warning(f"Outreach: {status.id} has no template or recipient")
+                continue
+
+            project = step.sequence.project
+            # sent from the project owner's mailbox
+            account = await resolve_account(project.owner_id)
+            if account is None:
+                logger.warning(f"Outreach: no nylas account to send {status.id}")
+                continue
+
+            name = person.name or ""
+            sends.append(
+                OutreachSend(
+                    status_id=status.id,
+                    grant_id=account.grant_id,
+                    to_email=person.email,
+                    to_name=person.name,
+                    subject=step.template.subject,
+                    body=step.template.body,
+                    context={
+                        "name": name,
+                        "first_name": name.split(" ")[0],
+                        "email": person.email,
+                        "project": project.name,
+                    },
+                )
+            )
+        return sends
+
+    async def advance(self, status_id: str) -> DueStatus:
+        status = await prisma.outreach_status.find_unique(
+            where={"id": status_id}, include={"step": True}
+        )
+        if status is None or status.step is None:
+            return DueStatus(status_id=status_id, updated_at=0)
+
+        steps = await prisma.outreach_step.find_many(
+            where={"sequence_id": status.step.sequence_id},
+            order=[{"delayDays": "asc"}, {"created_at": "asc"}],
+        )
+        index = [step.id for step in steps].index(status.step_id)
+        data = (
+            {"step_id": steps[index + 1].id}
+            if index + 1 < len(steps)
+            else {"active": False}
+        )
+
+        updated = await prisma.outreach_status.update(
+            where={"id": status_id},
+            data=data,
+            include={"step": True},
+        )
+        return due_status(updated)
+
+
+class NylasSender:
+    async def send(
+        self, grant_id: str, to_email: str, to_name: str | None, subject: str, body: str
+    ) -> None:
+        to = {"email": to_email}
+        if to_name:
+            to["name"] = to_name
+        await nylas_client.send_message(grant_id, [to], subject, body)
+
+
+outreach_scheduler = OutreachScheduler(
+    RedisDueQueue(),
+    PrismaOutreachStore(),
+    NylasSender(),
+    RedisRateLimiter(settings.outreach_rate_limit, settings.outreach_rate_window),
+    batch_size=settings.outreach_batch_size,
+    page_size=settings.outreach_rebuild_page_size,
+    retry_delay=settings.outreach_retry_delay,
+    rebuild_overlap=settings.outreach_rebuild_overlap,
+)
+
+
+async def run_scheduler(interval: float) -> None:
+    while not in_flight.draining:
+        try:
+            # shutdown waits for the batch in progress
+            with in_flight.track():
+                await outreach_scheduler.rebuild()
+                sent = await outreach_scheduler.run_due()
+            if sent:
+                logger.info(f"Outreach: sent {sent} steps")
+        except Exception as e:
+            logger.error(f"Outreach: scheduling failed: {e}")
+
+        await asyncio.sleep(interval)
+
+
+@contextlib.asynccontextmanager
+async def outreach_lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Runs the scheduling loop while the app is up"""
+    task = None
+    if settings.outreach_enabled:
+        task = asyncio.create_task(run_scheduler(settings.outreach_interval))
+
+    yield
+
+    if task is not None:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+@redis_router.subscriber(list=OUTREACH_LIST)
+async def on_rebuild_request(request: RebuildRequest) -> None:
+    with in_flight.track():
+        count = await outreach_scheduler.rebuild(full=request.full)
+    logger.info(f"Outreach: rebuilt the queue from {count} statuses")
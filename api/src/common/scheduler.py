@@ -0,0 +1,423 @@
+"""
+Scheduler: sends the due steps of outreach sequences
+Every active outreach_status sits in a due-queue (a redis sorted set scored by
+the time its current step is due), so a tick only touches what is due: it pops
+a batch, renders the steps' templates, sends them (rate limited per grant) and
+queues each status again at its next step. Popped statuses are leased, a
+worker dying mid-batch gives them back once the lease expires. Only the worker
+holding a lease queues that status again, rebuilds leave leased statuses alone
+(queueing one being sent would have another worker send it twice).
+The queue is rebuilt incrementally from the statuses changed since the last
+rebuild (a watermark), a full rebuild only reads the active ones. A status can
+commit after a newer one with an older updated_at, so the incremental rebuild
+reads the last rebuild_overlap seconds before the watermark again.
+Sending is at least once, a worker dying between sending a step and moving
+the status on sends that step again.
+"""
+import asyncio
+import json
+import re
+import time
+from collections.abc import Callable
+from typing import Protocol
+
+from loguru import logger
+from pydantic import BaseModel
+
+from .broker import redis_connection, run_script
+from .metrics import timed
+
+# {{ name }} placeholders
+PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+# (updated_at, id) of the last status seen by a rebuild
+Watermark = tuple[float, str]
+
+
+class TemplateError(Exception):
+    """A template uses a placeholder there is no value for"""
+
+
+def render(template: str, context: dict[str, str]) -> str:
+    def value(match: re.Match[str]) -> str:
+        name = match.group(1)
+        if name not in context:
+            raise TemplateError(f"No value for {{{{ {name} }}}}")
+        return context[name]
+
+    return PLACEHOLDER.sub(value, template)
+
+
+class DueStatus(BaseModel):
+    status_id: str
+    # unix seconds
+    updated_at: float
+    # None when nothing is due (inactive, replied, sequence finished)
+    due_at: float | None = None
+
+
+class OutreachSend(BaseModel):
+    """A due step with everything needed to send it"""
+
+    status_id: str
+    grant_id: str
+    to_email: str
+    to_name: str | None = None
+    subject: str
+    body: str
+    # template values (name, first_name, email, project, ...)
+    context: dict[str, str] = {}
+
+
+class DueQueue(Protocol):
+    async def add(self, due: dict[str, float]) -> None:
+        """Queues the statuses that aren't leased"""
+        ...
+
+    async def requeue(self, due: dict[str, float]) -> None:
+        """Queues leased statuses again, releasing their lease"""
+        ...
+
+    async def remove(self, status_ids: list[str]) -> None:
+        ...
+
+    async def pop_due(self, now: float, limit: int, lease: float) -> list[str]:
+        ...
+
+    async def reclaim(self, now: float) -> int:
+        ...
+
+    async def get_watermark(self) -> Watermark | None:
+        ...
+
+    async def set_watermark(self, watermark: Watermark) -> None:
+        ...
+
+
+class OutreachStore(Protocol):
+    async def changed_since(
+        self, watermark: Watermark | None, limit: int, active_only: bool = False
+    ) -> list[DueStatus]:
+        """Statuses ordered by (updated_at, id), after the watermark"""
+        ...
+
+    async def load(self, status_ids: list[str]) -> list[OutreachSend]:
+        """The sends of the statuses that are still due (active, not replied)"""
+        ...
+
+    async def advance(self, status_id: str) -> DueStatus:
+        """Moves the status to its next step (or ends it) after a send"""
+        ...
+
+
+class Sender(Protocol):
+    async def send(
+        self, grant_id: str, to_email: str, to_name: str | None, subject: str, body: str
+    ) -> None:
+        ...
+
+
+class RateLimiter(Protocol):
+    async def acquire(self, grant_id: str, now: float) -> float | None:
+        """None when a send is allowed now, otherwise when to try again"""
+        ...
+
+
+# pops due statuses and leases them to the caller, in one step so workers
+# never pop the same status
+POP_DUE = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, item in ipairs(items) do
+    redis.call('ZREM', KEYS[1], item)
+    redis.call('ZADD', KEYS[2], ARGV[1] + ARGV[3], item)
+end
+return items
+"""
+
+# queues the statuses (ARGV: score, member, ...) that aren't leased
+ADD_UNLEASED = """
+for i = 1, #ARGV, 2 do
+    if not redis.call('ZSCORE', KEYS[2], ARGV[i + 1]) then
+        redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+"""
+
+# puts statuses with an expired lease back in the queue
+RECLAIM = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, item in ipairs(items) do
+    redis.call('ZREM', KEYS[2], item)
+    redis.call('ZADD', KEYS[1], ARGV[1], item)
+end
+return #items
+"""
+
+
+class RedisDueQueue:
+    def __init__(self, name: str = "outreach") -> None:
+        self.due = f"{name}:due"
+        self.leased = f"{name}:leased"
+        self.watermark = f"{name}:watermark"
+
+    async def add(self, due: dict[str, float]) -> None:
+        args: list[float | str] = []
+        for status_id, due_at in due.items():
+            args += [due_at, status_id]
+        with timed("redis", "scheduler.add"):
+            await run_script(ADD_UNLEASED, [self.due, self.leased], args)
+
+    async def requeue(self, due: dict[str, float]) -> None:
+        connection = redis_connection()
+        with timed("redis", "scheduler.requeue"):
+            async with connection.pipeline(transaction=True) as pipe:
+                pipe.zadd(self.due, due)
+                pipe.zrem(self.leased, *due)
+                await pipe.execute()
+
+    async def remove(self, status_ids: list[str]) -> None:
+        connection = redis_connection()
+        with timed("redis", "scheduler.remove"):
+            async with connection.pipeline(transaction=True) as pipe:
+                pipe.zrem(self.due, *status_ids)
+                pipe.zrem(self.leased, *status_ids)
+                await pipe.execute()
+
+    async def pop_due(self, now: float, limit: int, lease: float) -> list[str]:
+        with timed("redis", "scheduler.pop_due"):
+            items = await run_script(
+                POP_DUE, [self.due, self.leased], [now, limit, lease]
+            )
+        return [item.decode() if isinstance(item, bytes) else item for item in items]
+
+    async def reclaim(self, now: float) -> int:
+        with timed("redis", "scheduler.reclaim"):
+            reclaimed: int = await run_script(RECLAIM, [self.due, self.leased], [now])
+        return reclaimed
+
+    async def get_watermark(self) -> Watermark | None:
+        with timed("redis", "scheduler.get_watermark"):
+            value = await redis_connection().get(self.watermark)
+        if value is None:
+            return None
+        updated_at, status_id = json.loads(value)
+        return updated_at, status_id
+
+    async def set_watermark(self, watermark: Watermark) -> None:
+        with timed("redis", "scheduler.set_watermark"):
+            await redis_connection().set(self.watermark, json.dumps(watermark))
+
+
+class MemoryDueQueue:
+    """In-process queue for tests"""
+
+    def __init__(self) -> None:
+        self.due: dict[str, float] = {}
+        self.leased: dict[str, float] = {}
+        self.watermark: Watermark | None = None
+
+    async def add(self, due: dict[str, float]) -> None:
+        self.due.update(
+            (status_id, due_at)
+            for status_id, due_at in due.items()
+            if status_id not in self.leased
+        )
+
+    async def requeue(self, due: dict[str, float]) -> None:
+        self.due.update(due)
+        for status_id in due:
+            self.leased.pop(status_id, None)
+
+    async def remove(self, status_ids: list[str]) -> None:
+        for status_id in status_ids:
+            self.due.pop(status_id, None)
+            self.leased.pop(status_id, None)
+
+    async def pop_due(self, now: float, limit: int, lease: float) -> list[str]:
+        items = sorted(
+            (due_at, status_id)
+            for status_id, due_at in self.due.items()
+            if due_at <= now
+        )[:limit]
+        for _, status_id in items:
+            del self.due[status_id]
+            self.leased[status_id] = now + lease
+        return [status_id for _, status_id in items]
+
+    async def reclaim(self, now: float) -> int:
+        expired = [
+            status_id for status_id, until in self.leased.items() if until <= now
+        ]
+        for status_id in expired:
+            del self.leased[status_id]
+            self.due[status_id] = now
+        return len(expired)
+
+    async def get_watermark(self) -> Watermark | None:
+        return self.watermark
+
+    async def set_watermark(self, watermark: Watermark) -> None:
+        self.watermark = watermark
+
+
+class RedisRateLimiter:
+    """At most `limit` sends per grant in each fixed window of `window` seconds,
+    shared by all workers"""
+
+    def __init__(self, limit: int, window: int, name: str = "outreach") -> None:
+        self.limit = limit
+        self.window = window
+        self.name = name
+
+    async def acquire(self, grant_id: str, now: float) -> float | None:
+        index = int(now // self.window)
+        key = f"{self.name}:rate:{grant_id}:{index}"
+        connection = redis_connection()
+        with timed("redis", "scheduler.rate_limit"):
+            async with connection.pipeline(transaction=True) as pipe:
+                pipe.incr(key)
+                pipe.expire(key, self.window * 2)
+                count, _ = await pipe.execute()
+
+        return None if count <= self.limit else (index + 1) * self.window
+
+
+class MemoryRateLimiter:
+    """In-process limiter for tests, same fixed windows"""
+
+    def __init__(self, limit: int, window: int) -> None:
+        self.limit = limit
+        self.window = window
+        self.counts: dict[tuple[str, int], int] = {}
+
+    async def acquire(self, grant_id: str, now: float) -> float | None:
+        index = int(now // self.window)
+        count = self.counts[grant_id, index] = self.counts.get((grant_id, index), 0) + 1
+        return None if count <= self.limit else (index + 1) * self.window
+
+
+class OutreachScheduler:
+    def __init__(
+        self,
+        queue: DueQueue,
+        store: OutreachStore,
+        sender: Sender,
+        limiter: RateLimiter,
+        clock: Callable[[], float] = time.time,
+        batch_size: int = 100,
+        page_size: int = 1000,
+        lease: float = 300.0,
+        retry_delay: float = 300.0,
+        rebuild_overlap: float = 60.0,
+    ) -> None:
+        self.queue = queue
+        self.store = store
+        self.sender = sender
+        self.limiter = limiter
+        self.clock = clock
+        self.batch_size = batch_size
+        self.page_size = page_size
+        # how long a popped status stays leased to the worker that popped it
+        self.lease = lease
+        # sends that failed (or could not be rendered) are retried after this
+        self.retry_delay = retry_delay
+        # seconds before the watermark an incremental rebuild reads again
+        self.rebuild_overlap = rebuild_overlap
+
+    async def schedule(self, statuses: list[DueStatus], leased: bool = False) -> None:
+        """Queues the statuses at their due time, leased ones only when they
+        are leased to this worker"""
+        due = {s.status_id: s.due_at for s in statuses if s.due_at is not None}
+        done = [s.status_id for s in statuses if s.due_at is None]
+        if due and leased:
+            await self.queue.requeue(due)
+        elif due:
+            await self.queue.add(due)
+        if done:
+            await self.queue.remove(done)
+
+    async def rebuild(self, full: bool = False) -> int:
+        """Queues the statuses changed since the last rebuild (or all active
+        ones, also when there was no rebuild yet), returns how many were
+        looked at"""
+        previous = None if full else await self.queue.get_watermark()
+        full = previous is None
+        watermark: Watermark | None = None
+        if previous is not None:
+            watermark = (previous[0] - self.rebuild_overlap, "")
+
+        count = 0
+        while True:
+            page = await self.store.changed_since(
+                watermark, self.page_size, active_only=full
+            )
+            if not page:
+                break
+
+            await self.schedule(page)
+            count += len(page)
+            watermark = (page[-1].updated_at, page[-1].status_id)
+            if len(page) < self.page_size:
+                break
+
+        # the overlap alone doesn't move the watermark back
+        if previous is not None and (watermark is None or watermark < previous):
+            watermark = previous
+        if watermark is not None and watermark != previous:
+            await self.queue.set_watermark(watermark)
+        return count
+
+    async def tick(self) -> int:
+        """Sends one batch of due steps, returns how many were sent"""
+        _, sent = await self._tick()
+        return sent
+
+    async def _tick(self) -> tuple[int, int]:
+        now = self.clock()
+        reclaimed = await self.queue.reclaim(now)
+        if reclaimed:
+            logger.warning(f"Scheduler: {reclaimed} leases expired, requeued")
+
+        status_ids = await self.queue.pop_due(now, self.batch_size, self.lease)
+        if not status_ids:
+            return 0, 0
+
+        sends = await self.store.load(status_ids)
+        # gone, inactive or replied since they were queued
+        loaded = {send.status_id for send in sends}
+        dropped = [status_id for status_id in status_ids if status_id not in loaded]
+        if dropped:
+            await self.queue.remove(dropped)
+
+        sent = await asyncio.gather(*(self._send(send, now) for send in sends))
+        return len(status_ids), sum(sent)
+
+    async def _send(self, send: OutreachSend, now: float) -> bool:
+        retry_at = await self.limiter.acquire(send.grant_id, now)
+        if retry_at is not None:
+            await self.queue.requeue({send.status_id: retry_at})
+            return False
+
+        try:
+            subject = render(send.subject, send.context)
+            body = render(send.body, send.context)
+            await self.sender.send(
+                send.grant_id, send.to_email, send.to_name, subject, body
+            )
+        except Exception as e:
+            logger.warning(f"Scheduler: sending {send.status_id} failed: {e}")
+            await self.queue.requeue({send.status_id: now + self.retry_delay})
+            return False
+
+        await self.schedule([await self.store.advance(send.status_id)], leased=True)
+        return True
+
+    async def run_due(self) -> int:
+        """Ticks until nothing is due anymore, returns how many were sent"""
+        sent = 0
+        while True:
+            popped, batch = await self._tick()
+            sent += batch
+            # a short batch means the queue ran out of due statuses
+            if popped < self.batch_size:
+                return sent
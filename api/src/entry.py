@@ -2,31 +2,49 @@
 Main API Entrypoint
 """
 import json
+from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from loguru import logger
 from starlette.middleware.cors import CORSMiddleware
 
 from src.common.broker import router as redis_router
+from src.common.broker import stop_consuming
 from src.common.config import settings
 from src.common.db import prisma
+from src.common.healthcheck import health_lifespan
 from src.common.healthcheck import router as healthcheck_router
-from src.common.lifespans import Lifespans
+from src.common.lifespans import Lifespan, Lifespans, in_flight
+from src.common.logging import log_sink_lifespan
+from src.common.metrics import router as metrics_router
 from src.common.middleware.logging import LoggingMiddleware
+from src.common.middleware.metrics import MetricsMiddleware
+from src.common.nylas import nylas_lifespan
+from src.common.outreach import outreach_lifespan
 from src.routes import routes as api
 
 
+def save_openapi(app: FastAPI) -> None:
+    with open("openapi.json", "w", encoding="utf-8") as f_out:
+        json.dump(app.openapi(), f_out, indent=4)
+
+
 # lifespan replaces the old on_event("startup") and on_event("shutdown")
 @asynccontextmanager
-async def lifespan(app: FastAPI):
+async def openapi_lifespan(app: FastAPI) -> AsyncIterator[None]:
     """Startup Event... Only really used for debugging"""
     if settings.debug is True:
-        # save the openapi schema
+        # save the openapi schema, off the event loop
         logger.debug("Saving openapi schema...")
-        with open("openapi.json", "w", encoding="utf-8") as f_out:
-            json.dump(app.openapi(), f_out, indent=4)
+        await run_in_threadpool(save_openapi, app)
+
+    yield
 
+
+@asynccontextmanager
+async def database_lifespan(app: FastAPI) -> AsyncIterator[None]:
     # connect to the database
     logger.debug("Connecting to the database...")
     await prisma.connect()
@@ -41,15 +59,35 @@ async def lifespan(app: FastAPI):
     await prisma.disconnect()
 
 
+# once shutdown starts, messages in flight are drained but no new ones taken
+in_flight.on_drain.append(stop_consuming)
+
 app = FastAPI(
     title=settings.app_name,
     debug=settings.debug,
     version="1.0.0",
+    # independent lifespans start concurrently, they stop in reverse order
     lifespan=Lifespans(
         [
-            redis_router.lifespan_context,
-            lifespan,
-        ]
+            Lifespan(log_sink_lifespan, name="log_sink"),
+            Lifespan(openapi_lifespan, name="openapi", after=["log_sink"]),
+            Lifespan(database_lifespan, name="database", after=["log_sink"]),
+            Lifespan(nylas_lifespan, name="nylas", after=["log_sink"]),
+            # the broker starts consuming right away, handlers use the database
+            Lifespan(redis_router.lifespan_context, name="redis", after=["database"]),
+            Lifespan(
+                health_lifespan, name="health", after=["database", "redis", "nylas"]
+            ),
+            Lifespan(
+                outreach_lifespan,
+                name="outreach",
+                after=["database", "redis", "nylas"],
+            ),
+        ],
+        in_flight=in_flight,
+        startup_timeout=settings.startup_timeout,
+        drain_timeout=settings.shutdown_drain_timeout,
+        shutdown_timeout=settings.shutdown_timeout,
     )
     # lifespan=kafka_router.lifespan_context
 )
@@ -64,9 +102,12 @@ if settings.debug:
         allow_methods=["*"],
         allow_headers=["*"],
     )
-app.middleware("http")(LoggingMiddleware())
+app.add_middleware(LoggingMiddleware)
+# added last so it is the outermost and sees the final status
+app.add_middleware(MetricsMiddleware)
 
 # include our routes
 app.include_router(redis_router)
 app.include_router(api.router)
 app.include_router(healthcheck_router)
+app.include_router(metrics_router)
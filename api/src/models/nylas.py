@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from typing import Literal
+
 from pydantic import BaseModel, Field
 
 
@@ -59,3 +61,26 @@ class MessagePreview(BaseModel):
     snippet: str | None = None
     has_attachments: bool = False
     created_at: int | None = None
+
+
+class MessagePage(BaseModel):
+    data: list[MessagePreview]
+    next_cursor: str | None = None
+
+
+class InboxPreview(MessagePreview):
+    grant_id: str
+
+
+class GrantResult(BaseModel):
+    grant_id: str
+    status: Literal["ok", "error", "timeout"]
+    error: str | None = None
+    next_cursor: str | None = None
+
+
+class InboxPage(BaseModel):
+    data: list[InboxPreview]
+    grants: list[GrantResult]
+    # some grants are missing from data (see grants)
+    partial: bool = False
@@ -1,50 +1,316 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, HTTPException
+import json
+from collections.abc import AsyncIterator
+from typing import Annotated, Any
 
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from loguru import logger
+from prisma.models import nylas_account
+from pydantic import TypeAdapter
+
+from src.common.cache import RedisBackend, ResponseCache
+from src.common.config import settings
 from src.common.db import prisma
-from src.common.nylas import nylas_client
-from src.models.nylas import MessagePreview
+from src.common.grants import grant_revoked, resolve_account, resolve_accounts
+from src.common.inbox import gather_grants, merge_newest
+from src.common.mirror import (
+    apply_message_event,
+    is_fresh,
+    list_previews,
+    request_sync,
+)
+from src.common.nylas import NylasApiError, nylas_client, verify_signature
+from src.models.nylas import (
+    GrantResult,
+    InboxPage,
+    InboxPreview,
+    Message,
+    MessageListResponse,
+    MessagePage,
+    MessagePreview,
+)
 
 router = APIRouter(
     prefix="/nylas",
     tags=["nylas"],
 )
 
+# live listings by (grant id, query params)
+messages_cache = ResponseCache(
+    "nylas_messages",
+    TypeAdapter(list[MessagePreview]),
+    RedisBackend(),
+    ttl=settings.nylas_cache_ttl,
+    stale_ttl=settings.nylas_cache_stale_ttl,
+)
 
-@router.get("/messages", response_model=list[MessagePreview])
-async def nylas_messages_list():
-    # first we need to get the grant id from our user id
-    user = await prisma.user.find_unique(
-        where={"email": "shaun@shaunberryman.com"},
-        include={"nylas_accounts": True},
+
+def preview(message: Message) -> MessagePreview:
+    """Maps a nylas message to the response model"""
+    return MessagePreview(
+        id=message.id,
+        from_=message.from_,
+        subject=message.subject,
+        snippet=message.snippet,
+        has_attachments=message.attachments is not None
+        and len(message.attachments) > 0,
+        created_at=message.created_at if message.created_at else message.date,
     )
 
-    # ensure we have a grant id
-    # also need to check and see if it has been deleted, etc.
-    if not user.nylas_accounts or len(user.nylas_accounts) < 1:
+
+async def fetch_previews(
+    grant_id: str, query_params: dict[str, Any]
+) -> list[MessagePreview]:
+    """Lists messages from nylas, mapped to the response model"""
+    try:
+        messages = await nylas_client.list_messages(grant_id, query_params=query_params)
+    except NylasApiError as e:
+        raise HTTPException(status_code=502, detail=e.message) from e
+
+    return [preview(message) for message in messages.data]
+
+
+# there is no auth yet, every request is made as this user
+DEMO_USER_EMAIL = "shaun@shaunberryman.com"
+_demo_user_id: str | None = None
+
+
+async def current_user_id() -> str:
+    """The authenticated user's id (the demo user's, looked up once)"""
+    global _demo_user_id
+    if _demo_user_id is None:
+        user = await prisma.user.find_unique(where={"email": DEMO_USER_EMAIL})
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        _demo_user_id = user.id
+
+    return _demo_user_id
+
+
+async def current_account(
+    user_id: Annotated[str, Depends(current_user_id)]
+) -> nylas_account:
+    account = await resolve_account(user_id)
+    if account is None:
         raise HTTPException(status_code=404, detail="No nylas grant id found")
 
-    # get the grant id
-    grant_id = user.nylas_accounts[0].grant_id
+    return account
+
+
+async def current_accounts(
+    user_id: Annotated[str, Depends(current_user_id)]
+) -> list[nylas_account]:
+    accounts = await resolve_accounts(user_id)
+    if not accounts:
+        raise HTTPException(status_code=404, detail="No nylas grant id found")
+
+    return accounts
+
+
+def message_filters(
+    unread: bool | None = None,
+    starred: bool | None = None,
+    has_attachment: bool | None = None,
+    in_folder: Annotated[str | None, Query(alias="in")] = None,
+    from_: Annotated[str | None, Query(alias="from")] = None,
+    to: str | None = None,
+    any_email: str | None = None,
+    subject: str | None = None,
+    thread_id: str | None = None,
+    received_after: int | None = None,
+    received_before: int | None = None,
+) -> dict[str, Any]:
+    """Listing filters, passed to nylas under their api names"""
+    filters = {
+        "unread": unread,
+        "starred": starred,
+        "has_attachment": has_attachment,
+        "in": in_folder,
+        "from": from_,
+        "to": to,
+        "any_email": any_email,
+        "subject": subject,
+        "thread_id": thread_id,
+        "received_after": received_after,
+        "received_before": received_before,
+    }
+    return {
+        name: str(value).lower() if isinstance(value, bool) else value
+        for name, value in filters.items()
+        if value is not None
+    }
+
+
+@router.get("/messages", response_model=list[MessagePreview])
+async def nylas_messages_list(
+    account: Annotated[nylas_account, Depends(current_account)]
+) -> list[MessagePreview]:
+    grant_id = account.grant_id
+
+    # the local mirror answers while it is fresh, otherwise it is refreshed in
+    # the background and this request goes to nylas
+    if is_fresh(account):
+        return await list_previews(account, limit=10, unread=True)
+
+    await request_sync(account)
 
-    # get the messages
-    messages = nylas_client.messages.list(
-        grant_id, query_params={"limit": 10, "unread": "true"}
+    # get the messages, cached for a short while (and invalidated by webhooks)
+    query_params = {"limit": 10, "unread": "true"}
+    return await messages_cache.get_or_load(
+        grant_id, query_params, lambda: fetch_previews(grant_id, query_params)
     )
 
-    # map our messages to the response model
-    result = [
-        MessagePreview(
-            id=message.id,
-            from_=message.from_,
-            subject=message.subject,
-            snippet=message.snippet,
-            has_attachments=message.attachments is not None
-            and len(message.attachments) > 0,
-            created_at=message.created_at if message.created_at else message.date,
+
+@router.get("/messages/page", response_model=MessagePage)
+async def nylas_messages_page(
+    account: Annotated[nylas_account, Depends(current_account)],
+    filters: Annotated[dict[str, Any], Depends(message_filters)],
+    limit: Annotated[int, Query(ge=1, le=200)] = 50,
+    cursor: str | None = None,
+) -> MessagePage:
+    """One page of messages, pass next_cursor back as cursor for the next one"""
+
+    query_params = {"limit": limit, **filters}
+    if cursor:
+        query_params["page_token"] = cursor
+
+    try:
+        messages = await nylas_client.list_messages(
+            account.grant_id, query_params=query_params
         )
-        for message in messages.data
-    ]
+    except NylasApiError as e:
+        raise HTTPException(status_code=502, detail=e.message) from e
+
+    return MessagePage(
+        data=[preview(message) for message in messages.data],
+        next_cursor=messages.next_cursor,
+    )
+
+
+@router.get("/inbox", response_model=InboxPage)
+async def nylas_inbox(
+    accounts: Annotated[list[nylas_account], Depends(current_accounts)],
+    filters: Annotated[dict[str, Any], Depends(message_filters)],
+    limit: Annotated[int, Query(ge=1, le=200)] = 50,
+) -> InboxPage:
+    """Newest messages across all of the user's grants
+    Grants that fail or miss the deadline are reported in grants and the page
+    is marked partial, the other grants' messages are still returned.
+    """
+    query_params = {"limit": limit, **filters}
+
+    async def fetch(grant_id: str) -> MessageListResponse:
+        return await nylas_client.list_messages(grant_id, query_params=query_params)
+
+    grant_ids = [account.grant_id for account in accounts]
+    results = await gather_grants(grant_ids, fetch, settings.nylas_inbox_deadline)
+
+    grants: list[GrantResult] = []
+    pages: list[list[InboxPreview]] = []
+    for grant_id in dict.fromkeys(grant_ids):
+        result = results.get(grant_id)
+        if result is None:
+            grants.append(GrantResult(grant_id=grant_id, status="timeout"))
+        elif isinstance(result, BaseException):
+            logger.warning(f"Inbox: grant {grant_id} failed: {result}")
+            error = result.message if isinstance(result, NylasApiError) else str(result)
+            grants.append(GrantResult(grant_id=grant_id, status="error", error=error))
+        else:
+            grants.append(
+                GrantResult(
+                    grant_id=grant_id, status="ok", next_cursor=result.next_cursor
+                )
+            )
+            pages.append(
+                [
+                    InboxPreview(grant_id=grant_id, **preview(message).model_dump())
+                    for message in result.data
+                ]
+            )
+
+    return InboxPage(
+        data=merge_newest(pages, limit),
+        grants=grants,
+        partial=any(grant.status != "ok" for grant in grants),
+    )
+
+
+@router.get("/messages/export", response_class=StreamingResponse)
+async def nylas_messages_export(
+    account: Annotated[nylas_account, Depends(current_account)],
+    filters: Annotated[dict[str, Any], Depends(message_filters)],
+) -> StreamingResponse:
+    """Every matching message as NDJSON (one MessagePreview per line)
+    Pages are streamed as they arrive, the next one is fetched while the
+    current one is written, so memory stays at two pages whatever the size of
+    the mailbox.
+    """
+    pages = nylas_client.message_pages(
+        account.grant_id,
+        query_params={"limit": settings.nylas_export_page_size, **filters},
+    )
+
+    # the first page is fetched up front, so failing to reach nylas is still a 502
+    try:
+        first = await anext(pages)
+    except NylasApiError as e:
+        await pages.aclose()
+        raise HTTPException(status_code=502, detail=e.message) from e
+
+    async def lines() -> AsyncIterator[bytes]:
+        try:
+            page: MessageListResponse | None = first
+            while page is not None:
+                yield b"".join(
+                    preview(message).model_dump_json(by_alias=True).encode() + b"\n"
+                    for message in page.data
+                )
+                page = await anext(pages, None)
+        except NylasApiError as e:
+            # too late for an error status, the last line tells the client
+            logger.warning(f"Export of {account.id} failed: {e}")
+            yield json.dumps({"error": e.message}).encode() + b"\n"
+        finally:
+            await pages.aclose()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.get("/webhook", response_class=PlainTextResponse)
+async def nylas_webhook_challenge(challenge: str) -> str:
+    """Nylas verifies a new webhook by having it echo the challenge"""
+    return challenge
+
+
+@router.post("/webhook", status_code=200)
+async def nylas_webhook(request: Request) -> dict[str, bool]:
+    """Drops the cached listings of the grant a message event is about (and
+    applies it to the mirror), and stops using grants nylas reports as expired
+    or deleted
+    """
+    # unsigned events could expire or delete anyone's grants
+    if not settings.nylas_webhook_secret:
+        raise HTTPException(status_code=503, detail="Webhook secret not configured")
+
+    body = await request.body()
+    signature = request.headers.get("x-nylas-signature", "")
+    if not verify_signature(settings.nylas_webhook_secret, body, signature):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+
+    try:
+        event = json.loads(body)
+        event_type = event.get("type") or ""
+        event_object = (event.get("data") or {}).get("object") or {}
+        grant_id = event_object.get("grant_id")
+    except (ValueError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid event") from e
+
+    if event_type.startswith("message.") and grant_id:
+        await apply_message_event(event_type, event_object)
+        await messages_cache.invalidate(grant_id)
+    elif event_type in ("grant.expired", "grant.deleted") and grant_id:
+        await grant_revoked(grant_id, deleted=event_type == "grant.deleted")
 
-    return result
+    return {"ok": True}
@@ -0,0 +1,131 @@
+import asyncio
+import os
+
+import pytest
+from pydantic import TypeAdapter
+
+os.environ.setdefault("NYLAS_CLIENT_ID", "test")
+os.environ.setdefault("NYLAS_API_KEY", "test")
+os.environ.setdefault("NYLAS_API_REGION_URI", "http://127.0.0.1")
+
+from src.common.cache import MemoryBackend, ResponseCache  # noqa: E402
+from src.models.nylas import MessagePreview  # noqa: E402
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Loader:
+    """Counts its calls, returns one preview per call (subject = call number)"""
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self) -> list[MessagePreview]:
+        self.calls += 1
+        calls = self.calls
+        await asyncio.sleep(self.delay)
+        return [
+            MessagePreview(
+                id="m1",
+                from_=[{"email": "a@example.com", "name": "A"}],
+                subject=str(calls),
+                created_at=1700000000,
+            )
+        ]
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def cache(clock):
+    return ResponseCache(
+        "test",
+        TypeAdapter(list[MessagePreview]),
+        MemoryBackend(clock),
+        ttl=30,
+        stale_ttl=300,
+        clock=clock,
+    )
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_load_once(cache):
+    loader = Loader(delay=0.05)
+
+    results = await asyncio.gather(
+        *(cache.get_or_load("grant", {"limit": 10}, loader) for _ in range(10))
+    )
+
+    assert loader.calls == 1
+    assert cache.misses == 10
+    assert all(result[0].subject == "1" for result in results)
+
+    # and the value is cached, field names survive the round trip
+    cached = await cache.get_or_load("grant", {"limit": 10}, loader)
+    assert loader.calls == 1
+    assert cache.hits == 1
+    assert cached[0].from_[0].email == "a@example.com"
+
+
+@pytest.mark.asyncio
+async def test_stale_values_are_served_while_refreshing(cache, clock):
+    loader = Loader()
+    await cache.get_or_load("grant", {"limit": 10}, loader)
+
+    clock.now += 60
+    stale = await cache.get_or_load("grant", {"limit": 10}, loader)
+    assert stale[0].subject == "1"
+    assert cache.stale == 1
+
+    # the refresh runs in the background
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert loader.calls == 2
+    fresh = await cache.get_or_load("grant", {"limit": 10}, loader)
+    assert fresh[0].subject == "2"
+
+    # past the stale window it is a plain miss again
+    clock.now += 1000
+    await cache.get_or_load("grant", {"limit": 10}, loader)
+    assert cache.misses == 2
+    assert loader.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_invalidate_drops_the_scope_only(cache):
+    loader = Loader()
+    await cache.get_or_load("grant", {"limit": 10}, loader)
+    await cache.get_or_load("grant", {"limit": 20}, loader)
+    await cache.get_or_load("other", {"limit": 10}, loader)
+
+    await cache.invalidate("grant")
+
+    await cache.get_or_load("grant", {"limit": 10}, loader)
+    await cache.get_or_load("other", {"limit": 10}, loader)
+    assert loader.calls == 4
+    assert cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_loads_in_flight_are_not_cached_after_invalidate(cache):
+    loader = Loader(delay=0.05)
+    loading = asyncio.ensure_future(cache.get_or_load("grant", {"limit": 10}, loader))
+    await asyncio.sleep(0.01)
+
+    # e.g. a webhook while the listing is loaded, the load may predate it
+    await cache.invalidate("grant")
+    assert (await loading)[0].subject == "1"
+
+    fresh = await cache.get_or_load("grant", {"limit": 10}, loader)
+    assert fresh[0].subject == "2"
+    assert cache.misses == 2
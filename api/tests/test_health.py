@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from src.common.health import HealthMonitor, Probe
+
+
+async def ok():
+    pass
+
+
+async def slow():
+    await asyncio.sleep(1)
+
+
+async def broken():
+    raise ConnectionError("refused")
+
+
+@pytest.mark.asyncio
+async def test_probes_report_latency_and_errors():
+    monitor = HealthMonitor(
+        [Probe("db", ok), Probe("cache", slow), Probe("api", broken)], timeout=0.05
+    )
+    assert not monitor.ready()
+
+    await monitor.probe()
+
+    assert monitor.status["db"].healthy
+    assert monitor.status["db"].latency_ms is not None
+    assert monitor.status["cache"].error == "timed out after 0.05s"
+    assert monitor.status["api"].error == "ConnectionError: refused"
+    assert not monitor.ready()
+
+
+@pytest.mark.asyncio
+async def test_readiness_ignores_non_critical_and_expires():
+    now = [1000.0]
+    monitor = HealthMonitor(
+        [Probe("db", ok), Probe("api", broken, critical=False)],
+        interval=10,
+        timeout=1,
+        clock=lambda: now[0],
+    )
+
+    await monitor.probe()
+    assert monitor.ready()
+
+    # no fresh probe for a while, the old result is not trusted anymore
+    now[0] += 60
+    assert not monitor.ready()
+
+
+@pytest.mark.asyncio
+async def test_background_probing():
+    monitor = HealthMonitor([Probe("db", ok)], interval=0.01)
+
+    monitor.start()
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    assert monitor.ready()
+    assert not monitor.running
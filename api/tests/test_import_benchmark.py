@@ -0,0 +1,56 @@
+import importlib.util
+import os
+import sys
+
+SCRIPTS = os.path.join(os.path.dirname(__file__), "..", "scripts")
+sys.path.insert(0, SCRIPTS)
+
+from profiles import ProfileShape, generate_profiles, write_profiles  # noqa: E402
+
+spec = importlib.util.spec_from_file_location(
+    "benchmark_import", os.path.join(SCRIPTS, "benchmark-import.py")
+)
+benchmark = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(benchmark)
+
+
+def test_profiles_are_deterministic():
+    shape = ProfileShape(experiences=3, education=1, languages=1, projects=0)
+    profiles = list(generate_profiles(50, seed=7, shape=shape))
+
+    assert profiles == list(generate_profiles(50, seed=7, shape=shape))
+    assert profiles != list(generate_profiles(50, seed=8, shape=shape))
+    for profile in profiles:
+        assert 1 <= len(profile["experiences"]) <= 3
+        assert len(profile["education"]) <= 1
+        assert len(profile["languages"]) <= 1
+        assert profile["accomplishment_projects"] == []
+
+
+def test_import_benchmark(tmp_path):
+    source = str(tmp_path / "profiles.jsonl")
+    write_profiles(source, 300)
+
+    result = benchmark.run_benchmark(source, batch_size=100)
+
+    assert result.profiles == 300
+    assert result.failed == 0
+    # one transaction for the shared nodes and one for the people per batch
+    assert result.transactions == 6
+    # at most one statement per entity type per batch, a regression back to
+    # per-profile writes shows up as hundreds
+    assert result.queries_per_profile < 0.1
+    assert result.nodes >= 300
+    assert result.profiles_per_second > 0
+    assert set(result.cpu) == {"read", "transform", "write", "embed"}
+
+    report = result.report().splitlines()
+    assert report[0].startswith("300 profiles in ")
+    assert report[0].endswith(", 0 failed")
+    assert f"in 6 transactions ({result.queries_per_profile:.3f} per profile)" in (
+        report[1]
+    )
+    assert report[3].split()[1:] == [
+        f"{stage}={seconds:.2f}s" for stage, seconds in result.cpu.items()
+    ]
+    assert report[4].startswith("  peak rss ")
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+import pytest
+
+from src.common.inbox import gather_grants, merge_newest
+from src.models.nylas import MessagePreview
+
+
+def previews(*created_at: int) -> list[MessagePreview]:
+    return [
+        MessagePreview(id=str(value), from_=[], created_at=value)
+        for value in created_at
+    ]
+
+
+@pytest.mark.asyncio
+async def test_grants_are_fetched_concurrently_up_to_the_deadline():
+    delays = {"fast": 0.05, "slow": 0.1, "stuck": 5.0, "broken": 0.0}
+
+    async def fetch(grant_id: str) -> str:
+        await asyncio.sleep(delays[grant_id])
+        if grant_id == "broken":
+            raise RuntimeError("provider down")
+        return grant_id
+
+    started = time.perf_counter()
+    results = await gather_grants(delays, fetch, deadline=0.3)
+    elapsed = time.perf_counter() - started
+
+    # the slowest answering grant (or the deadline), not the sum
+    assert elapsed < 0.5
+    assert results["fast"] == "fast"
+    assert results["slow"] == "slow"
+    assert isinstance(results["broken"], RuntimeError)
+    assert "stuck" not in results
+
+
+def test_merge_newest_interleaves_grants():
+    merged = merge_newest([previews(9, 5, 1), previews(8, 7), previews(6, 2)], 5)
+
+    assert [preview.created_at for preview in merged] == [9, 8, 7, 6, 5]
@@ -0,0 +1,119 @@
+import asyncio
+import contextlib
+import time
+
+import anyio
+import pytest
+from fastapi import FastAPI
+
+from src.common.lifespans import InFlight, Lifespan, Lifespans
+
+
+def recording(events: list[str], name: str, delay: float = 0.0, fail: bool = False):
+    @contextlib.asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError(f"{name} failed")
+        events.append(f"start {name}")
+        yield
+        events.append(f"stop {name}")
+
+    return lifespan
+
+
+@pytest.mark.asyncio
+async def test_independent_lifespans_start_concurrently():
+    events: list[str] = []
+    lifespans = Lifespans(
+        [
+            Lifespan(recording(events, "db", 0.1), name="db"),
+            Lifespan(recording(events, "redis", 0.1), name="redis"),
+            Lifespan(recording(events, "health"), name="health", after=["db", "redis"]),
+        ]
+    )
+
+    started = time.perf_counter()
+    async with lifespans(FastAPI()):
+        assert time.perf_counter() - started < 0.18
+        assert events[-1] == "start health"
+
+    # reverse order of starting
+    assert events[3] == "stop health"
+    assert set(events[4:]) == {"stop db", "stop redis"}
+
+
+@pytest.mark.asyncio
+async def test_failed_startup_cancels_and_stops_the_others():
+    events: list[str] = []
+    lifespans = Lifespans(
+        [
+            Lifespan(recording(events, "log"), name="log"),
+            Lifespan(recording(events, "db", fail=True), name="db", after=["log"]),
+            Lifespan(recording(events, "slow", 5.0), name="slow", after=["log"]),
+            Lifespan(recording(events, "app"), name="app", after=["db"]),
+        ]
+    )
+
+    with pytest.raises(RuntimeError, match="db failed"):
+        async with lifespans(FastAPI()):
+            pass
+
+    assert events == ["start log", "stop log"]
+
+
+@pytest.mark.asyncio
+async def test_startup_timeout():
+    lifespans = Lifespans(
+        [Lifespan(recording([], "slow", 5.0), name="slow", timeout=0.05)]
+    )
+
+    with pytest.raises(TimeoutError, match="slow did not start within 0.05s"):
+        async with lifespans(FastAPI()):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_shutdown_drains_work_in_flight():
+    events: list[str] = []
+    in_flight = InFlight()
+    in_flight.on_drain.append(lambda: events.append("stop consuming"))
+    lifespans = Lifespans([recording(events, "db")], in_flight=in_flight)
+
+    async def request():
+        with in_flight.track():
+            await asyncio.sleep(0.05)
+            events.append("request done")
+
+    async with lifespans(FastAPI()):
+        task = asyncio.create_task(request())
+        await asyncio.sleep(0)
+        # e.g. on SIGTERM, before the lifespans shut down
+        in_flight.start_draining()
+
+    await task
+    assert in_flight.draining
+    assert events == ["start db", "stop consuming", "request done", "stop db"]
+
+
+@pytest.mark.asyncio
+async def test_lifespans_stop_in_the_task_they_started_in():
+    events: list[str] = []
+
+    @contextlib.asynccontextmanager
+    async def scoped(app: FastAPI):
+        # cancel scopes can only be exited in the task that entered them
+        with anyio.CancelScope():
+            events.append("start")
+            yield
+        events.append("stop")
+
+    async with Lifespans([scoped], startup_timeout=1, shutdown_timeout=1)(FastAPI()):
+        pass
+
+    assert events == ["start", "stop"]
+
+
+def test_dependencies_must_be_listed_first():
+    with pytest.raises(ValueError, match="not listed before it"):
+        Lifespans([Lifespan(recording([], "app"), name="app", after=["db"])])
@@ -0,0 +1,104 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from types import SimpleNamespace
+
+os.environ.setdefault("NYLAS_CLIENT_ID", "test")
+os.environ.setdefault("NYLAS_API_KEY", "test")
+os.environ.setdefault("NYLAS_API_REGION_URI", "http://127.0.0.1")
+
+from src.common.logging import JsonLogSink  # noqa: E402
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "ERROR": 40}
+
+
+def message(level: str, text: str = "") -> SimpleNamespace:
+    return SimpleNamespace(
+        record={"level": SimpleNamespace(name=level, no=LEVELS[level]), "text": text}
+    )
+
+
+def full_sink(**kwargs) -> JsonLogSink:
+    """A sink with a full queue and no writer taking records off it"""
+    sink = JsonLogSink(queue_size=1, **kwargs)
+    # pretend the writer is running so the queue only fills up
+    sink._pid = os.getpid()
+    sink(message("INFO", "first"))
+    return sink
+
+
+def put_in_thread(sink: JsonLogSink, level: str) -> threading.Thread:
+    thread = threading.Thread(target=sink, args=(message(level, "waiting"),))
+    thread.start()
+    thread.join(0.1)
+    return thread
+
+
+def test_drop_debug_first_drops_debug_and_waits_for_the_rest():
+    sink = full_sink(overflow="drop_debug_first")
+
+    sink(message("DEBUG"))
+    assert sink.dropped == {"DEBUG": 1}
+
+    thread = put_in_thread(sink, "ERROR")
+    assert thread.is_alive()
+    sink.queue.get()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert sink.queue.get_nowait()["text"] == "waiting"
+
+
+def test_block_waits_for_room_at_every_level():
+    sink = full_sink(overflow="block")
+
+    thread = put_in_thread(sink, "DEBUG")
+    assert thread.is_alive()
+    sink.queue.get()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert not sink.dropped
+
+
+def test_sample_keeps_one_in_sample_rate():
+    sink = full_sink(overflow="sample", sample_rate=3)
+
+    sink(message("ERROR"))
+    sink(message("ERROR"))
+    assert sink.dropped == {"ERROR": 2}
+
+    # the third overflowing record is kept, it waits for room
+    thread = put_in_thread(sink, "ERROR")
+    assert thread.is_alive()
+    sink.queue.get()
+    thread.join(1)
+    assert sink.dropped == {"ERROR": 2}
+
+
+def test_records_are_written_when_the_process_exits():
+    # logged without a lifespan draining the sink, then exiting right away
+    script = """
+from loguru import logger
+from src.common.logging import JsonLogSink
+sink = JsonLogSink(flush_interval=60)
+logger.remove()
+logger.add(sink)
+logger.info("written by close")
+sink.close()
+# restarts the writer
+logger.error("startup failed")
+raise SystemExit(1)
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.join(os.path.dirname(__file__), ".."),
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+
+    assert result.returncode == 1
+    lines = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [line["msg"] for line in lines] == ["written by close", "startup failed"]
+    assert lines[1]["level"] == "ERROR"
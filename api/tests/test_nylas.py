@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+os.environ.setdefault("NYLAS_CLIENT_ID", "test")
+os.environ.setdefault("NYLAS_API_KEY", "test")
+os.environ.setdefault("NYLAS_API_REGION_URI", "http://127.0.0.1")
+
+from src.common.nylas import AsyncNylas, NylasApiError, verify_signature  # noqa: E402
+
+MESSAGE = {
+    "id": "m1",
+    "from": [{"email": "a@example.com", "name": "A"}],
+    "subject": "hello",
+    "created_at": 1700000000,
+}
+
+
+class StubNylas(ThreadingHTTPServer):
+    """Local stand-in for the Nylas API, answers with the queued (status, body)
+    pairs in order and then with the last one"""
+
+    def __init__(self, responses: list[tuple[int, dict]], delay: float = 0.0):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.responses = responses
+        self.delay = delay
+        self.requests: list[str] = []
+        self.active = self.peak = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server: StubNylas
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            status, body = server.responses[
+                min(len(server.requests), len(server.responses)) - 1
+            ]
+
+        time.sleep(server.delay)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        with server.lock:
+            server.active -= 1
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(responses, delay=0.0):
+        server = StubNylas(responses, delay)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.asyncio
+async def test_list_messages_retries_429_and_5xx(stub):
+    server = stub(
+        [
+            (503, {"error": "unavailable"}),
+            (429, {"error": "slow down"}),
+            (200, {"request_id": "r1", "data": [MESSAGE], "next_cursor": "c2"}),
+        ]
+    )
+    nylas = AsyncNylas("key", server.url, backoff=0.001)
+
+    messages = await nylas.list_messages("grant", {"limit": 10, "unread": "true"})
+    await nylas.aclose()
+
+    assert len(server.requests) == 3
+    assert server.requests[-1] == "/v3/grants/grant/messages?limit=10&unread=true"
+    assert messages.next_cursor == "c2"
+    assert messages.data[0].from_[0].email == "a@example.com"
+    assert messages.data[0].grant_id == "grant"
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried(stub):
+    server = stub([(404, {"error": "grant not found"})])
+    nylas = AsyncNylas("key", server.url, backoff=0.001)
+
+    with pytest.raises(NylasApiError) as error:
+        await nylas.list_messages("grant")
+    await nylas.aclose()
+
+    assert error.value.status_code == 404
+    assert len(server.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_timeouts_are_raised_as_api_errors(stub):
+    server = stub([(200, {"request_id": "r", "data": []})], delay=0.5)
+    nylas = AsyncNylas("key", server.url, timeout=0.05, retries=1, backoff=0.001)
+
+    with pytest.raises(NylasApiError) as error:
+        await nylas.list_messages("grant")
+    await nylas.aclose()
+
+    assert error.value.status_code == 504
+    assert len(server.requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_sends_are_not_repeated_after_a_timeout_or_5xx(stub):
+    to = [{"email": "b@example.com"}]
+    server = stub([(200, {"data": {"id": "m1"}})], delay=0.5)
+    nylas = AsyncNylas("key", server.url, timeout=0.05, backoff=0.001)
+
+    # nylas may have sent it, trying again could send it twice
+    with pytest.raises(NylasApiError) as error:
+        await nylas.send_message("grant", to, "subject", "body")
+    await nylas.aclose()
+    assert error.value.status_code == 504
+    assert server.requests == ["/v3/grants/grant/messages/send"]
+
+    server = stub([(502, {"error": "bad gateway"})])
+    nylas = AsyncNylas("key", server.url, backoff=0.001)
+    with pytest.raises(NylasApiError):
+        await nylas.send_message("grant", to, "subject", "body")
+    await nylas.aclose()
+    assert len(server.requests) == 1
+
+    # rejected, nothing was sent
+    server = stub([(429, {"error": "slow down"}), (200, {"data": {"id": "m1"}})])
+    nylas = AsyncNylas("key", server.url, backoff=0.001)
+    assert await nylas.send_message("grant", to, "subject", "body") == {"id": "m1"}
+    assert len(server.requests) == 2
+    await nylas.aclose()
+
+
+@pytest.mark.asyncio
+async def test_calls_per_grant_are_limited(stub):
+    server = stub([(200, {"request_id": "r", "data": []})], delay=0.05)
+    nylas = AsyncNylas("key", server.url, grant_concurrency=2)
+
+    await asyncio.gather(*(nylas.list_messages("grant") for _ in range(6)))
+    await nylas.aclose()
+
+    assert len(server.requests) == 6
+    assert server.peak <= 2
+
+
+@pytest.mark.asyncio
+async def test_message_pages_prefetch_the_next_page(stub):
+    server = stub(
+        [
+            (200, {"request_id": "r1", "data": [MESSAGE], "next_cursor": "c2"}),
+            (200, {"request_id": "r2", "data": [MESSAGE], "next_cursor": "c3"}),
+            (200, {"request_id": "r3", "data": [MESSAGE]}),
+        ]
+    )
+    nylas = AsyncNylas("key", server.url)
+
+    seen = []
+    async for page in nylas.message_pages("grant", {"limit": 1}):
+        # the next page is requested while this one is being consumed
+        await asyncio.sleep(0.1)
+        seen.append((page.request_id, len(server.requests)))
+    await nylas.aclose()
+
+    assert seen == [("r1", 2), ("r2", 3), ("r3", 3)]
+    assert server.requests[1:] == [
+        "/v3/grants/grant/messages?limit=1&page_token=c2",
+        "/v3/grants/grant/messages?limit=1&page_token=c3",
+    ]
+
+
+def test_webhook_signatures():
+    body = b'{"type": "grant.expired"}'
+    # hmac-sha256 of body with the secret "secret"
+    signature = hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+
+    assert verify_signature("secret", body, signature)
+    assert not verify_signature("other", body, signature)
+    assert not verify_signature("secret", body + b" ", signature)
+    assert not verify_signature("secret", body, "")
@@ -0,0 +1,236 @@
+import os
+
+import pytest
+
+os.environ.setdefault("NYLAS_CLIENT_ID", "test")
+os.environ.setdefault("NYLAS_API_KEY", "test")
+os.environ.setdefault("NYLAS_API_REGION_URI", "http://127.0.0.1")
+
+from src.common.scheduler import (  # noqa: E402
+    DueStatus,
+    MemoryDueQueue,
+    MemoryRateLimiter,
+    OutreachScheduler,
+    OutreachSend,
+    TemplateError,
+    Watermark,
+    render,
+)
+
+DAY = 24 * 60 * 60
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeStore:
+    """Statuses of one sequence (steps after 0, 2 and 5 days), all created at
+    start, by grant"""
+
+    def __init__(self, start: float, grants: dict[str, str]) -> None:
+        self.start = start
+        self.delays = [0, 2, 5]
+        self.grants = grants
+        self.steps = {status_id: 0 for status_id in grants}
+        self.active = {status_id: True for status_id in grants}
+        self.updated = {status_id: start for status_id in grants}
+
+    def due(self, status_id: str) -> DueStatus:
+        due_at = None
+        if self.active[status_id]:
+            due_at = self.start + self.delays[self.steps[status_id]] * DAY
+        return DueStatus(
+            status_id=status_id, updated_at=self.updated[status_id], due_at=due_at
+        )
+
+    def touch(self, status_id: str, when: float) -> None:
+        self.updated[status_id] = when
+
+    async def changed_since(
+        self, watermark: Watermark | None, limit: int, active_only: bool = False
+    ) -> list[DueStatus]:
+        rows = sorted(
+            (updated, status_id) for status_id, updated in self.updated.items()
+        )
+        rows = [row for row in rows if watermark is None or row > watermark]
+        if active_only:
+            rows = [row for row in rows if self.active[row[1]]]
+        return [self.due(status_id) for _, status_id in rows[:limit]]
+
+    async def load(self, status_ids: list[str]) -> list[OutreachSend]:
+        return [
+            OutreachSend(
+                status_id=status_id,
+                grant_id=self.grants[status_id],
+                to_email=f"{status_id}@example.com",
+                subject="Step {{ step }} for {{ first_name }}",
+                body="Hi {{first_name}}",
+                context={"first_name": status_id, "step": str(self.steps[status_id])},
+            )
+            for status_id in status_ids
+            if self.active[status_id]
+        ]
+
+    async def advance(self, status_id: str) -> DueStatus:
+        if self.steps[status_id] + 1 < len(self.delays):
+            self.steps[status_id] += 1
+        else:
+            self.active[status_id] = False
+        return self.due(status_id)
+
+
+class FakeSender:
+    def __init__(self, failing: set[str] | None = None) -> None:
+        self.sent: list[tuple[str, str, str]] = []
+        self.failing = failing or set()
+
+    async def send(self, grant_id, to_email, to_name, subject, body) -> None:
+        if to_email in self.failing:
+            raise RuntimeError("provider down")
+        self.sent.append((grant_id, to_email, subject))
+
+
+def scheduler(store, sender, clock, limit=10, batch_size=100):
+    return OutreachScheduler(
+        MemoryDueQueue(),
+        store,
+        sender,
+        MemoryRateLimiter(limit, 60),
+        clock=clock,
+        batch_size=batch_size,
+        page_size=2,
+        retry_delay=300,
+    )
+
+
+def test_render():
+    assert render("Hi {{ name }}!", {"name": "Ada"}) == "Hi Ada!"
+    with pytest.raises(TemplateError):
+        render("Hi {{ name }}", {})
+
+
+@pytest.mark.asyncio
+async def test_sequences_are_sent_step_by_step():
+    clock = Clock()
+    store = FakeStore(clock.now, {"a": "g1", "b": "g1", "c": "g2"})
+    sender = FakeSender()
+    engine = scheduler(store, sender, clock, batch_size=2)
+
+    assert await engine.rebuild() == 3
+    assert await engine.run_due() == 3
+    assert sorted(sent[2] for sent in sender.sent) == [
+        "Step 0 for a",
+        "Step 0 for b",
+        "Step 0 for c",
+    ]
+
+    # nothing is due until the second step
+    clock.now += DAY
+    assert await engine.run_due() == 0
+
+    clock.now += DAY
+    assert await engine.run_due() == 3
+    clock.now += 3 * DAY
+    assert await engine.run_due() == 3
+    assert len(sender.sent) == 9
+
+    # the sequence is over
+    clock.now += 30 * DAY
+    assert await engine.run_due() == 0
+    assert engine.queue.due == {}
+
+
+@pytest.mark.asyncio
+async def test_sends_are_rate_limited_per_grant():
+    clock = Clock()
+    store = FakeStore(clock.now, {"a": "g1", "b": "g1", "c": "g1", "d": "g2"})
+    sender = FakeSender()
+    engine = scheduler(store, sender, clock, limit=2)
+    await engine.rebuild()
+
+    assert await engine.run_due() == 3
+    assert {sent[0] for sent in sender.sent} == {"g1", "g2"}
+
+    # the third g1 send waits for the next window, the others are at step 2
+    assert engine.queue.due["c"] == 1_700_000_040
+    clock.now += 60
+    assert await engine.run_due() == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_sends_are_retried_and_leases_expire():
+    clock = Clock()
+    store = FakeStore(clock.now, {"a": "g1", "b": "g1"})
+    sender = FakeSender(failing={"a@example.com"})
+    engine = scheduler(store, sender, clock)
+    await engine.rebuild()
+
+    assert await engine.run_due() == 1
+    assert engine.queue.due["a"] == clock.now + 300
+
+    sender.failing.clear()
+    clock.now += 300
+    assert await engine.run_due() == 1
+
+    # a worker died holding a popped status, it comes back after the lease
+    await engine.queue.pop_due(clock.now + 2 * DAY, 10, lease=300)
+    assert engine.queue.leased
+    clock.now += 2 * DAY + 300
+    assert await engine.run_due() == 2
+
+
+@pytest.mark.asyncio
+async def test_rebuild_is_incremental():
+    clock = Clock()
+    store = FakeStore(clock.now, {"a": "g1", "b": "g1", "c": "g1", "d": "g1"})
+    store.active["d"] = False
+    engine = scheduler(store, FakeSender(), clock)
+
+    # without a watermark the first one is full, it reads the active ones only
+    assert await engine.rebuild() == 3
+    # the minute before the watermark is read again
+    assert await engine.rebuild() == 4
+
+    # deactivated (e.g. the candidate replied) two minutes later, read with
+    # the minute before the watermark
+    store.active["b"] = False
+    store.touch("b", clock.now + 120)
+    assert await engine.rebuild() == 4
+    assert set(engine.queue.due) == {"a", "c"}
+
+    # committed after b, with an older updated_at
+    store.active["c"] = False
+    store.touch("c", clock.now + 90)
+    assert await engine.rebuild() == 2
+    assert set(engine.queue.due) == {"a"}
+
+    # a full rebuild reads the active statuses only
+    assert await engine.rebuild(full=True) == 1
+
+
+@pytest.mark.asyncio
+async def test_rebuilds_leave_leased_statuses_alone():
+    clock = Clock()
+    store = FakeStore(clock.now, {"a": "g1"})
+    sender = FakeSender()
+    engine = scheduler(store, sender, clock)
+    await engine.rebuild(full=True)
+
+    # another worker rebuilds while "a" is being sent
+    send = sender.send
+
+    async def rebuilding_send(*args) -> None:
+        await engine.rebuild(full=True)
+        assert await engine.queue.pop_due(clock.now, 10, lease=300) == []
+        await send(*args)
+
+    sender.send = rebuilding_send  # type: ignore[method-assign]
+    assert await engine.run_due() == 1
+    # queued at the next step by the worker that sent it
+    assert engine.queue.due == {"a": clock.now + 2 * DAY}
+    assert not engine.queue.leased
@@ -0,0 +1,54 @@
+-- AlterTable
+ALTER TABLE "nylas_account" ADD COLUMN     "messages_synced_at" TIMESTAMP(3),
+ADD COLUMN     "messages_watermark" INTEGER;
+
+-- CreateTable
+CREATE TABLE "email_message" (
+    "id" TEXT NOT NULL,
+    "thread_id" TEXT,
+    "object" TEXT NOT NULL DEFAULT 'message',
+    "subject" TEXT,
+    "snippet" TEXT,
+    "body" TEXT,
+    "from" JSONB NOT NULL DEFAULT '[]',
+    "to" JSONB NOT NULL DEFAULT '[]',
+    "folders" TEXT[],
+    "unread" BOOLEAN NOT NULL DEFAULT false,
+    "starred" BOOLEAN NOT NULL DEFAULT false,
+    "has_attachments" BOOLEAN NOT NULL DEFAULT false,
+    "date" TIMESTAMP(3) NOT NULL,
+    "created_at" TIMESTAMP(3) NOT NULL,
+    "updated_at" TIMESTAMP(3) NOT NULL,
+    "nylas_account_id" TEXT NOT NULL,
+
+    CONSTRAINT "email_message_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateTable
+CREATE TABLE "email_attachment" (
+    "id" TEXT NOT NULL,
+    "nylas_id" TEXT NOT NULL,
+    "filename" TEXT,
+    "size" INTEGER,
+    "content_type" TEXT,
+    "is_inline" BOOLEAN,
+    "content_disposition" TEXT,
+    "message_id" TEXT NOT NULL,
+
+    CONSTRAINT "email_attachment_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE INDEX "email_message_nylas_account_id_date_idx" ON "email_message"("nylas_account_id", "date");
+
+-- CreateIndex
+CREATE INDEX "email_message_nylas_account_id_unread_date_idx" ON "email_message"("nylas_account_id", "unread", "date");
+
+-- CreateIndex
+CREATE UNIQUE INDEX "email_attachment_message_id_nylas_id_key" ON "email_attachment"("message_id", "nylas_id");
+
+-- AddForeignKey
+ALTER TABLE "email_message" ADD CONSTRAINT "email_message_nylas_account_id_fkey" FOREIGN KEY ("nylas_account_id") REFERENCES "nylas_account"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "email_attachment" ADD CONSTRAINT "email_attachment_message_id_fkey" FOREIGN KEY ("message_id") REFERENCES "email_message"("id") ON DELETE CASCADE ON UPDATE CASCADE;
@@ -0,0 +1,2 @@
+-- CreateIndex
+CREATE INDEX "nylas_account_user_id_deleted_at_expired_idx" ON "nylas_account"("user_id", "deleted_at", "expired");
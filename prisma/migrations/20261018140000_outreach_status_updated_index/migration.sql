@@ -0,0 +1,2 @@
+-- CreateIndex
+CREATE INDEX "outreach_status_updated_at_id_idx" ON "outreach_status"("updated_at", "id");